@@ -6,17 +6,107 @@ Arquitectura: Modular, async-aware, dopamina-optimizada, THREAD-SAFE
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import json
+import csv
+import io
 import os
+import base64
+import struct
+import zlib
+import hashlib
+import html
+import mmap
+import shutil
+import tempfile
+from array import array
+from itertools import chain, islice
 import time
 import threading
 import random
-from datetime import datetime, timedelta
+import re
+import uuid
+import heapq
+import unicodedata
+import bisect
+import argparse
+import asyncio
+import urllib.request
+from datetime import datetime, timedelta, date
 from collections import deque
 import webbrowser
 from typing import Dict, List, Optional, Callable
 import queue
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import numpy as np  # Opcional: escaneo vectorizado del archivo binario
+except ImportError:
+    np = None
+
+try:
+    import lzma  # Opcional: compresión más fuerte de las instantáneas
+except ImportError:
+    lzma = None
+
+try:
+    import fcntl  # Locks advisory entre procesos (POSIX)
+except ImportError:
+    fcntl = None
+
+
+class Clock:
+    """
+    Reloj de la app (inyectable)
+    Todo lo que depende de la hora pasa por aquí en lugar de llamar a
+    time/datetime directamente, así un SimulatedClock puede acelerarlo.
+    """
+    
+    def time(self) -> float:
+        return time.time()
+    
+    def monotonic(self) -> float:
+        return time.monotonic()
+    
+    def now(self) -> datetime:
+        return datetime.now()
+    
+    def today(self) -> date:
+        return date.today()
+    
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """Reloj virtual: solo avanza cuando se le pide (sleep no bloquea)"""
+    
+    def __init__(self, start: Optional[datetime] = None):
+        self._now = start or datetime.now()
+    
+    def time(self) -> float:
+        return self._now.timestamp()
+    
+    def monotonic(self) -> float:
+        return self._now.timestamp()
+    
+    def now(self) -> datetime:
+        return self._now
+    
+    def today(self) -> date:
+        return self._now.date()
+    
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+    
+    def advance(self, seconds: float):
+        self._now += timedelta(seconds=seconds)
+    
+    def advance_to(self, when: datetime):
+        if when > self._now:
+            self._now = when
 
 
 class DopamineRewardSystem:
@@ -55,13 +145,9 @@ class DopamineRewardSystem:
         self.achievements_unlocked = set()
         
     def register_session(self, minutes: int, quality: float = 1.0) -> Dict:
-        """Registra una sesión y calcula recompensas"""
+        """Registra una sesión y calcula recompensas (la racha va por días: update_streak)"""
         self.session_count += 1
         self.total_focus_minutes += minutes
-        self.current_streak += 1
-        
-        if self.current_streak > self.best_streak:
-            self.best_streak = self.current_streak
             
         # Sistema de recompensa variable (más adictivo que fijo)
         reward = {
@@ -84,10 +170,23 @@ class DopamineRewardSystem:
             
         return reward
     
+    @staticmethod
+    def session_quality(pauses: int) -> float:
+        """Calidad de una sesión según sus pausas (0.5 - 1.0)"""
+        return max(0.5, 1.0 - pauses * 0.1)
+        
     def break_streak(self):
         """Rompe la racha (cuando fallas un día)"""
         self.current_streak = 0
         
+    def update_streak(self, days: int, longest: int = 0):
+        """Sincroniza la racha (en días) con el índice de sesiones por día"""
+        if days == 0:
+            self.break_streak()
+        else:
+            self.current_streak = days
+        self.best_streak = max(self.best_streak, self.current_streak, longest)
+        
     def get_stats(self) -> Dict:
         return {
             'sessions': self.session_count,
@@ -98,6 +197,396 @@ class DopamineRewardSystem:
         }
 
 
+class SessionRecordFile:
+    """
+    Registro binario de ancho fijo de las sesiones archivadas
+    24 bytes por sesión (timestamp, duración, pausas, calidad, energía,
+    tarea) que se recorren con mmap + memoryview/struct, o numpy.memmap si
+    está instalado, sin construir un dict por sesión. Los textos de tarea
+    van en una tabla aparte (una etiqueta por línea; id = nº de línea).
+    """
+    
+    MAGIC = b'SFRB'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHH')          # magia, versión, tamaño de registro
+    RECORD = struct.Struct('<dHHfB3xi')      # ts, duración, pausas, calidad, energía, tarea
+    NUMPY_DTYPE = [('timestamp', '<f8'), ('duration', '<u2'), ('pauses', '<u2'),
+                   ('quality', '<f4'), ('energy', 'u1'), ('_pad', 'V3'), ('task', '<i4')]
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.labels_path = os.path.splitext(path)[0] + '_labels.jsonl'
+        self.labels: List[str] = []
+        self._label_ids: Dict[str, int] = {}
+        self._labels_offset = 0
+        if not os.path.exists(path) or os.path.getsize(path) < self.HEADER.size:
+            with open(path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size))
+        else:
+            with open(path, 'rb') as f:
+                self.check_header(f.read(self.HEADER.size), path)
+        self.refresh_labels()
+        
+    def __len__(self) -> int:
+        return (os.path.getsize(self.path) - self.HEADER.size) // self.RECORD.size
+    
+    @classmethod
+    def check_header(cls, header: bytes, path: str):
+        """ValueError si la cabecera no es de este formato (otra versión, otro tamaño de registro)"""
+        if len(header) < cls.HEADER.size:
+            raise ValueError(f"{path}: cabecera incompleta")
+        magic, version, size = cls.HEADER.unpack(header)
+        if (magic, version, size) != (cls.MAGIC, cls.VERSION, cls.RECORD.size):
+            raise ValueError(f"{path}: formato {magic!r} v{version} con registros de {size} B "
+                             f"(se esperaba {cls.MAGIC!r} v{cls.VERSION}, {cls.RECORD.size} B)")
+    
+    def refresh_labels(self):
+        if not os.path.exists(self.labels_path):
+            return
+        with open(self.labels_path, 'rb') as f:
+            f.seek(self._labels_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._labels_offset += len(line)
+                label = json.loads(line)
+                self._label_ids.setdefault(label, len(self.labels))
+                self.labels.append(label)
+                
+    def encode(self, session: Dict, new_labels: List[str]) -> bytes:
+        label = session.get('task', 'General')
+        task_id = self._label_ids.get(label)
+        if task_id is None:
+            task_id = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+            new_labels.append(label)
+        codes = list(TaskEnergyMatcher.ENERGY_LEVELS)
+        level = session.get('energy_level', 'medium')
+        return self.RECORD.pack(datetime.fromisoformat(session['timestamp']).timestamp(),
+                                min(session.get('duration', 0), 0xffff),
+                                min(session.get('pauses', 0), 0xffff),
+                                session.get('quality', 1.0),
+                                codes.index(level) if level in codes else 1,
+                                task_id)
+    
+    def append(self, sessions) -> int:
+        """Añade registros (las etiquetas nuevas se escriben antes que ellos)"""
+        self.refresh_labels()
+        new_labels = []
+        payload = b''.join(self.encode(s, new_labels) for s in sessions)
+        if new_labels:
+            with open(self.labels_path, 'ab') as f:
+                for label in new_labels:
+                    line = json.dumps(label).encode('utf-8') + b'\n'
+                    f.write(line)
+                    self._labels_offset += len(line)
+        if payload:
+            with open(self.path, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+        return len(payload) // self.RECORD.size
+    
+    @classmethod
+    def scan(cls, path: str, start: int = 0, end: Optional[int] = None):
+        """Tuplas de registros [start, end) leídas sobre el mmap (cero copias)"""
+        with open(path, 'rb') as f:
+            cls.check_header(f.read(cls.HEADER.size), path)
+            size = os.fstat(f.fileno()).st_size
+            count = (size - cls.HEADER.size) // cls.RECORD.size
+            end = count if end is None else min(end, count)
+            if start >= end:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)[cls.HEADER.size + start * cls.RECORD.size:
+                                      cls.HEADER.size + end * cls.RECORD.size]
+                records = cls.RECORD.iter_unpack(view)
+                try:
+                    yield from records
+                finally:
+                    del records
+                    view.release()
+                    
+    def as_array(self):
+        """numpy.memmap estructurado (None si numpy no está instalado o no hay datos)"""
+        if np is None or len(self) == 0:
+            return None
+        return np.memmap(self.path, dtype=np.dtype(self.NUMPY_DTYPE), mode='r',
+                         offset=self.HEADER.size, shape=(len(self),))
+    
+    def session_dict(self, record: tuple) -> Dict:
+        """Registro -> dict mínimo, solo para quien de verdad lo necesita"""
+        ts, duration, pauses, quality, energy, task_id = record
+        return {
+            'timestamp': datetime.fromtimestamp(ts).isoformat(),
+            'duration': duration,
+            'task': self.labels[task_id] if 0 <= task_id < len(self.labels) else 'General',
+            'pauses': pauses,
+            'quality': round(quality, 4),
+            'energy_level': list(TaskEnergyMatcher.ENERGY_LEVELS)[energy]
+        }
+    
+    @classmethod
+    def convert_json(cls, source: str, target: str) -> int:
+        """Convierte las sesiones de un fichero de datos (o un .jsonl) a registros"""
+        if source.endswith('.jsonl'):
+            with open(source, 'r') as f:
+                sessions = [json.loads(line) for line in f if line.strip()]
+        else:
+            sessions = [payload for kind, payload in SnapshotFile.iter_records(source)
+                        if kind == 'session']
+        return cls(target).append(sessions)
+    
+    @classmethod
+    def benchmark(cls, n: int = 100000) -> str:
+        """Compara escanear minutos por energía: JSON vs. JSONL vs. mmap (vs. numpy)"""
+        codes = list(TaskEnergyMatcher.ENERGY_LEVELS)
+        base = datetime.now() - timedelta(days=n // 10)
+        sessions = [{'timestamp': (base + timedelta(minutes=37 * i)).isoformat(),
+                     'duration': random.choice([5, 10, 15, 25]), 'task': f"Tarea {i % 300}",
+                     'pauses': random.randint(0, 3), 'quality': 0.9,
+                     'energy_level': random.choice(codes)} for i in range(n)]
+        workdir = tempfile.mkdtemp(prefix='studyflow_bench_')
+        json_path = os.path.join(workdir, 'data.json')
+        jsonl_path = os.path.join(workdir, 'archive.jsonl')
+        with open(json_path, 'w') as f:
+            json.dump({'sessions': sessions}, f, indent=2)
+        with open(jsonl_path, 'w') as f:
+            for session in sessions:
+                f.write(json.dumps(session) + '\n')
+        records = cls(os.path.join(workdir, 'archive.bin'))
+        records.append(sessions)
+        del sessions
+        
+        def timed(label: str, func) -> str:
+            started = time.perf_counter()
+            totals = func()
+            return f"{label:18} {time.perf_counter() - started:8.4f}s  {totals}"
+        
+        def scan_json():
+            totals = dict.fromkeys(codes, 0)
+            with open(json_path) as f:
+                for s in json.load(f)['sessions']:
+                    totals[s['energy_level']] += s['duration']
+            return totals
+        
+        def scan_jsonl():
+            totals = dict.fromkeys(codes, 0)
+            with open(jsonl_path) as f:
+                for line in f:
+                    s = json.loads(line)
+                    totals[s['energy_level']] += s['duration']
+            return totals
+        
+        def scan_mmap():
+            minutes = [0] * len(codes)
+            for _, duration, _, _, energy, _ in cls.scan(records.path):
+                minutes[energy] += duration
+            return dict(zip(codes, minutes))
+        
+        lines = [f"{n} sesiones • binario {os.path.getsize(records.path)} B • "
+                 f"JSON {os.path.getsize(json_path)} B",
+                 timed("json (indent=2)", scan_json),
+                 timed("jsonl", scan_jsonl),
+                 timed("mmap + struct", scan_mmap)]
+        if np is not None:
+            def scan_numpy():
+                arr = records.as_array()
+                minutes = np.bincount(arr['energy'], weights=arr['duration'], minlength=len(codes))
+                return dict(zip(codes, minutes.astype(int).tolist()))
+            lines.append(timed("numpy.memmap", scan_numpy))
+        shutil.rmtree(workdir, ignore_errors=True)
+        return '\n'.join(lines)
+
+
+class SessionArchive:
+    """
+    Archivo de sesiones antiguas (una sesión JSON por línea, solo se añade)
+    En RAM queda solo la ventana reciente; lo archivado se pagina desde disco
+    al iterar. Para deduplicar basta un hash de 8 bytes por sesión, en un
+    array ordenado (bisect), así la memoria no crece con los dicts.
+    En paralelo se mantiene el registro binario (línea i = registro i) para
+    los escaneos que no necesitan la sesión completa.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._offset = 0            # Bytes ya leídos (para leer solo lo nuevo)
+        self._hashes = array('q')
+        records_path = os.path.splitext(path)[0] + '.bin'
+        try:
+            self.records = SessionRecordFile(records_path)
+        except ValueError as e:
+            # Es derivado del JSONL: uno de otro formato se rehace entero
+            print(f"Error en el archivo binario (se regenera): {e}")
+            for derived in (records_path, os.path.splitext(records_path)[0] + '_labels.jsonl'):
+                if os.path.exists(derived):
+                    os.remove(derived)
+            self.records = SessionRecordFile(records_path)
+        self.refresh()
+        
+    @staticmethod
+    def _hash(uid: str) -> int:
+        return int.from_bytes(hashlib.blake2b(uid.encode('utf-8'), digest_size=8).digest(),
+                              'big', signed=True)
+        
+    def refresh(self):
+        """Incorpora lo añadido desde la última lectura (también por otra instancia)"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size < self._offset:  # Reemplazado: empezar de cero
+            self.count, self._offset, self._hashes = 0, 0, array('q')
+        if size == self._offset:
+            return
+        new = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Línea a medio escribir
+                self._offset += len(line)
+                try:
+                    uid = json.loads(line).get('uid')
+                except ValueError:
+                    continue
+                self.count += 1
+                if uid:
+                    new.append(self._hash(uid))
+        if new:
+            self._hashes = array('q', sorted(chain(self._hashes, new)))
+        self._catch_up_records()
+        
+    def _catch_up_records(self):
+        """Completa el binario si va por detrás del JSONL (archivos previos, cortes)"""
+        behind = len(self.records)
+        if behind > self.count:  # Binario de otro archivo: rehacer
+            os.remove(self.records.path)
+            self.records = SessionRecordFile(self.records.path)
+            behind = 0
+        if behind < self.count:
+            pending = (s for i, s in enumerate(self.iter_sessions()) if i >= behind)
+            self.records.append(list(pending))
+            
+    def contains(self, uid: str) -> bool:
+        h = self._hash(uid)
+        i = bisect.bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+    
+    def append(self, sessions: List[Dict]) -> int:
+        """Añade (sin duplicar) y sincroniza a disco antes de que se borren de RAM"""
+        fresh = [s for s in sessions if not self.contains(s['uid'])]
+        if fresh:
+            with open(self.path, 'ab') as f:
+                for session in fresh:
+                    f.write(json.dumps(session).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()  # También añade los registros binarios
+        return len(fresh)
+    
+    def iter_sessions(self):
+        """Recorre lo archivado línea a línea: memoria constante"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+                    
+    def find(self, uid: str) -> Optional[Dict]:
+        if not self.contains(uid):
+            return None
+        return next((s for s in self.iter_sessions() if s.get('uid') == uid), None)
+
+
+class DaySessionIndex:
+    """
+    Índice de sesiones por día del calendario
+    Racha actual, minutos de un día y racha más larga en O(1): cada día nuevo
+    une su racha con la de ayer y la de mañana guardando la longitud solo en
+    los extremos del intervalo (sirve aunque lleguen días viejos por sync).
+    """
+    
+    def __init__(self, state: Optional[Dict] = None):
+        self.days: Dict[int, List[int]] = {}   # ordinal -> [sesiones, minutos]
+        self._run_at: Dict[int, int] = {}      # extremo de racha -> longitud
+        self.longest_run = 0
+        for iso, bucket in (state or {}).get('days', {}).items():
+            day = date.fromisoformat(iso).toordinal()
+            self.days[day] = list(bucket)
+            self._link(day)
+            
+    def add(self, session: Dict):
+        self.add_minutes(datetime.fromisoformat(session['timestamp']).date(), session.get('duration', 0))
+        
+    def add_minutes(self, day_date: date, minutes: int):
+        day = day_date.toordinal()
+        bucket = self.days.get(day)
+        if bucket is None:
+            bucket = self.days[day] = [0, 0]
+            self._link(day)
+        bucket[0] += 1
+        bucket[1] += minutes
+        
+    def remove(self, session: Dict):
+        """Quita una sesión (deshacer); si el día queda vacío, parte su racha"""
+        day = datetime.fromisoformat(session['timestamp']).date().toordinal()
+        bucket = self.days.get(day)
+        if bucket is None:
+            return
+        bucket[0] -= 1
+        bucket[1] -= session.get('duration', 0)
+        if bucket[0] > 0:
+            return
+        # Caso raro: recorrer la racha hasta sus extremos es O(su longitud)
+        start, end = day, day
+        while start - 1 in self.days:
+            start -= 1
+        while end + 1 in self.days:
+            end += 1
+        del self.days[day]
+        self._run_at.pop(day, None)
+        if start < day:
+            self._run_at[start] = self._run_at[day - 1] = day - start
+        if end > day:
+            self._run_at[day + 1] = self._run_at[end] = end - day
+        # Los inicios de racha siempre guardan su longitud correcta
+        self.longest_run = max((n for d, n in self._run_at.items()
+                                if d in self.days and d - 1 not in self.days), default=0)
+        
+    def _link(self, day: int):
+        # Si day-1 existe es necesariamente el final de su racha (y day+1 el inicio)
+        left = self._run_at.get(day - 1, 0) if day - 1 in self.days else 0
+        right = self._run_at.get(day + 1, 0) if day + 1 in self.days else 0
+        length = left + 1 + right
+        self._run_at[day - left] = length
+        self._run_at[day + right] = length
+        self.longest_run = max(self.longest_run, length)
+        
+    def current_streak(self, today: date) -> int:
+        """Días seguidos hasta hoy (o hasta ayer, si hoy aún no has estudiado)"""
+        for end in (today.toordinal(), today.toordinal() - 1):
+            if end in self.days and end + 1 not in self.days:
+                return self._run_at[end]
+        return 0
+    
+    def sessions_on(self, day: date) -> int:
+        return self.days.get(day.toordinal(), (0, 0))[0]
+    
+    def minutes_on(self, day: date) -> int:
+        return self.days.get(day.toordinal(), (0, 0))[1]
+    
+    def to_state(self) -> Dict:
+        return {'days': {date.fromordinal(d).isoformat(): b for d, b in self.days.items()}}
+
+
 class TaskEnergyMatcher:
     """
     Empareja tareas con tu nivel de energía actual
@@ -111,16 +600,24 @@ class TaskEnergyMatcher:
         'minimal': {'color': '#ff6b6b', 'icon': '🌱', 'duration': 5}
     }
     
-    def __init__(self):
+    def __init__(self, model: Optional['DurationModel'] = None, clock: Optional[Clock] = None):
         self.current_energy = 'medium'
+        self.model = model   # Si hay historial, la duración sale de lo aprendido
+        self.clock = clock or Clock()
         
     def set_energy(self, level: str):
         if level in self.ENERGY_LEVELS:
             self.current_energy = level
             
     def get_recommended_duration(self) -> int:
+        if self.model is not None:
+            return self.model.recommend(self.current_energy, self.clock.now().hour)
         return self.ENERGY_LEVELS[self.current_energy]['duration']
     
+    @classmethod
+    def default_durations(cls) -> Dict[str, int]:
+        return {level: info['duration'] for level, info in cls.ENERGY_LEVELS.items()}
+    
     def get_task_suggestion(self, task_difficulty: str) -> str:
         """Sugiere si hacer la tarea ahora o posponer"""
         energy_map = {
@@ -138,46 +635,113 @@ class TaskEnergyMatcher:
             return "adapt"
 
 
+class DurationModel:
+    """
+    Duración recomendada aprendida por nivel de energía y hora del día
+    Medias exponenciales (EWMA) de los minutos "sostenibles" de cada sesión
+    (duración escalada por su calidad y pausas), por nivel y por celda
+    nivel x hora. Cada celda se encoge hacia su nivel, y el nivel hacia la
+    duración por defecto, según cuántas sesiones tenga. Actualizar es O(1)
+    (más las 24 entradas de la fila en la tabla); recomendar es una lectura.
+    """
+    
+    ALPHA = 0.2              # Peso de la sesión nueva (con pocas sesiones, más)
+    PRIOR = 3                # Sesiones "virtuales" del valor de arriba al encoger
+    TARGET_QUALITY = 0.85    # Por encima alarga, por debajo acorta
+    PAUSE_PENALTY = 0.05
+    MIN_MINUTES, MAX_MINUTES = 5, 50
+    
+    def __init__(self, defaults: Dict[str, int], state: Optional[Dict] = None):
+        self.defaults = dict(defaults)
+        self.levels = {level: [float(d), 0] for level, d in self.defaults.items()}   # [media, n]
+        self.cells = {level: [[float(d), 0] for _ in range(24)] for level, d in self.defaults.items()}
+        for level, stat in (state or {}).get('levels', {}).items():
+            if level in self.levels:
+                self.levels[level] = [float(stat[0]), int(stat[1])]
+        for level, row in (state or {}).get('cells', {}).items():
+            if level in self.cells and len(row) == 24:
+                self.cells[level] = [[float(mean), int(n)] for mean, n in row]
+        self.table = {level: [0] * 24 for level in self.defaults}   # level -> hora -> minutos
+        for level in self.defaults:
+            self._refresh(level)
+            
+    def sustainable(self, duration: float, quality: float, pauses: int) -> float:
+        """Minutos que la sesión sugiere aguantar (una buena alarga, una mala acorta)"""
+        factor = min(1.25, max(0.6, quality / self.TARGET_QUALITY - self.PAUSE_PENALTY * pauses))
+        return duration * factor
+    
+    def update(self, level: str, hour: int, duration: float, quality: float, pauses: int = 0):
+        if level not in self.levels or not 0 <= hour < 24:
+            return
+        x = self.sustainable(duration, quality, pauses)
+        for stat in (self.levels[level], self.cells[level][hour]):
+            alpha = max(self.ALPHA, 1.0 / (stat[1] + 1))
+            stat[0] += alpha * (x - stat[0])
+            stat[1] += 1
+        self._refresh(level)   # La media del nivel entra en las 24 horas
+        
+    def _refresh(self, level: str):
+        mean, n = self.levels[level]
+        level_estimate = (n * mean + self.PRIOR * self.defaults[level]) / (n + self.PRIOR)
+        row = self.table[level]
+        for hour, (cell_mean, cell_n) in enumerate(self.cells[level]):
+            estimate = (cell_n * cell_mean + self.PRIOR * level_estimate) / (cell_n + self.PRIOR)
+            row[hour] = int(round(min(self.MAX_MINUTES, max(self.MIN_MINUTES, estimate))))
+            
+    def recommend(self, level: str, hour: int) -> int:
+        return self.table[level][hour]
+    
+    def to_state(self) -> Dict:
+        return {'levels': {level: [round(m, 3), n] for level, (m, n) in self.levels.items()},
+                'cells': {level: [[round(m, 3), n] for m, n in row] for level, row in self.cells.items()}}
+
+
 class FocusGuardian:
     """
     Sistema anti-distracción proactivo - VERSION THREAD-SAFE
     Usa una cola para comunicarse con el hilo principal de Tkinter
     """
     
-    def __init__(self, message_queue: queue.Queue):
+    def __init__(self, message_queue: queue.Queue, clock: Optional[Clock] = None):
         self.message_queue = message_queue
+        self.clock = clock or Clock()
         self.check_interval = 30  # segundos
-        self.last_interaction = time.time()
+        self.last_interaction = self.clock.time()
         self.is_monitoring = False
         self.distraction_count = 0
         self._timer = None
         
     def start_monitoring(self):
         self.is_monitoring = True
-        self.last_interaction = time.time()
+        self.last_interaction = self.clock.time()
         self._monitor_loop()
         
     def register_interaction(self):
         """Llama esto cuando el usuario interactúa"""
-        self.last_interaction = time.time()
+        self.last_interaction = self.clock.time()
         self.distraction_count = 0
         
-    def _monitor_loop(self):
-        if not self.is_monitoring:
-            return
-            
-        idle_time = time.time() - self.last_interaction
+    def check(self):
+        """Una revisión (sin programar la siguiente: el simulador la llama a mano)"""
+        idle_time = self.clock.time() - self.last_interaction
         
         # Niveles de intervención
         if idle_time > 120:  # 2 minutos sin actividad
             self.distraction_count += 1
             # Enviar mensaje a la cola en lugar de llamar directamente
-            self.message_queue.put(('severe', f"¡Distraído por {int(idle_time/60)} min! ¿Volvemos?"))
-            self.last_interaction = time.time()  # Reset para no spamear
+            self.message_queue.put(('severe', (f"¡Distraído por {int(idle_time/60)} min! ¿Volvemos?",
+                                               idle_time)))
+            self.last_interaction = self.clock.time()  # Reset para no spamear
             
         elif idle_time > 60:  # 1 minuto
             if self.distraction_count == 0:
-                self.message_queue.put(('mild', "¿Sigues ahí? Un click y volvemos al flow"))
+                self.message_queue.put(('mild', ("¿Sigues ahí? Un click y volvemos al flow", idle_time)))
+                
+    def _monitor_loop(self):
+        if not self.is_monitoring:
+            return
+            
+        self.check()
                 
         # Programar siguiente revisión
         if self.is_monitoring:
@@ -191,6 +755,211 @@ class FocusGuardian:
             self._timer.cancel()
 
 
+class TimerTelemetry:
+    """
+    Precisión del countdown de una sesión
+    El countdown cuenta iteraciones de sleep(1); aquí se mide cuánto duró de
+    verdad (pared y monotónico, descontando pausas), el peor retraso de un
+    tick y cuántos repintados llegaron tarde al hilo de Tk.
+    """
+    
+    LATE_UI = 0.25   # Segundos entre programar un repintado y que Tk lo ejecute
+    
+    def __init__(self, planned: int, clock: Optional[Clock] = None):
+        self.planned = planned
+        self.clock = clock or Clock()
+        self._wall_start = self.clock.time()
+        self._mono_start = self.clock.monotonic()
+        self._last_tick = self._mono_start
+        self._paused_at: Optional[tuple] = None
+        self.paused_wall = 0.0
+        self.paused_mono = 0.0
+        self.max_tick_late = 0.0
+        self.late_ui = 0
+        
+    def tick(self) -> float:
+        """Hilo del countdown: tras cada sleep(1); devuelve el instante monotónico"""
+        now = self.clock.monotonic()
+        self.max_tick_late = max(self.max_tick_late, now - self._last_tick - 1.0)
+        self._last_tick = now
+        return now
+    
+    def ui_updated(self, scheduled: float):
+        """Hilo de Tk: el repintado programado en `scheduled` acaba de ejecutarse"""
+        if self.clock.monotonic() - scheduled > self.LATE_UI:
+            self.late_ui += 1
+            
+    def pause(self):
+        self._paused_at = (self.clock.time(), self.clock.monotonic())
+        
+    def resume(self):
+        if self._paused_at is not None:
+            wall, mono = self._paused_at
+            self.paused_wall += self.clock.time() - wall
+            self.paused_mono += self.clock.monotonic() - mono
+            self._paused_at = None
+        self._last_tick = self.clock.monotonic()   # La pausa no cuenta como retraso
+        
+    def summary(self) -> Dict:
+        """Para el registro de la sesión (segundos, sin pausas)"""
+        return {
+            'planned': self.planned,
+            'wall': round(self.clock.time() - self._wall_start - self.paused_wall, 2),
+            'mono': round(self.clock.monotonic() - self._mono_start - self.paused_mono, 2),
+            'max_tick_late': round(max(0.0, self.max_tick_late), 3),
+            'late_ui': self.late_ui
+        }
+    
+    @staticmethod
+    def aggregate(timings: List[Dict]) -> Optional[Dict]:
+        """Resumen de varias sesiones para el diagnóstico"""
+        timings = [t for t in timings if isinstance(t, dict) and 'planned' in t and 'mono' in t]
+        if not timings:
+            return None
+        drifts = [t['mono'] - t['planned'] for t in timings]
+        return {
+            'sessions': len(timings),
+            'drift_mean': round(sum(drifts) / len(drifts), 2),
+            'drift_max': round(max(drifts), 2),
+            'wall_vs_mono_max': round(max(abs(t.get('wall', t['mono']) - t['mono']) for t in timings), 2),
+            'tick_late_max': max(t.get('max_tick_late', 0) for t in timings),
+            'late_ui': sum(t.get('late_ui', 0) for t in timings)
+        }
+
+
+class FocusTrace:
+    """
+    Traza de eventos de una sesión en un buffer circular de tamaño fijo
+    Pausas, reanudaciones, avisos leves/fuertes del FocusGuardian (con los
+    segundos de inactividad) y cambios de tarea. Se guarda como varints con
+    el tiempo en delta respecto al evento anterior: unos pocos bytes por
+    sesión. Los acumulados (pausado, distraído) se llevan al registrar, así
+    la calidad es exacta aunque el buffer haya descartado los más viejos.
+    """
+    
+    EVENTS = ('pause', 'resume', 'mild', 'severe', 'task_switch')
+    WITH_VALUE = ('mild', 'severe')   # Llevan los segundos de inactividad
+    CAPACITY = 64
+    
+    def __init__(self, start: float, capacity: int = CAPACITY):
+        self.start = start
+        self.capacity = capacity
+        self._codes = array('B', bytes(capacity))
+        self._offsets = array('I', bytes(4 * capacity))   # Segundos desde el inicio
+        self._values = array('I', bytes(4 * capacity))
+        self._next = 0
+        self.count = 0      # Eventos retenidos
+        self.dropped = 0    # Pisados por el buffer circular
+        self.paused = 0.0
+        self.distracted = 0.0
+        self._paused_at: Optional[float] = None
+        self._idle_pending = 0   # Aviso leve que aún puede acabar en uno fuerte
+        self._idle_since: Optional[float] = None   # Inicio del tramo inactivo de ese aviso
+        
+    def record(self, event: str, at: float, value: int = 0):
+        i = self._next
+        self._codes[i] = self.EVENTS.index(event)
+        self._offsets[i] = max(0, int(at - self.start))
+        self._values[i] = max(0, int(value))
+        self._next = (i + 1) % self.capacity
+        if self.count == self.capacity:
+            self.dropped += 1
+        else:
+            self.count += 1
+            
+        if event == 'pause':
+            self._paused_at = at
+        elif event == 'resume' and self._paused_at is not None:
+            self.paused += at - self._paused_at
+            self._paused_at = None
+        if event in self.WITH_VALUE:
+            # Mismo tramo si empieza donde el del aviso pendiente (el valor son los
+            # segundos desde la última interacción); si no, el pendiente ya terminó
+            since = at - value
+            if self._idle_since is None or abs(since - self._idle_since) > 1.0:
+                self.distracted += self._idle_pending
+            if event == 'mild':
+                self._idle_pending = value
+                self._idle_since = since
+            else:
+                self.distracted += value   # Abarca el tramo del aviso leve, si es el mismo
+                self._idle_pending = 0
+                self._idle_since = None
+        else:
+            self.distracted += self._idle_pending
+            self._idle_pending = 0
+            self._idle_since = None
+            
+    def quality(self, at: float) -> float:
+        """Fracción del tiempo de pared realmente enfocado (sin pausas ni inactividad)"""
+        wall = at - self.start
+        if wall <= 0:
+            return 1.0
+        paused = self.paused + (at - self._paused_at if self._paused_at is not None else 0)
+        focused = wall - paused - self.distracted - self._idle_pending
+        return round(min(1.0, max(0.0, focused / wall)), 3)
+    
+    def events(self):
+        """(evento, segundos desde el inicio, valor), del más viejo al más nuevo"""
+        first = (self._next - self.count) % self.capacity
+        for k in range(self.count):
+            i = (first + k) % self.capacity
+            yield self.EVENTS[self._codes[i]], self._offsets[i], self._values[i]
+            
+    @staticmethod
+    def _put_varint(out: bytearray, n: int):
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+        
+    @staticmethod
+    def _get_varint(data: bytes, pos: int) -> tuple:
+        n = shift = 0
+        while True:
+            byte = data[pos]   # IndexError si está truncado
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return n, pos
+            shift += 7
+            
+    def encode(self) -> bytes:
+        """varint descartados, y por evento varint((delta << 3) | código) [+ varint valor]"""
+        out = bytearray()
+        self._put_varint(out, self.dropped)
+        previous = 0
+        for event, offset, value in self.events():
+            self._put_varint(out, (max(0, offset - previous) << 3) | self.EVENTS.index(event))
+            if event in self.WITH_VALUE:
+                self._put_varint(out, value)
+            previous = offset
+        return bytes(out)
+    
+    def to_text(self) -> str:
+        """Para el registro JSON de la sesión"""
+        return base64.b64encode(self.encode()).decode('ascii')
+    
+    @classmethod
+    def decode(cls, text: str) -> tuple:
+        """(descartados, [(evento, segundos desde el inicio, valor)]); ValueError si no es válida"""
+        try:
+            data = base64.b64decode(text, validate=True)
+            dropped, pos = cls._get_varint(data, 0)
+            events, offset = [], 0
+            while pos < len(data):
+                head, pos = cls._get_varint(data, pos)
+                offset += head >> 3
+                event = cls.EVENTS[head & 0x7]
+                value = 0
+                if event in cls.WITH_VALUE:
+                    value, pos = cls._get_varint(data, pos)
+                events.append((event, offset, value))
+        except (TypeError, IndexError, ValueError) as e:   # binascii.Error es ValueError
+            raise ValueError(f"traza ilegible: {e}")
+        return dropped, events
+
+
 class BodyDoublingRoom:
     """
     Simulación de "body doubling" (estudiar con alguien más)
@@ -228,14 +997,2702 @@ class BodyDoublingRoom:
         return None
 
 
+class TaskSearchIndex:
+    """
+    Índice invertido incremental sobre el texto de las tareas
+    Sin acentos ("álgebra" encuentra "algebra") y por prefijo, para filtrar
+    mientras se escribe: cada término busca su rango en el vocabulario
+    ordenado (bisect) y se intersectan los uids empezando por el más pequeño.
+    Los prefijos cortos (las primeras teclas, los más caros de unir) se
+    mantienen materializados.
+    """
+    
+    _WORD_RE = re.compile(r'\w+')
+    SHORT_PREFIX = 2
+    
+    def __init__(self):
+        self._postings: Dict[str, set] = {}      # token -> uids
+        self._short: Dict[str, set] = {}         # prefijo corto -> uids
+        self._vocab: List[str] = []              # tokens ordenados
+        self._tokens_by_uid: Dict[str, tuple] = {}
+        self._prefix_cache: Dict[str, frozenset] = {}
+        
+    @staticmethod
+    def fold(text: str) -> str:
+        """Minúsculas y sin diacríticos (á->a, ñ->n, ü->u)"""
+        decomposed = unicodedata.normalize('NFKD', text.lower())
+        return ''.join(c for c in decomposed if not unicodedata.combining(c))
+    
+    def tokenize(self, text: str) -> tuple:
+        return tuple(set(self._WORD_RE.findall(self.fold(text))))
+    
+    def add(self, uid: str, text: str):
+        """Indexa (o re-indexa tras una edición) una tarea"""
+        tokens = self.tokenize(text)
+        old = self._tokens_by_uid.get(uid)
+        if old == tokens:
+            return
+        if old is not None:
+            self.remove(uid)
+        self._tokens_by_uid[uid] = tokens
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = set()
+                bisect.insort(self._vocab, token)
+            posting.add(uid)
+        for prefix in self._short_prefixes(tokens):
+            self._short.setdefault(prefix, set()).add(uid)
+        self._prefix_cache.clear()
+        
+    def remove(self, uid: str):
+        tokens = self._tokens_by_uid.pop(uid, ())
+        for token in tokens:
+            posting = self._postings[token]
+            posting.discard(uid)
+            if not posting:
+                del self._postings[token]
+                del self._vocab[bisect.bisect_left(self._vocab, token)]
+        for prefix in self._short_prefixes(tokens):
+            short = self._short[prefix]
+            short.discard(uid)
+            if not short:
+                del self._short[prefix]
+        self._prefix_cache.clear()
+        
+    def _short_prefixes(self, tokens: tuple) -> set:
+        return {t[:n] for t in tokens for n in range(1, self.SHORT_PREFIX + 1) if len(t) >= n}
+        
+    def _prefix_matches(self, prefix: str):
+        if len(prefix) <= self.SHORT_PREFIX:
+            return self._short.get(prefix, frozenset())
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            return cached
+        lo = bisect.bisect_left(self._vocab, prefix)
+        hi = bisect.bisect_left(self._vocab, prefix + '\uffff')
+        if hi - lo == 1:
+            result = frozenset(self._postings[self._vocab[lo]])
+        else:
+            result = frozenset().union(*(self._postings[t] for t in self._vocab[lo:hi]))
+        self._prefix_cache[prefix] = result
+        return result
+    
+    def search(self, query: str):
+        """uids cuyas palabras empiezan por TODOS los términos (solo lectura)"""
+        terms = self._WORD_RE.findall(self.fold(query))
+        if not terms:
+            return frozenset(self._tokens_by_uid)
+        sets = sorted((self._prefix_matches(t) for t in set(terms)), key=len)
+        result = sets[0]
+        for other in sets[1:]:
+            if not result:
+                break
+            result = result & other
+        return result
+
+
+class TaskTree:
+    """
+    Proyectos y subtareas (campo 'parent' de la tarea = uid del padre)
+    Cada nodo guarda su aporte propio y el acumulado de su subárbol:
+    hechas, pendientes, minutos de foco y sesiones. Completar, borrar, mover
+    una tarea o registrar una sesión suma la diferencia solo a lo largo de
+    sus ancestros: refrescar el progreso de un proyecto es O(profundidad).
+    """
+    
+    DONE, PENDING, MINUTES, SESSIONS = range(4)
+    MAX_DEPTH = 16   # Niveles de una rama; un padre que la alargaría (o formaría un ciclo) se ignora
+    
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+        self.children: Dict[str, set] = {}
+        self.own: Dict[str, List[int]] = {}
+        self.totals: Dict[str, List[int]] = {}
+        
+    def _node(self, uid: str) -> List[int]:
+        """Nodo vacío si aún no existe (un padre puede llegar por sync después del hijo)"""
+        if uid not in self.own:
+            self.own[uid] = [0, 0, 0, 0]
+            self.totals[uid] = [0, 0, 0, 0]
+        return self.own[uid]
+    
+    def path(self, uid: Optional[str]):
+        """El nodo y sus ancestros, hasta la raíz"""
+        while uid is not None:
+            yield uid
+            uid = self.parent.get(uid)
+            
+    def _propagate(self, uid: Optional[str], delta: List[int]):
+        for node in self.path(uid):
+            totals = self.totals[node]
+            for i, value in enumerate(delta):
+                totals[i] += value
+                
+    def _height(self, uid: str, limit: int) -> int:
+        """Niveles del subárbol de `uid` (él incluido); deja de bajar pasado `limit`"""
+        level, height = [uid], 0
+        while level and height <= limit:
+            height += 1
+            level = [child for node in level for child in self.children.get(node, ())]
+        return height
+    
+    def _valid_parent(self, uid: str, parent) -> Optional[str]:
+        """El padre si cabe: sin ciclo y con ancestros + subárbol movido <= MAX_DEPTH"""
+        if not isinstance(parent, str) or parent == uid:
+            return None
+        self._node(parent)
+        ancestors = list(islice(self.path(parent), self.MAX_DEPTH))
+        if uid in ancestors:
+            return None
+        # El subárbol cuenta: al cargar, un hijo puede haberse colgado antes que su padre
+        if len(ancestors) + self._height(uid, self.MAX_DEPTH - len(ancestors)) > self.MAX_DEPTH:
+            return None
+        return parent
+    
+    def set_task(self, task: Dict):
+        """Alta, cambio, borrado (lápida) o cambio de padre de una tarea"""
+        uid = task['uid']
+        own = self._node(uid)
+        old_parent = self.parent.get(uid)
+        # Un enlace aceptado sigue siendo válido: solo se comprueba si el padre cambia
+        parent = (old_parent if old_parent is not None and task.get('parent') == old_parent
+                  else self._valid_parent(uid, task.get('parent')))
+        if parent != old_parent:
+            # El subárbol entero cambia de rama: se resta de la vieja y se suma a la nueva
+            subtree = self.totals[uid]
+            self._propagate(old_parent, [-value for value in subtree])
+            if old_parent is not None:
+                self.children[old_parent].discard(uid)
+                del self.parent[uid]
+            if parent is not None:
+                self.parent[uid] = parent
+                self.children.setdefault(parent, set()).add(uid)
+            self._propagate(parent, subtree)
+        live = not task.get('deleted')
+        done = int(live and bool(task.get('done')))
+        pending = int(live and not task.get('done'))
+        delta = [done - own[self.DONE], pending - own[self.PENDING], 0, 0]
+        if any(delta):
+            own[self.DONE], own[self.PENDING] = done, pending
+            self._propagate(uid, delta)
+            
+    def add_focus(self, uid: str, minutes: int, sessions: int = 1):
+        """Foco propio de la tarea (su nodo se crea si la sesión llega antes que ella)"""
+        own = self._node(uid)
+        own[self.MINUTES] += minutes
+        own[self.SESSIONS] += sessions
+        self._propagate(uid, [0, 0, minutes, sessions])
+        
+    def add_session(self, session: Dict, sign: int = 1):
+        """Suma (o resta, al deshacer) una sesión a su tarea y sus ancestros"""
+        uid = session.get('task_uid')
+        if isinstance(uid, str):
+            self.add_focus(uid, sign * session.get('duration', 0), sign)
+            
+    def has_children(self, uid: str) -> bool:
+        return bool(self.children.get(uid))
+    
+    def progress(self, uid: str) -> tuple:
+        """(hechas, total, minutos, sesiones) de las subtareas (sin contar la propia)"""
+        own, totals = self.own[uid], self.totals[uid]
+        done = totals[self.DONE] - own[self.DONE]
+        return (done, done + totals[self.PENDING] - own[self.PENDING],
+                totals[self.MINUTES], totals[self.SESSIONS])
+    
+    def rebuild(self, tasks: List[Dict], focus: Optional[Dict] = None):
+        """Desde cero: tareas y el foco propio guardado {uid: [minutos, sesiones]}"""
+        self.__init__()
+        for task in tasks:
+            self.set_task(task)
+        for uid, (minutes, sessions) in (focus or {}).items():
+            self.add_focus(uid, int(minutes), int(sessions))
+            
+    def to_state(self) -> Dict:
+        """Solo el foco propio: lo demás se deduce de las tareas al cargar"""
+        return {uid: own[self.MINUTES:] for uid, own in self.own.items() if own[self.SESSIONS]}
+
+
+class TaskOrder:
+    """
+    Orden de la lista de tareas, mantenido al editar y no al teclear
+    La clave de una tarea son las claves propias (hecha, dificultad,
+    creación, uid) desde la raíz hasta ella: cada subtarea queda justo debajo
+    de su padre. Las tareas vivas se guardan ordenadas (bisect); un cambio
+    recalcula solo la tarea y su subárbol, y filtrar solo lee la lista.
+    """
+    
+    LEVELS = ('high', 'medium', 'low', 'minimal')
+    
+    def __init__(self):
+        self.keys: Dict[str, tuple] = {}
+        self.ordered: List[tuple] = []   # (clave, uid) de las tareas vivas
+        self._dirty: set = set()
+        self._stale = True               # Rehacer entero (carga, cambio de perfil)
+        
+    def own_key(self, task: Dict) -> tuple:
+        level = task.get('difficulty')
+        return (bool(task.get('done')), self.LEVELS.index(level) if level in self.LEVELS else 1,
+                task.get('created', ''), task['uid'])
+    
+    def _key(self, uid: str, tasks_by_uid: Dict[str, Dict], tree: TaskTree) -> tuple:
+        return tuple(self.own_key(tasks_by_uid[node]) for node in reversed(list(tree.path(uid)))
+                     if node in tasks_by_uid)
+    
+    def mark(self, uid: str):
+        self._dirty.add(uid)
+        
+    def invalidate(self):
+        self._stale = True
+        
+    def refresh(self, tasks_by_uid: Dict[str, Dict], tree: TaskTree):
+        """Aplica lo marcado: cada tarea cambiada y su subárbol (su camino cambió)"""
+        if self._stale:
+            self.keys = {uid: self._key(uid, tasks_by_uid, tree) for uid in tasks_by_uid}
+            self.ordered = sorted((key, uid) for uid, key in self.keys.items()
+                                  if not tasks_by_uid[uid].get('deleted'))
+            self._dirty.clear()
+            self._stale = False
+            return
+        pending, seen = list(self._dirty), set()
+        self._dirty.clear()
+        while pending:
+            uid = pending.pop()
+            if uid in seen:
+                continue
+            seen.add(uid)
+            pending.extend(tree.children.get(uid, ()))
+            old = self.keys.pop(uid, None)
+            if old is not None:
+                i = bisect.bisect_left(self.ordered, (old, uid))
+                if i < len(self.ordered) and self.ordered[i] == (old, uid):
+                    del self.ordered[i]
+            task = tasks_by_uid.get(uid)
+            if task is None:
+                continue
+            key = self.keys[uid] = self._key(uid, tasks_by_uid, tree)
+            if not task.get('deleted'):
+                bisect.insort(self.ordered, (key, uid))
+                
+    def first(self, limit: int, uids=None) -> List[str]:
+        """Las `limit` primeras tareas vivas (de `uids`, si se da) en orden de lista"""
+        if uids is None:
+            return [uid for _, uid in islice(self.ordered, limit)]
+        if len(uids) * 16 < len(self.ordered):   # Pocas coincidencias: ordenarlas a ellas
+            return heapq.nsmallest(limit, (uid for uid in uids if uid in self.keys),
+                                   key=lambda uid: (self.keys[uid], uid))
+        return list(islice((uid for _, uid in self.ordered if uid in uids), limit))
+
+
+class TaskImporter:
+    """
+    Importa tareas desde CSV, listas Markdown (- [ ] / - [x]) o texto plano
+    Todo es un generador línea a línea (ni el fichero ni el texto pegado se
+    convierten en listas intermedias): cada elemento sale como
+    (texto, dificultad, hecha). La dificultad se normaliza a las claves de
+    TaskEnergyMatcher.ENERGY_LEVELS desde columnas (nombre o 3-0) o desde
+    una etiqueta final con nombre ("#alta"); "#1" se queda en el texto. En
+    texto plano solo se omiten los títulos Markdown ("# ", "## "...).
+    """
+    
+    TEXT_COLUMNS = ('tarea', 'task', 'texto', 'text', 'titulo', 'title', 'item', 'nombre', 'name')
+    LEVEL_COLUMNS = ('dificultad', 'difficulty', 'energia', 'energy', 'nivel', 'level',
+                     'prioridad', 'priority')
+    DONE_COLUMNS = ('hecha', 'hecho', 'done', 'completada', 'completed', 'estado', 'status')
+    LEVEL_ALIASES = {
+        'high': ('high', 'alta', 'alto', 'dificil', 'hard', 'urgente'),
+        'medium': ('medium', 'media', 'medio', 'normal', 'moderada'),
+        'low': ('low', 'baja', 'bajo', 'facil', 'easy'),
+        'minimal': ('minimal', 'minima', 'minimo', 'trivial'),
+    }
+    NUMERIC_LEVELS = {'3': 'high', '2': 'medium', '1': 'low', '0': 'minimal'}   # Solo en columnas
+    TRUE_VALUES = ('1', 'x', 'si', 'yes', 'true', 'hecha', 'hecho', 'done', 'completada', 'completed')
+    CHECKBOX_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+\[([ xX])\]\s+(.*)$')
+    BULLET_RE = re.compile(r'^\s*(?:[-*+•]|\d+[.)])\s+(.*)$')
+    TAG_RE = re.compile(r'\s+[#@]([^\W\d_]\w*)\s*$')
+    HEADING_RE = re.compile(r'^\s*#{1,6}\s')
+    
+    _LEVEL_BY_ALIAS = {alias: level for level, aliases in LEVEL_ALIASES.items() for alias in aliases}
+    
+    @classmethod
+    def level(cls, value: str, numeric: bool = False) -> Optional[str]:
+        value = TaskSearchIndex.fold(value.strip())
+        return cls._LEVEL_BY_ALIAS.get(value) or (cls.NUMERIC_LEVELS.get(value) if numeric else None)
+    
+    @staticmethod
+    def key(text: str) -> int:
+        """Hash de deduplicación: sin acentos, mayúsculas ni espacios repetidos"""
+        folded = ' '.join(TaskSearchIndex.fold(text).split())
+        return int.from_bytes(hashlib.blake2b(folded.encode('utf-8'), digest_size=8).digest(),
+                              'big', signed=True)
+    
+    @classmethod
+    def parse(cls, lines, default_level: str = 'medium', csv_hint: bool = False):
+        """
+        (texto, dificultad, hecha) por cada tarea de `lines`
+        Es CSV si csv_hint (extensión .csv/.tsv) o si la primera línea es una
+        cabecera con una columna de texto reconocible; si no, línea a línea.
+        """
+        lines = iter(lines)
+        first = next(lines, None)
+        if first is None:
+            return
+        lines = chain([first], lines)
+        dialect = None
+        if csv_hint or any(sep in first for sep in ',;\t'):
+            try:
+                dialect = csv.Sniffer().sniff(first, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            header = [TaskSearchIndex.fold(h.strip()) for h in next(csv.reader([first], dialect))]
+            if not csv_hint and not any(h in cls.TEXT_COLUMNS for h in header):
+                dialect = None
+        if dialect is not None:
+            yield from cls._parse_csv(lines, dialect, default_level)
+        else:
+            yield from cls._parse_lines(lines, default_level)
+            
+    @classmethod
+    def _parse_csv(cls, lines, dialect, default_level: str):
+        rows = csv.reader(lines, dialect)
+        first = next(rows, [])
+        header = [TaskSearchIndex.fold(h.strip()) for h in first]
+        
+        def column(names) -> Optional[int]:
+            return next((i for i, h in enumerate(header) if h in names), None)
+        
+        text_col = column(cls.TEXT_COLUMNS)
+        level_col = column(cls.LEVEL_COLUMNS)
+        done_col = column(cls.DONE_COLUMNS)
+        if text_col is None:
+            # Sin cabecera reconocible: la primera fila ya es una tarea (tal cual, sin
+            # normalizar), su primera columna es el texto y la dificultad va en la
+            # primera columna cuyo valor se reconozca como nivel
+            rows = chain([first], rows)
+            text_col, done_col = 0, None
+            level_col = next((i for i, value in enumerate(first) if i and cls.level(value)), None)
+        for row in rows:
+            if len(row) <= text_col or not row[text_col].strip():
+                continue
+            level = cls.level(row[level_col], numeric=True) if level_col is not None and level_col < len(row) else None
+            done = (done_col is not None and done_col < len(row)
+                    and TaskSearchIndex.fold(row[done_col].strip()) in cls.TRUE_VALUES)
+            yield row[text_col].strip(), level or default_level, done
+            
+    @classmethod
+    def _parse_lines(cls, lines, default_level: str):
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line.strip() or cls.HEADING_RE.match(line):
+                continue  # Vacías y títulos Markdown
+            done = False
+            match = cls.CHECKBOX_RE.match(line)
+            if match:
+                done, text = match.group(1) != ' ', match.group(2)
+            else:
+                match = cls.BULLET_RE.match(line)
+                text = match.group(1) if match else line
+            level = None
+            tag = cls.TAG_RE.search(text)
+            if tag:
+                level = cls.level(tag.group(1))
+                if level:
+                    text = text[:tag.start()]
+            text = text.strip()
+            if text:
+                yield text, level or default_level, done
+
+
+class ReminderScheduler:
+    """
+    Fechas límite y recordatorios de tareas con un solo temporizador
+    Un min-heap de (instante, tipo, uid) y UN callback armado para el más
+    próximo: con miles de avisos, en reposo no cuesta nada. Editar es
+    O(log n): se apila la entrada nueva y la vieja queda obsoleta (se
+    descarta al salir del heap; si se acumulan, se re-amontona). Lo ya
+    avisado se anota en la propia tarea ('reminded': tipo -> fecha avisada):
+    cambiar la fecha, aunque sea a una anterior, vuelve a programarlo.
+    """
+    
+    KINDS = {'remind_at': 'remind', 'due': 'due'}   # campo de la tarea -> tipo de aviso
+    MAX_DELAY_MS = 3600 * 1000   # Re-armar al menos cada hora (suspensión, cambio de hora)
+    RELATIVE_RE = re.compile(r'^\+(\d+)\s*([dhm])$')
+    
+    def __init__(self, schedule: Callable, cancel: Callable, on_due: Callable[[List[tuple]], None],
+                 clock: Optional[Clock] = None):
+        self.schedule = schedule    # (ms, callback) -> id, como root.after
+        self.cancel = cancel        # (id), como root.after_cancel
+        self.on_due = on_due        # [(uid, tipo)] vencidos en la misma pasada
+        self.clock = clock or Clock()
+        self._heap: List[tuple] = []
+        self._when: Dict[tuple, float] = {}   # (uid, tipo) -> instante vigente
+        self._armed: Optional[tuple] = None   # (instante, id del after)
+        
+    @classmethod
+    def parse_when(cls, text: str, now: datetime) -> Optional[datetime]:
+        """'2025-06-10', '2025-06-10 08:30' o relativo ('+2d', '+3h', '+45m'); '' = sin fecha"""
+        text = text.strip()
+        if not text:
+            return None
+        match = cls.RELATIVE_RE.match(text)
+        if match:
+            unit = {'d': 'days', 'h': 'hours', 'm': 'minutes'}[match.group(2)]
+            return now + timedelta(**{unit: int(match.group(1))})
+        when = datetime.fromisoformat(text)   # ValueError si no se entiende
+        if len(text) <= 10:
+            when = when.replace(hour=9)   # Solo fecha: aviso por la mañana
+        return when
+    
+    @classmethod
+    def entries(cls, task: Dict):
+        """(tipo, instante) de los avisos vigentes (y aún no avisados) de una tarea"""
+        if task.get('done') or task.get('deleted'):
+            return
+        reminded = task.get('reminded')
+        reminded = reminded if isinstance(reminded, dict) else {}
+        for field, kind in cls.KINDS.items():
+            value = task.get(field)
+            if value and reminded.get(kind) != value:
+                try:
+                    yield kind, datetime.fromisoformat(value).timestamp()
+                except (TypeError, ValueError):
+                    continue
+                    
+    @classmethod
+    def mark_reminded(cls, task: Dict, kind: str):
+        """Anota en la tarea que este aviso (con su fecha actual) ya sonó"""
+        field = next(f for f, k in cls.KINDS.items() if k == kind)
+        reminded = task.get('reminded')
+        task['reminded'] = dict(reminded if isinstance(reminded, dict) else {}, **{kind: task.get(field)})
+        
+    @classmethod
+    def migrate_delivered(cls, tasks: List[Dict], delivered: float):
+        """Datos de antes de 'reminded': lo anterior a la marca global cuenta como avisado"""
+        for task in tasks:
+            if not isinstance(task.get('reminded'), dict):
+                for kind, when in cls.entries(task):
+                    if when <= delivered:
+                        cls.mark_reminded(task, kind)
+                        
+    def rebuild(self, tasks: List[Dict]):
+        """Desde las tareas guardadas: O(n log n); lo ya avisado no se repite"""
+        self._when = {(t['uid'], kind): when for t in tasks for kind, when in self.entries(t)}
+        self._heap = [(when, kind, uid) for (uid, kind), when in self._when.items()]
+        heapq.heapify(self._heap)
+        self._arm()
+        
+    def update(self, task: Dict):
+        """La tarea cambió (edición, completar, borrar, deshacer, sync): O(log n)"""
+        uid = task['uid']
+        # Lo que ya sonó no vuelve a sonar al editar otra cosa ('reminded' de la tarea)
+        wanted = dict(self.entries(task))
+        for kind in self.KINDS.values():
+            when = wanted.get(kind)
+            if when is None:
+                self._when.pop((uid, kind), None)   # Su entrada del heap queda obsoleta
+            elif self._when.get((uid, kind)) != when:
+                self._when[(uid, kind)] = when
+                heapq.heappush(self._heap, (when, kind, uid))
+        if len(self._heap) > 2 * len(self._when) + 64:
+            self._heap = [(when, kind, uid) for (uid, kind), when in self._when.items()]
+            heapq.heapify(self._heap)
+        self._arm()
+        
+    def _peek(self) -> Optional[float]:
+        """Instante del próximo aviso vigente (limpia las entradas obsoletas de la cima)"""
+        while self._heap:
+            when, kind, uid = self._heap[0]
+            if self._when.get((uid, kind)) == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+    
+    def _arm(self):
+        when = self._peek()
+        if self._armed is not None:
+            if when is not None and self._armed[0] <= when:
+                return   # El armado ya llega a tiempo
+            self.cancel(self._armed[1])
+            self._armed = None
+        if when is None:
+            return
+        delay = min(max(0, int((when - self.clock.time()) * 1000)), self.MAX_DELAY_MS)
+        self._armed = (when, self.schedule(delay, self._fire))
+        
+    def _fire(self):
+        self._armed = None
+        now = self.clock.time()
+        due = []
+        while True:
+            when = self._peek()
+            if when is None or when > now:
+                break
+            _, kind, uid = heapq.heappop(self._heap)
+            del self._when[(uid, kind)]
+            due.append((uid, kind))
+        self._arm()
+        if due:
+            self.on_due(due)
+            
+    def stop(self):
+        if self._armed is not None:
+            self.cancel(self._armed[1])
+            self._armed = None
+            
+    def __len__(self) -> int:
+        return len(self._when)
+
+
+def _analytics_partial(rows: List[tuple]) -> Dict:
+    """
+    Agregados parciales de un bloque de sesiones (corre en otro proceso)
+    rows: (timestamp ISO, duración, pausas, calidad, energía)
+    """
+    return _aggregate((datetime.fromisoformat(ts), d, p, q, e) for ts, d, p, q, e in rows)
+
+
+def _analytics_records_partial(path: str, start: int, end: int) -> Dict:
+    """Agregados de los registros binarios [start, end): sin dicts, vía mmap"""
+    codes = list(TaskEnergyMatcher.ENERGY_LEVELS)
+    return _aggregate((datetime.fromtimestamp(ts), d, p, q, codes[e])
+                      for ts, d, p, q, e, _ in SessionRecordFile.scan(path, start, end))
+
+
+def _aggregate(rows) -> Dict:
+    """rows: (datetime, duración, pausas, calidad, energía)"""
+    heatmap = [[0] * 24 for _ in range(7)]   # día de la semana x hora -> minutos
+    months = {}                               # 'YYYY-MM' -> [sesiones, pausas, minutos]
+    by_energy = {}                            # energía -> [sesiones, suma calidad, minutos]
+    count = 0
+    for when, duration, pauses, quality, energy in rows:
+        count += 1
+        heatmap[when.weekday()][when.hour] += duration
+        month = months.setdefault(when.strftime('%Y-%m'), [0, 0, 0])
+        month[0] += 1
+        month[1] += pauses
+        month[2] += duration
+        level = by_energy.setdefault(energy, [0, 0.0, 0])
+        level[0] += 1
+        level[1] += quality
+        level[2] += duration
+    return {'sessions': count, 'heatmap': heatmap, 'months': months, 'energy': by_energy}
+
+
+def _session_row(session: Dict) -> tuple:
+    """Sesión -> tupla compacta para los workers de análisis"""
+    return (session['timestamp'], session.get('duration', 0), session.get('pauses', 0),
+            session.get('quality', 1.0), session.get('energy_level', 'medium'))
+
+
+def _throughput_partial(done_dates: List[str]) -> Dict:
+    """Tareas completadas por mes (corre en otro proceso)"""
+    throughput = {}
+    for stamp in done_dates:
+        month = stamp[:7]
+        throughput[month] = throughput.get(month, 0) + 1
+    return {'throughput': throughput}
+
+
+def _merge_analytics(acc: Dict, part: Dict):
+    """Suma un parcial sobre el acumulado (hilo de Tk, O(tamaño del parcial))"""
+    acc['sessions'] = acc.get('sessions', 0) + part.get('sessions', 0)
+    if 'heatmap' in part:
+        heatmap = acc.setdefault('heatmap', [[0] * 24 for _ in range(7)])
+        for day, row in enumerate(part['heatmap']):
+            for hour, minutes in enumerate(row):
+                heatmap[day][hour] += minutes
+    for key in ('months', 'energy'):
+        target = acc.setdefault(key, {})
+        for k, values in part.get(key, {}).items():
+            if k in target:
+                target[k] = [a + b for a, b in zip(target[k], values)]
+            else:
+                target[k] = list(values)
+    throughput = acc.setdefault('throughput', {})
+    for month, count in part.get('throughput', {}).items():
+        throughput[month] = throughput.get(month, 0) + count
+
+
+class AnalyticsEngine:
+    """
+    Motor de análisis pesado en un pool de procesos
+    Parte el historial en bloques, cada proceso devuelve agregados parciales
+    que llegan a Tk por la cola de mensajes (resultado en streaming) y el
+    resultado final se cachea por versión de datos.
+    """
+    
+    CHUNK = 5000
+    RECORDS_CHUNK = 50000
+    WEEKDAYS = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
+    
+    def __init__(self, post_to_ui: Callable):
+        self.post_to_ui = post_to_ui
+        self._executor = None
+        self._cache: Optional[tuple] = None   # (versión, resultado)
+        self._runs: Dict[int, List[tuple]] = {}   # versión en curso -> [(on_partial, on_done)]
+        
+    def _get_executor(self):
+        if self._executor is None:
+            try:
+                # spawn: los hijos no heredan el estado de Tk ni sus hilos
+                self._executor = ProcessPoolExecutor(
+                    max_workers=min(4, os.cpu_count() or 1),
+                    mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError):
+                self._executor = ThreadPoolExecutor(max_workers=2)
+        return self._executor
+    
+    def attach(self, version: int, on_partial: Callable[[Dict, int, int], None],
+               on_done: Callable[[Dict], None]) -> bool:
+        """Sirve desde la caché o se suma al análisis en curso de esa versión"""
+        if self._cache and self._cache[0] == version:
+            on_done(self._cache[1])
+            return True
+        listeners = self._runs.get(version)
+        if listeners is None:
+            return False
+        listeners.append((on_partial, on_done))
+        return True
+    
+    def run(self, version: int, rows: List[tuple], done_dates: List[str],
+            on_partial: Callable[[Dict, int, int], None], on_done: Callable[[Dict], None],
+            records_path: Optional[str] = None, record_count: int = 0):
+        """
+        on_partial/on_done se llaman siempre en el hilo de Tk.
+        Las sesiones archivadas no pasan por aquí: cada proceso mapea su rango
+        de registros binarios directamente.
+        """
+        if self.attach(version, on_partial, on_done):
+            return
+        
+        listeners = self._runs[version] = [(on_partial, on_done)]
+        chunks = [rows[i:i + self.CHUNK] for i in range(0, len(rows), self.CHUNK)]
+        ranges = []
+        if records_path:
+            ranges = [(start, min(record_count, start + self.RECORDS_CHUNK))
+                      for start in range(0, record_count, self.RECORDS_CHUNK)]
+        total = len(chunks) + len(ranges) + 1
+        acc = {}
+        state = {'done': 0, 'failed': False}
+        
+        def on_result(part: Optional[Dict]):
+            if part is None:
+                state['failed'] = True
+            else:
+                _merge_analytics(acc, part)
+            state['done'] += 1
+            if state['done'] == total:
+                del self._runs[version]
+                # Con un bloque fallido el resultado se entrega pero no se cachea
+                if not state['failed'] and (self._cache is None or self._cache[0] < version):
+                    self._cache = (version, acc)
+                for _, done in listeners:
+                    done(acc)
+            else:
+                for partial, _ in listeners:
+                    partial(acc, state['done'], total)
+                
+        def on_future(future):
+            # Se ejecuta en un hilo del executor: solo encolar
+            try:
+                self.post_to_ui(on_result, future.result())
+            except Exception as e:
+                print(f"Error en análisis: {e}")
+                self.post_to_ui(on_result, None)
+                
+        executor = self._get_executor()
+        executor.submit(_throughput_partial, done_dates).add_done_callback(on_future)
+        for chunk in chunks:
+            executor.submit(_analytics_partial, chunk).add_done_callback(on_future)
+        for start, end in ranges:
+            executor.submit(_analytics_records_partial, records_path, start, end).add_done_callback(on_future)
+            
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            
+    @classmethod
+    def format_report(cls, result: Dict) -> str:
+        lines = [f"Sesiones analizadas: {result.get('sessions', 0)}", ""]
+        
+        heatmap = result.get('heatmap')
+        if heatmap:
+            peak = max(max(row) for row in heatmap) or 1
+            shades = ' ░▒▓█'
+            lines.append("MAPA DE FOCO (minutos por día y hora)")
+            lines.append("     " + ''.join(f"{h:<3}" for h in range(0, 24, 3)).rstrip())
+            for day, row in enumerate(heatmap):
+                cells = ''.join(shades[max(1, m * 4 // peak) if m else 0] for m in row)
+                lines.append(f"{cls.WEEKDAYS[day]}  {cells}")
+            lines.append("")
+            
+        energy = result.get('energy', {})
+        if energy:
+            lines.append("CALIDAD POR ENERGÍA")
+            for level in TaskEnergyMatcher.ENERGY_LEVELS:
+                if level in energy:
+                    n, quality_sum, minutes = energy[level]
+                    lines.append(f"{level:8} {n:5} sesiones • calidad {quality_sum / n:.2f} • {minutes} min")
+            lines.append("")
+            
+        months = result.get('months', {})
+        throughput = result.get('throughput', {})
+        if months or throughput:
+            lines.append("POR MES       sesiones  pausas/sesión  minutos  tareas hechas")
+            for month in sorted(set(months) | set(throughput)):
+                n, pauses, minutes = months.get(month, (0, 0, 0))
+                rate = f"{pauses / n:.2f}" if n else "-"
+                lines.append(f"{month}     {n:8}  {rate:>13}  {minutes:7}  {throughput.get(month, 0):13}")
+        return '\n'.join(lines)
+
+
+def _hex_to_rgb(color: str) -> tuple:
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def _encode_png(width: int, height: int, rows: List[bytes]) -> bytes:
+    """PNG RGB mínimo (stdlib): Tk 8.6 lo carga directo en un PhotoImage"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+    raw = b''.join(b'\x00' + row for row in rows)
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+
+class FocusHeatmap:
+    """
+    Mapa de calor calendario x hora del día, rasterizado fuera del hilo de Tk
+    Una tesela por mes (filas = días, columnas = horas, color = energía
+    dominante, intensidad = minutos). Las teselas se cachean: tras una sesión
+    solo se repinta su mes y Tk recibe una única imagen.
+    """
+    
+    CELL = 2
+    GAP = 1
+    TILE_GAP = 8
+    MONTHS_SHOWN = 12
+    ENERGY_ORDER = list(TaskEnergyMatcher.ENERGY_LEVELS)
+    
+    def __init__(self, post_to_ui: Callable, panel_bg: str, empty_bg: str):
+        self.post_to_ui = post_to_ui
+        self.panel_bg = _hex_to_rgb(panel_bg)
+        self.empty_bg = _hex_to_rgb(empty_bg)
+        self.energy_rgb = [_hex_to_rgb(TaskEnergyMatcher.ENERGY_LEVELS[e]['color'])
+                           for e in self.ENERGY_ORDER]
+        # mes -> (día, hora) -> [minutos, min. por cada nivel de energía...]
+        self._cells: Dict[str, Dict[tuple, List[int]]] = {}
+        self._dirty = set()
+        self._rendered_months: List[str] = []
+        self._tiles: Dict[str, List[bytes]] = {}   # Solo las toca el hilo de render
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='heatmap')
+        self.tile_width = 24 * (self.CELL + self.GAP)
+        self.tile_height = 31 * (self.CELL + self.GAP)
+        
+    def add_session(self, session: Dict):
+        self.add(datetime.fromisoformat(session['timestamp']), session.get('duration', 0),
+                 session.get('energy_level', 'medium'))
+        
+    def remove_session(self, session: Dict):
+        self.add(datetime.fromisoformat(session['timestamp']), session.get('duration', 0),
+                 session.get('energy_level', 'medium'), sign=-1)
+        
+    def add(self, end: datetime, duration: int, level: str, sign: int = 1):
+        """Reparte los minutos de la sesión por horas (O(horas que abarca))"""
+        remaining = duration
+        energy = self.ENERGY_ORDER.index(level) if level in self.ENERGY_ORDER else 1
+        cursor = end - timedelta(minutes=remaining)
+        while remaining > 0:
+            slot = min(remaining, 60 - cursor.minute)
+            month = cursor.strftime('%Y-%m')
+            cell = self._cells.setdefault(month, {}).setdefault((cursor.day, cursor.hour),
+                                                                [0] * (1 + len(self.ENERGY_ORDER)))
+            cell[0] += sign * slot
+            cell[1 + energy] += sign * slot
+            self._dirty.add(month)
+            cursor += timedelta(minutes=slot)
+            remaining -= slot
+            
+    def reset(self):
+        """Vacía los datos (cambio de perfil): los meses pintados se repintan"""
+        self._dirty.update(self._cells)
+        self._dirty.update(self._rendered_months)
+        self._cells = {}
+        self._rendered_months = []
+        
+    def visible_months(self, today: date) -> List[str]:
+        months = []
+        year, month = today.year, today.month
+        for _ in range(self.MONTHS_SHOWN):
+            months.append(f"{year:04d}-{month:02d}")
+            month -= 1
+            if month == 0:
+                year, month = year - 1, 12
+        return months[::-1]
+    
+    def needs_render(self, today: date) -> bool:
+        months = self.visible_months(today)
+        return months != self._rendered_months or any(m in self._dirty for m in months)
+    
+    def render_async(self, today: date, on_done: Callable[[str, List[str]], None]):
+        """Repinta solo los meses sucios en el worker; on_done(png_base64, meses) en Tk"""
+        months = self.visible_months(today)
+        dirty = {m: {k: tuple(v) for k, v in self._cells.get(m, {}).items()}
+                 for m in months if m in self._dirty}
+        self._dirty.difference_update(dirty)
+        self._rendered_months = months
+        
+        def work():
+            for month in months:
+                if month in dirty or month not in self._tiles:
+                    self._tiles[month] = self._rasterize(month, dirty.get(month, {}))
+            png = self._compose(months)
+            self.post_to_ui(on_done, base64.b64encode(png).decode('ascii'), months)
+        self._executor.submit(work)
+        
+    def _rasterize(self, month: str, cells: Dict[tuple, tuple]) -> List[bytes]:
+        year, mon = int(month[:4]), int(month[5:])
+        next_month = date(year + mon // 12, mon % 12 + 1, 1)
+        days_in_month = (next_month - date(year, mon, 1)).days
+        panel = bytes(self.panel_bg)
+        rows = []
+        for day in range(1, 32):
+            line = bytearray()
+            for hour in range(24):
+                if day > days_in_month:
+                    rgb = self.panel_bg
+                else:
+                    cell = cells.get((day, hour))
+                    if cell:
+                        counts = cell[1:]
+                        base = self.energy_rgb[counts.index(max(counts))]
+                        t = 0.25 + 0.75 * min(cell[0], 60) / 60
+                        rgb = tuple(int(e + (b - e) * t) for e, b in zip(self.empty_bg, base))
+                    else:
+                        rgb = self.empty_bg
+                line += bytes(rgb) * self.CELL + panel * self.GAP
+            line = bytes(line)
+            rows.extend([line] * self.CELL)
+            rows.extend([panel * self.tile_width] * self.GAP)
+        return rows
+    
+    def _compose(self, months: List[str]) -> bytes:
+        gap = bytes(self.panel_bg) * self.TILE_GAP
+        width = len(months) * self.tile_width + (len(months) - 1) * self.TILE_GAP
+        rows = [gap.join(self._tiles[m][y] for m in months) for y in range(self.tile_height)]
+        return _encode_png(width, self.tile_height, rows)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DashboardBuilder:
+    """
+    Panel HTML estático: un índice y una página por semana ISO
+    Cada página es autocontenida (CSS y gráficos SVG en línea). Se construye
+    desde resúmenes por semana cacheados en disco: lo archivado se escanea
+    una sola vez sobre el registro binario (solo crece) y la ventana
+    reciente se resume en cada build. Una semana se reescribe solo si su
+    resumen cambió: tras una sesión, la semana actual y el índice.
+    Pensado para el hilo de E/S (build() bloquea).
+    """
+    
+    CACHE_VERSION = 1
+    TOP_TASKS = 15
+    WEEKS_CHARTED = 52
+    ENERGY_ORDER = list(TaskEnergyMatcher.ENERGY_LEVELS)
+    STYLE = ("body{font-family:Helvetica,Arial,sans-serif;background:#0f172a;color:#f8fafc;"
+             "max-width:960px;margin:auto;padding:24px}a{color:#60a5fa}"
+             "table{border-collapse:collapse;width:100%}td,th{padding:4px 8px;text-align:left;"
+             "border-bottom:1px solid #334155}.muted{color:#64748b}.cards{display:flex;gap:12px}"
+             ".card{background:#1e293b;border-radius:8px;padding:12px 16px;flex:1}"
+             ".card b{display:block;font-size:1.6em}svg{background:#1e293b;border-radius:8px}")
+    
+    def __init__(self, directory: str, records_path: str):
+        self.directory = directory
+        self.records_path = records_path
+        self.cache_path = os.path.join(directory, 'rollups.json')
+        self.index_path = os.path.join(directory, 'index.html')
+        self._cache: Optional[Dict] = None
+        
+    @staticmethod
+    def week_of(when: datetime) -> str:
+        year, week, _ = when.isocalendar()
+        return f"{year:04d}-W{week:02d}"
+    
+    @classmethod
+    def _add(cls, weeks: Dict[str, Dict], when: datetime, duration: int, pauses: int,
+             quality: float, energy: int, task: str):
+        rollup = weeks.get(cls.week_of(when))
+        if rollup is None:
+            rollup = weeks[cls.week_of(when)] = {
+                'sessions': 0, 'minutes': 0, 'pauses': 0, 'quality': 0.0,
+                'days': [0] * 7, 'energy': [0] * len(cls.ENERGY_ORDER), 'tasks': {}}
+        rollup['sessions'] += 1
+        rollup['minutes'] += duration
+        rollup['pauses'] += pauses
+        rollup['quality'] = round(rollup['quality'] + quality, 4)
+        rollup['days'][when.weekday()] += duration
+        rollup['energy'][energy] += duration
+        totals = rollup['tasks'].setdefault(task, [0, 0])
+        totals[0] += duration
+        totals[1] += 1
+        
+    @staticmethod
+    def recent_rows(sessions: List[Dict]) -> List[tuple]:
+        """Foto de la ventana reciente para build() (se toma en el hilo de Tk)"""
+        return [(s['timestamp'], s['duration'], s.get('pauses', 0), s.get('quality', 1.0),
+                 s.get('energy_level', 'medium'), s.get('task', 'General')) for s in sessions]
+    
+    @staticmethod
+    def _copy(rollup: Dict) -> Dict:
+        return dict(rollup, days=list(rollup['days']), energy=list(rollup['energy']),
+                    tasks={task: list(totals) for task, totals in rollup['tasks'].items()})
+    
+    def _load_cache(self) -> Dict:
+        if self._cache is None:
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if cache.get('version') != self.CACHE_VERSION:
+                    raise ValueError("versión distinta")
+                self._cache = cache
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"Error leyendo la caché del panel (se regenera): {e}")
+        if self._cache is None:
+            self._cache = {'version': self.CACHE_VERSION, 'records': 0, 'archive': {}, 'digests': {}}
+        return self._cache
+    
+    def _write(self, path: str, text: str):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+        
+    def build(self, records: int, labels: List[str], recent: List[tuple], generated: datetime,
+              full: bool = False) -> Dict:
+        """
+        Actualiza el panel con los `records` primeros registros archivados y la
+        ventana `recent` [(timestamp, duración, pausas, calidad, energía, tarea)]
+        """
+        started = time.perf_counter()
+        if full:
+            self._cache = None
+            for path in (self.cache_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        cache = self._load_cache()
+        if records < cache['records']:   # Archivo reemplazado (restauración): de cero
+            cache.update(records=0, archive={}, digests={})
+        archive = cache['archive']
+        for ts, duration, pauses, quality, energy, task_id in SessionRecordFile.scan(
+                self.records_path, cache['records'], records):
+            task = labels[task_id] if 0 <= task_id < len(labels) else "General"
+            self._add(archive, datetime.fromtimestamp(ts), duration, pauses, quality, energy, task)
+        cache['records'] = records
+        
+        # Semanas con sesiones recientes: copia de su resumen archivado + la ventana
+        weeks = dict(archive)
+        copied = set()
+        for timestamp, duration, pauses, quality, energy, task in recent:
+            when = datetime.fromisoformat(timestamp)
+            week = self.week_of(when)
+            if week not in copied:
+                copied.add(week)
+                if week in weeks:
+                    weeks[week] = self._copy(weeks[week])
+            level = self.ENERGY_ORDER.index(energy) if energy in self.ENERGY_ORDER else 1
+            self._add(weeks, when, duration, pauses, quality, level, task)
+            
+        os.makedirs(os.path.join(self.directory, 'weeks'), exist_ok=True)
+        digests = cache['digests']
+        written = 0
+        for week, rollup in weeks.items():
+            digest = hashlib.blake2b(json.dumps(rollup, sort_keys=True).encode('utf-8'),
+                                     digest_size=8).hexdigest()
+            path = os.path.join(self.directory, 'weeks', f"{week}.html")
+            if digests.get(week) == digest and os.path.exists(path):
+                continue
+            self._write(path, self.week_page(week, rollup))
+            digests[week] = digest
+            written += 1
+        for week in [w for w in digests if w not in weeks]:   # Semana vaciada (deshacer)
+            digests.pop(week)
+            path = os.path.join(self.directory, 'weeks', f"{week}.html")
+            if os.path.exists(path):
+                os.remove(path)
+        self._write(self.index_path, self.index_page(weeks, generated))
+        self._write(self.cache_path, json.dumps(cache, ensure_ascii=False))
+        return {'weeks': len(weeks), 'written': written, 'seconds': time.perf_counter() - started}
+    
+    # Render (funciones puras: la misma semana produce el mismo HTML)
+    
+    @staticmethod
+    def bar_chart(values: List[float], labels: List[str], color: str,
+                  links: Optional[List[str]] = None, width: int = 900, height: int = 180) -> str:
+        """Barras SVG en línea (con enlace opcional por barra)"""
+        top = max(values, default=0) or 1
+        slot = width / max(len(values), 1)
+        parts = [f'<svg width="{width}" height="{height + 20}" viewBox="0 0 {width} {height + 20}">']
+        for i, value in enumerate(values):
+            bar = round(value / top * (height - 10), 1)
+            x = round(i * slot + slot * 0.1, 1)
+            rect = (f'<rect x="{x}" y="{round(height - bar, 1)}" width="{round(slot * 0.8, 1)}" height="{bar}" '
+                    f'fill="{color}"><title>{html.escape(labels[i])}: {value:g}</title></rect>')
+            parts.append(f'<a href="{links[i]}">{rect}</a>' if links else rect)
+            if len(values) <= 14:
+                parts.append(f'<text x="{round(x + slot * 0.4, 1)}" y="{height + 14}" fill="#cbd5e1" '
+                             f'font-size="11" text-anchor="middle">{html.escape(labels[i])}</text>')
+        parts.append('</svg>')
+        return ''.join(parts)
+    
+    @classmethod
+    def energy_bar(cls, minutes: List[int], width: int = 900) -> str:
+        """Reparto de minutos por nivel de energía (barra apilada)"""
+        total = sum(minutes) or 1
+        parts = [f'<svg width="{width}" height="28">']
+        x = 0.0
+        for level, value in zip(cls.ENERGY_ORDER, minutes):
+            w = value / total * width
+            info = TaskEnergyMatcher.ENERGY_LEVELS[level]
+            parts.append(f'<rect x="{round(x, 1)}" y="0" width="{round(w, 1)}" height="28" '
+                         f'fill="{info["color"]}"><title>{level}: {value} min</title></rect>')
+            x += w
+        parts.append('</svg>')
+        return ''.join(parts)
+    
+    @classmethod
+    def task_table(cls, tasks: Dict[str, List[int]]) -> str:
+        top = sorted(tasks.items(), key=lambda item: (-item[1][0], item[0]))[:cls.TOP_TASKS]
+        rows = ''.join(f'<tr><td>{html.escape(task)}</td><td>{minutes} min</td><td>{sessions}</td></tr>'
+                       for task, (minutes, sessions) in top)
+        return f'<table><tr><th>Tarea</th><th>Foco</th><th>Sesiones</th></tr>{rows}</table>'
+    
+    @classmethod
+    def page(cls, title: str, body: str) -> str:
+        return (f'<!DOCTYPE html><html lang="es"><head><meta charset="utf-8">'
+                f'<title>{html.escape(title)}</title><style>{cls.STYLE}</style></head>'
+                f'<body>{body}</body></html>\n')
+    
+    @staticmethod
+    def cards(rollup: Dict) -> str:
+        quality = rollup['quality'] / rollup['sessions'] if rollup['sessions'] else 0
+        values = [("Sesiones", rollup['sessions']), ("Horas de foco", f"{rollup['minutes'] / 60:.1f}"),
+                  ("Calidad media", f"{quality:.0%}"), ("Pausas", rollup['pauses'])]
+        return '<div class="cards">' + ''.join(
+            f'<div class="card"><span class="muted">{label}</span><b>{value}</b></div>'
+            for label, value in values) + '</div>'
+    
+    @classmethod
+    def week_page(cls, week: str, rollup: Dict) -> str:
+        monday = datetime.strptime(f"{week}-1", "%G-W%V-%u").date()
+        days = [f"{name} {(monday + timedelta(days=i)).day}" for i, name in enumerate(AnalyticsEngine.WEEKDAYS)]
+        body = (f'<p><a href="../index.html">← Panel</a></p>'
+                f'<h1>Semana {week}</h1><p class="muted">{monday.isoformat()} – '
+                f'{(monday + timedelta(days=6)).isoformat()}</p>{cls.cards(rollup)}'
+                f'<h2>Minutos por día</h2>{cls.bar_chart(rollup["days"], days, "#60a5fa")}'
+                f'<h2>Energía</h2>{cls.energy_bar(rollup["energy"])}'
+                f'<h2>Tareas</h2>{cls.task_table(rollup["tasks"])}')
+        return cls.page(f"StudyFlow • {week}", body)
+    
+    @classmethod
+    def index_page(cls, weeks: Dict[str, Dict], generated: datetime) -> str:
+        order = sorted(weeks)
+        total = {'sessions': 0, 'minutes': 0, 'pauses': 0, 'quality': 0.0}
+        energy = [0] * len(cls.ENERGY_ORDER)
+        tasks: Dict[str, List[int]] = {}
+        for rollup in weeks.values():
+            for key in total:
+                total[key] += rollup[key]
+            for i, value in enumerate(rollup['energy']):
+                energy[i] += value
+            for task, (minutes, sessions) in rollup['tasks'].items():
+                totals = tasks.setdefault(task, [0, 0])
+                totals[0] += minutes
+                totals[1] += sessions
+        charted = order[-cls.WEEKS_CHARTED:]
+        rows = ''.join(
+            f'<tr><td><a href="weeks/{week}.html">{week}</a></td><td>{weeks[week]["sessions"]}</td>'
+            f'<td>{weeks[week]["minutes"]} min</td>'
+            f'<td>{weeks[week]["quality"] / max(weeks[week]["sessions"], 1):.0%}</td></tr>'
+            for week in reversed(order))
+        body = (f'<h1>StudyFlow</h1><p class="muted">Generado {generated.strftime("%Y-%m-%d %H:%M")} • '
+                f'{len(order)} semanas</p>{cls.cards(total)}'
+                f'<h2>Minutos por semana (últimas {len(charted)})</h2>'
+                f'{cls.bar_chart([weeks[w]["minutes"] for w in charted], charted, "#4ade80", [f"weeks/{w}.html" for w in charted])}'
+                f'<h2>Energía</h2>{cls.energy_bar(energy)}'
+                f'<h2>Tareas con más foco</h2>{cls.task_table(tasks)}'
+                f'<h2>Semanas</h2><table><tr><th>Semana</th><th>Sesiones</th><th>Foco</th>'
+                f'<th>Calidad</th></tr>{rows}</table>')
+        return cls.page("StudyFlow • Panel", body)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Handler HTTP mínimo: solo sirve /metrics"""
+    
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, format, *args):
+        pass  # Sin ruido en consola por cada scrape
+
+
+class MetricsExporter:
+    """
+    Exportador opcional de métricas en formato texto de Prometheus
+    Pensado para vigilar muchas copias en laboratorios desde un solo sitio.
+    El hilo de Tk publica una foto inmutable (tupla); el servidor solo la lee,
+    así un scrape nunca compite con la interfaz.
+    """
+    
+    # nombre: (tipo, ayuda)
+    METRICS = {
+        'studyflow_sessions_completed_total': ('counter', 'Sesiones de focus completadas'),
+        'studyflow_focus_minutes_total': ('counter', 'Minutos de focus acumulados'),
+        'studyflow_distraction_events_total': ('counter', 'Alertas de distracción del FocusGuardian'),
+        'studyflow_save_latency_seconds': ('gauge', 'Duración del último guardado'),
+        'studyflow_save_latency_seconds_max': ('gauge', 'Guardado más lento desde el arranque'),
+        'studyflow_data_file_bytes': ('gauge', 'Tamaño del fichero de datos'),
+        'studyflow_load_seconds': ('gauge', 'Duración de la carga del fichero de datos'),
+        'studyflow_load_repaired_records': ('gauge', 'Registros reparados con valores por defecto al cargar'),
+        'studyflow_load_quarantined_records': ('gauge', 'Registros o líneas ilegibles apartados en cuarentena'),
+        'studyflow_reminders_pending': ('gauge', 'Recordatorios y fechas límite programados'),
+        'studyflow_bus_events_total': ('counter', 'Eventos publicados en el bus por tipo'),
+        'studyflow_bus_queue_depth': ('gauge', 'Eventos pendientes en la cola de cada suscriptor'),
+        'studyflow_bus_dropped_total': ('counter', 'Eventos descartados por cola llena (contrapresión)'),
+        'studyflow_bus_errors_total': ('counter', 'Excepciones de cada suscriptor'),
+        'studyflow_timer_drift_seconds': ('gauge', 'Duración real (monotónica) menos la planificada en la última sesión'),
+        'studyflow_timer_tick_late_seconds_max': ('gauge', 'Tick del countdown más tardío en la última sesión'),
+        'studyflow_timer_late_ui_updates': ('gauge', 'Repintados del timer que llegaron tarde en la última sesión'),
+        'studyflow_threads': ('gauge', 'Hilos vivos del proceso'),
+        'studyflow_event_loop_lag_seconds': ('gauge', 'Retraso del loop de Tk en la última revisión'),
+        'studyflow_event_loop_lag_seconds_max': ('gauge', 'Mayor retraso del loop de Tk desde la última foto'),
+    }
+    
+    def __init__(self, port: int, host: str = '127.0.0.1'):
+        self.host = host
+        self.port = port
+        # Tupla de (nombre, etiquetas, valor); se reemplaza entera, nunca se muta
+        self._snapshot = ()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        
+    @classmethod
+    def from_env(cls) -> Optional['MetricsExporter']:
+        """Crea el exportador solo si STUDYFLOW_METRICS_PORT está definido"""
+        port = os.environ.get('STUDYFLOW_METRICS_PORT')
+        if not port:
+            return None
+        try:
+            return cls(int(port), os.environ.get('STUDYFLOW_METRICS_HOST', '127.0.0.1'))
+        except ValueError:
+            print(f"Puerto de métricas inválido: {port}")
+            return None
+        
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='metrics-exporter', daemon=True)
+        self._thread.start()
+        
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            
+    def publish(self, samples: List[tuple]):
+        """Publica una foto nueva (asignación atómica de referencia)"""
+        self._snapshot = tuple(samples)
+        
+    @staticmethod
+    def escape(value) -> str:
+        """Valor de etiqueta: \\, " y saltos de línea escapados como pide el formato"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    
+    def render(self) -> str:
+        """Formato de exposición de texto de Prometheus"""
+        snapshot = self._snapshot  # Una sola lectura: foto consistente
+        lines = []
+        seen = set()
+        for name, labels, value in snapshot:
+            if name not in seen:
+                seen.add(name)
+                kind, help_text = self.METRICS.get(name, ('untyped', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            label_str = ''
+            if labels:
+                label_str = '{' + ','.join(f'{k}="{self.escape(v)}"' for k, v in labels) + '}'
+            lines.append(f"{name}{label_str} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class _Subscription:
+    """Cola acotada de un suscriptor (la drena un worker del pool, de uno en uno)"""
+    
+    def __init__(self, name: str, handler: Callable[[Dict], None], types, maxsize: int, drop_oldest: bool):
+        self.name = name
+        self.handler = handler
+        self.types = frozenset(types) if types else None
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+
+
+class EventBus:
+    """
+    Bus publish/subscribe de eventos del ciclo de vida (sesiones, tareas)
+    publish() corre en el hilo de Tk y nunca bloquea: deja el evento en la
+    cola acotada de cada suscriptor y, si hacía falta, encarga al pool
+    drenarla. Cada suscriptor tiene su cola y como mucho un worker a la vez
+    (orden garantizado); si se llena, descarta en vez de frenar la UI
+    (contrapresión contada en métricas).
+    """
+    
+    TYPES = ('session_started', 'session_paused', 'session_resumed', 'session_completed',
+             'task_added', 'task_toggled', 'distraction_detected')
+    DRAIN_BATCH = 32   # Eventos por turno antes de ceder el worker a otro suscriptor
+    
+    def __init__(self, workers: int = 2, clock: Optional[Clock] = None):
+        self.clock = clock or Clock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bus')
+        self._subscriptions: tuple = ()
+        self._closed = False
+        self.published = dict.fromkeys(self.TYPES, 0)
+        
+    @classmethod
+    def from_env(cls, clock: Optional[Clock] = None) -> 'EventBus':
+        """Bus con los hooks configurados: STUDYFLOW_HOOK_LOG (JSONL) y STUDYFLOW_HOOK_URL (POST)"""
+        bus = cls(clock=clock)
+        if os.environ.get('STUDYFLOW_HOOK_LOG'):
+            bus.subscribe('log', cls.jsonl_hook(os.environ['STUDYFLOW_HOOK_LOG']))
+        if os.environ.get('STUDYFLOW_HOOK_URL'):
+            bus.subscribe('webhook', cls.webhook_hook(os.environ['STUDYFLOW_HOOK_URL']))
+        return bus
+    
+    def subscribe(self, name: str, handler: Callable[[Dict], None], types=None,
+                  maxsize: int = 1024, drop_oldest: bool = True):
+        """handler(evento) en un worker; types=None recibe todos"""
+        unknown = set(types or ()) - set(self.TYPES)
+        if unknown:
+            raise ValueError(f"eventos desconocidos: {sorted(unknown)}")
+        # Copia al escribir: publish recorre la tupla sin lock
+        self._subscriptions += (_Subscription(name, handler, types, maxsize, drop_oldest),)
+        
+    def publish(self, event_type: str, **data):
+        """En el hilo de Tk: O(suscriptores), sin bloquear nunca"""
+        if event_type not in self.published:
+            raise ValueError(f"evento desconocido: {event_type}")
+        if self._closed:
+            return
+        self.published[event_type] += 1
+        event = {'type': event_type, 'at': self.clock.now().isoformat(timespec='seconds'), 'data': data}
+        for sub in self._subscriptions:
+            if sub.types is not None and event_type not in sub.types:
+                continue
+            with sub.lock:
+                if len(sub.pending) >= sub.maxsize:
+                    sub.dropped += 1
+                    if not sub.drop_oldest:
+                        continue
+                    sub.pending.popleft()
+                sub.pending.append(event)
+                if sub.scheduled:
+                    continue
+                sub.scheduled = True
+            self._submit(sub)
+            
+    def _submit(self, sub: _Subscription):
+        try:
+            self._executor.submit(self._drain, sub)
+        except RuntimeError:  # Pool cerrado
+            sub.scheduled = False
+            
+    def _drain(self, sub: _Subscription):
+        for _ in range(self.DRAIN_BATCH):
+            with sub.lock:
+                if not sub.pending:
+                    sub.scheduled = False
+                    return
+                event = sub.pending.popleft()
+            try:
+                sub.handler(event)
+                sub.delivered += 1
+            except Exception as e:
+                sub.errors += 1
+                print(f"Error en suscriptor {sub.name}: {e}")
+        self._submit(sub)   # Quedan más: al final de la cola del pool
+        
+    def stats(self) -> List[tuple]:
+        """(suscriptor, en cola, entregados, descartados, errores)"""
+        return [(s.name, len(s.pending), s.delivered, s.dropped, s.errors) for s in self._subscriptions]
+    
+    def shutdown(self):
+        """Lo que está en marcha termina; lo encolado se descarta"""
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        
+    @staticmethod
+    def jsonl_hook(path: str) -> Callable[[Dict], None]:
+        def write(event: Dict):
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        return write
+    
+    @staticmethod
+    def webhook_hook(url: str, timeout: float = 5) -> Callable[[Dict], None]:
+        def post(event: Dict):
+            request = urllib.request.Request(url, data=json.dumps(event).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+        return post
+
+
+class AsyncBridge:
+    """
+    Loop de asyncio en un hilo compañero del mainloop de Tk
+    Desde Tk se lanzan corrutinas con submit(); el resultado (o el error)
+    vuelve al hilo de Tk por post_to_ui, la misma cola que usan los demás
+    workers. La E/S bloqueante va a un único hilo de E/S, así las
+    escrituras salen en orden. Al cerrar la ventana se cancela lo pendiente.
+    """
+    
+    def __init__(self, post_to_ui: Callable):
+        self.post_to_ui = post_to_ui
+        self.loop = asyncio.new_event_loop()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-io')
+        self._thread = threading.Thread(target=self.loop.run_forever, name='asyncio', daemon=True)
+        self._thread.start()
+        
+    def submit(self, coro, on_done: Optional[Callable] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Future:
+        """Programa la corrutina desde cualquier hilo; el Future permite cancelarla"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        
+        def done(f: Future):
+            if f.cancelled():
+                return
+            error = f.exception()
+            if error is not None:
+                if on_error:
+                    self.post_to_ui(on_error, error)
+                else:
+                    print(f"Error en tarea asíncrona: {error}")
+            elif on_done:
+                self.post_to_ui(on_done, f.result())
+        future.add_done_callback(done)
+        return future
+    
+    async def run_blocking(self, func: Callable, *args):
+        """Para usar dentro de una corrutina: func(*args) en el hilo de E/S"""
+        return await self.loop.run_in_executor(self._io, func, *args)
+    
+    def run_io(self, func: Callable, *args, on_done: Optional[Callable] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Future:
+        """Atajo desde Tk: una llamada bloqueante como tarea cancelable"""
+        return self.submit(self.run_blocking(func, *args), on_done, on_error)
+    
+    def shutdown(self, timeout: float = 2.0):
+        """Cancela las tareas vivas y para el loop (lo ya en el hilo de E/S termina)"""
+        if not self.loop.is_running():
+            return
+        
+        async def cancel_all():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_all(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"Error cancelando tareas asíncronas: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._io.shutdown(wait=False, cancel_futures=True)
+
+
+class RecordSchema:
+    """
+    Esquema de tareas y sesiones para la carga tolerante
+    Por campo: (tipos, obligatorio, defecto, valores permitidos). Un campo
+    opcional ausente o inválido se repara con su defecto; uno obligatorio
+    inválido manda el registro entero a cuarentena.
+    """
+    
+    LEVELS = tuple(TaskEnergyMatcher.ENERGY_LEVELS)
+    FIELDS = {
+        'task': {
+            'text': ((str,), True, None, None),
+            'difficulty': ((str,), False, 'medium', LEVELS),
+            'done': ((bool,), False, False, None),
+            'created': ((str,), False, '', None),
+        },
+        'session': {
+            'timestamp': ((str,), True, None, None),
+            'duration': ((int, float), True, None, None),
+            'task': ((str,), False, 'General', None),
+            'pauses': ((int,), False, 0, None),
+            'quality': ((int, float), False, 1.0, None),
+            'energy_level': ((str,), False, 'medium', LEVELS),
+        },
+    }
+    TIMESTAMPS = {'task': ('created', 'done_at', 'due', 'remind_at'), 'session': ('timestamp',)}
+    
+    @classmethod
+    def validate(cls, kind: str, record) -> tuple:
+        """(registro reparado o None, motivo): motivo vacío si estaba bien"""
+        fields = cls.FIELDS.get(kind)
+        if fields is None:
+            return None, f"tipo de registro desconocido: {kind}"
+        if not isinstance(record, dict):
+            return None, "no es un objeto"
+        repairs = []
+        for name, (types, required, default, allowed) in fields.items():
+            value = record.get(name)
+            ok = (isinstance(value, types) and not (bool not in types and isinstance(value, bool))
+                  and (allowed is None or value in allowed))
+            if not ok:
+                if required:
+                    return None, f"campo '{name}' ausente o inválido"
+                record[name] = default
+                repairs.append(name)
+        for name in cls.TIMESTAMPS[kind]:
+            value = record.get(name)
+            if name != 'timestamp' and not value:
+                continue
+            try:
+                datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                if name == 'timestamp':
+                    return None, f"fecha '{name}' ilegible"
+                record.pop(name)
+                repairs.append(name)
+        if kind == 'session' and record['duration'] < 0:
+            return None, "duración negativa"
+        # Identidad de sync rota: se quita y load_data vuelve a sellar
+        rev = record.get('_rev')
+        if not isinstance(record.get('uid'), str) or not (
+                isinstance(rev, list) and len(rev) == 2 and isinstance(rev[0], int)):
+            if 'uid' in record or '_rev' in record:
+                record.pop('uid', None)
+                record.pop('_rev', None)
+                repairs.append('uid')
+        return record, f"reparado: {', '.join(repairs)}" if repairs else ''
+
+
+class SnapshotFile:
+    """
+    Instantánea versionada del fichero de datos
+    Cabecera fija (magia, versión de esquema, códec) y después un registro
+    JSON compacto por línea - ["task", {...}], ["session", {...}], ["meta", {...}] -
+    comprimido en streaming con zlib o lzma. Se escribe, lee y migra
+    registro a registro; el JSON antiguo (esquema 1) se sigue leyendo.
+    """
+    
+    MAGIC = b'SFSN'
+    SCHEMA = 2
+    HEADER = struct.Struct('<4sHB')          # magia, esquema, códec
+    CODECS = ('none', 'zlib', 'lzma')
+    CHUNK = 1 << 16
+    
+    @staticmethod
+    def _upgrade_v1(kind: str, payload):
+        """Esquema 1 (JSON de un solo objeto) -> 2: las claves sueltas pasan a 'meta'"""
+        if kind == 'tasks':
+            return 'task', payload
+        if kind == 'sessions':
+            return 'session', payload
+        return 'meta', {kind: payload}
+    
+    # Versión de origen -> paso a la siguiente; se encadenan hasta SCHEMA
+    MIGRATIONS = {1: _upgrade_v1.__func__}
+    
+    @classmethod
+    def _codec(cls, codec: str) -> str:
+        if codec not in cls.CODECS:
+            raise ValueError(f"Códec desconocido: {codec}")
+        if codec == 'lzma' and lzma is None:
+            return 'zlib'
+        return codec
+    
+    @classmethod
+    def write(cls, path: str, records, codec: str = 'zlib') -> int:
+        """Escribe (kind, payload) en streaming a un temporal y lo renombra"""
+        codec = cls._codec(codec)
+        compressor = (zlib.compressobj() if codec == 'zlib' else
+                      lzma.LZMACompressor() if codec == 'lzma' else None)
+        count = 0
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.SCHEMA, cls.CODECS.index(codec)))
+                pending, size = [], 0
+                for kind, payload in records:
+                    line = json.dumps([kind, payload], separators=(',', ':'),
+                                      ensure_ascii=False).encode('utf-8') + b'\n'
+                    pending.append(line)
+                    size += len(line)
+                    count += 1
+                    if size >= cls.CHUNK:
+                        chunk = b''.join(pending)
+                        f.write(compressor.compress(chunk) if compressor else chunk)
+                        pending, size = [], 0
+                chunk = b''.join(pending)
+                f.write(compressor.compress(chunk) + compressor.flush() if compressor else chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        return count
+    
+    @classmethod
+    def read_header(cls, path: str) -> tuple:
+        """(esquema, códec); un fichero sin cabecera es el JSON antiguo"""
+        with open(path, 'rb') as f:
+            head = f.read(cls.HEADER.size)
+        if len(head) == cls.HEADER.size and head[:4] == cls.MAGIC:
+            _, schema, codec = cls.HEADER.unpack(head)
+            if schema > cls.SCHEMA or codec >= len(cls.CODECS):
+                raise ValueError(f"Instantánea de una versión más nueva (esquema {schema})")
+            return schema, cls.CODECS[codec]
+        return 1, 'none'
+    
+    @classmethod
+    def iter_records(cls, path: str, damaged: Optional[List] = None):
+        """
+        (kind, payload) uno a uno, ya migrados al esquema actual
+        Con una lista en `damaged` la lectura es tolerante: lo ilegible se
+        anota ahí como (motivo, texto) y se sigue; un corte solo termina antes.
+        """
+        schema, codec = cls.read_header(path)
+        raw = (cls._iter_legacy(path) if schema == 1 else
+               cls._iter_snapshot(path, codec, damaged))
+        try:
+            for kind, payload in raw:
+                for version in range(schema, cls.SCHEMA):
+                    kind, payload = cls.MIGRATIONS[version](kind, payload)
+                yield kind, payload
+        except (ValueError, zlib.error, EOFError) + ((lzma.LZMAError,) if lzma else ()) as e:
+            if damaged is None:
+                raise
+            damaged.append(("lectura interrumpida", str(e)))
+            
+    @classmethod
+    def _iter_batches(cls, path: str, codec: str, damaged: Optional[List] = None):
+        """Listas de líneas ya descomprimidas; lo que quede sin '\\n' sale al final"""
+        if codec == 'lzma' and lzma is None:
+            raise ValueError("Instantánea comprimida con lzma y este Python no tiene lzma")
+        decompressor = (zlib.decompressobj() if codec == 'zlib' else
+                        lzma.LZMADecompressor() if codec == 'lzma' else None)
+        carry = b''
+        with open(path, 'rb') as f:
+            f.seek(cls.HEADER.size)
+            while True:
+                chunk = f.read(cls.CHUNK)
+                if not chunk:
+                    break
+                lines = (carry + (decompressor.decompress(chunk) if decompressor else chunk)).split(b'\n')
+                carry = lines.pop()
+                yield lines
+        if damaged is not None and decompressor and not decompressor.eof:
+            damaged.append(("fichero truncado", ''))
+        if carry.strip():
+            yield [carry]
+            
+    @classmethod
+    def _iter_snapshot(cls, path: str, codec: str, damaged: Optional[List] = None):
+        for lines in cls._iter_batches(path, codec, damaged):
+            # Un json.loads por trozo, no por línea: el coste por llamada domina
+            present = list(filter(None, lines))
+            try:
+                batch = json.loads(b'[' + b','.join(present) + b']')
+                # JSON válido no basta: cada línea tiene que ser un [kind, payload]
+                if len(batch) != len(present) or not all(
+                        type(record) is list and len(record) == 2 and isinstance(record[0], str)
+                        for record in batch):
+                    raise ValueError("hay líneas que no son [kind, payload]")
+            except ValueError:
+                if damaged is None:
+                    raise
+                batch = cls._salvage_lines(lines, damaged)
+            for kind, payload in batch:
+                yield kind, payload
+                
+    @classmethod
+    def iter_lines(cls, path: str):
+        """Líneas crudas (bytes, sin parsear) de una instantánea del esquema actual"""
+        schema, codec = cls.read_header(path)
+        if schema != cls.SCHEMA:
+            raise ValueError(f"{path} no es una instantánea del esquema {cls.SCHEMA}")
+        for lines in cls._iter_batches(path, codec):
+            yield from filter(None, lines)
+            
+    @staticmethod
+    def _salvage_lines(lines: List[bytes], damaged: List) -> List:
+        """Plan B de un trozo con alguna línea rota: línea a línea"""
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not (isinstance(record, list) and len(record) == 2 and isinstance(record[0], str)):
+                    raise ValueError("no es [kind, payload]")
+                records.append(record)
+            except ValueError:
+                damaged.append(("línea ilegible", line.decode('utf-8', 'replace')))
+        return records
+            
+    @classmethod
+    def _iter_legacy(cls, path: str):
+        """
+        JSON antiguo sin cargarlo entero: raw_decode sobre un buffer que se
+        rellena a trozos. Los arrays 'tasks'/'sessions' salen elemento a
+        elemento; el resto de claves, como (clave, valor).
+        """
+        decoder = json.JSONDecoder()
+        with open(path, 'r', encoding='utf-8') as f:
+            buf, pos, eof = '', 0, False
+            
+            def fill() -> bool:
+                nonlocal buf, pos, eof
+                chunk = f.read(cls.CHUNK)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                return not eof
+            
+            def peek() -> str:
+                nonlocal pos
+                while True:
+                    while pos < len(buf) and buf[pos].isspace():
+                        pos += 1
+                    if pos < len(buf) or not fill():
+                        return buf[pos] if pos < len(buf) else ''
+                    
+            def value():
+                nonlocal pos
+                peek()
+                while True:
+                    try:
+                        result, end = decoder.raw_decode(buf, pos)
+                        # Un número al final del buffer puede seguir en el siguiente trozo
+                        if end < len(buf) or eof:
+                            pos = end
+                            return result
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    fill()
+                    
+            def expect(char: str):
+                nonlocal pos
+                if peek() != char:
+                    raise ValueError(f"JSON antiguo mal formado: se esperaba '{char}'")
+                pos += 1
+                
+            expect('{')
+            while peek() not in ('}', ''):
+                key = value()
+                expect(':')
+                if key in ('tasks', 'sessions') and peek() == '[':
+                    pos += 1
+                    while peek() not in (']', ''):
+                        yield key, value()
+                        if peek() == ',':
+                            pos += 1
+                    expect(']')
+                else:
+                    yield key, value()
+                if peek() == ',':
+                    pos += 1
+            expect('}')
+            
+    @classmethod
+    def load(cls, path: str, quarantine: Optional[List] = None) -> Dict:
+        """
+        Reconstruye el dict de siempre (tasks, sessions + claves de 'meta')
+        Con una lista en `quarantine` la carga es tolerante: cada tarea y
+        sesión se valida con RecordSchema y lo irrecuperable (registros o
+        líneas ilegibles) se deja ahí en vez de abortar la carga entera.
+        """
+        data = {'tasks': [], 'sessions': []}
+        damaged = None
+        if quarantine is not None:
+            data['repaired'], damaged = 0, []
+        for kind, payload in cls.iter_records(path, damaged):
+            if kind == 'meta':
+                if isinstance(payload, dict):
+                    data.update(payload)
+                elif quarantine is not None:
+                    quarantine.append({'kind': kind, 'reason': "meta no es un objeto", 'record': payload})
+                continue
+            if quarantine is not None:
+                record, reason = RecordSchema.validate(kind, payload)
+                if record is None:
+                    quarantine.append({'kind': kind, 'reason': reason, 'record': payload})
+                    continue
+                data['repaired'] += bool(reason)
+            if kind == 'task':
+                data['tasks'].append(payload)
+            elif kind == 'session':
+                data['sessions'].append(payload)
+        for reason, raw in damaged or ():
+            quarantine.append({'kind': None, 'reason': reason, 'raw': raw})
+        return data
+    
+    @classmethod
+    def migrate(cls, source: str, target: str, codec: str = 'zlib',
+                damaged: Optional[List] = None) -> tuple:
+        """
+        Actualiza un fichero (JSON antiguo o instantánea vieja) registro a registro
+        Devuelve (registros, códec escrito): sin el módulo lzma se cae a zlib.
+        """
+        codec = cls._codec(codec)
+        return cls.write(target, cls.iter_records(source, damaged), codec), codec
+
+
+class BackupStore:
+    """
+    Copias de seguridad incrementales del fichero de datos
+    Cada punto guarda solo lo que cambió desde el anterior: las líneas nuevas
+    de la instantánea (con su posición), el hash de las que desaparecieron y
+    los bytes que se añadieron al archivo de sesiones (que solo crece). Cada
+    FULL_EVERY puntos empieza una cadena nueva con una copia completa; se
+    conservan KEEP_CHAINS cadenas. Cada punto lleva el sha256 de su fichero
+    y el del estado que reconstruye, y ambos se comprueban al restaurar.
+    """
+    
+    FULL_EVERY = 50
+    KEEP_CHAINS = 3
+    
+    def __init__(self, directory: str, clock: Optional[Clock] = None):
+        self.directory = directory
+        self.clock = clock or Clock()
+        self.manifest_path = os.path.join(directory, 'manifest.jsonl')
+        # Último punto: hashes de línea en orden, bytes de archivo, seq, base y largo de su cadena
+        self._state: Optional[tuple] = None
+        
+    @staticmethod
+    def _line_hash(line: bytes) -> str:
+        return hashlib.blake2b(line, digest_size=8).hexdigest()
+    
+    @staticmethod
+    def _state_digest(hashes, archive_bytes: int) -> str:
+        digest = hashlib.sha256(b'\n'.join(h.encode('ascii') for h in sorted(hashes)))
+        digest.update(str(archive_bytes).encode('ascii'))
+        return digest.hexdigest()
+    
+    def entries(self) -> List[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return []
+        entries = []
+        with open(self.manifest_path, 'r') as f:
+            for line in f:
+                if line.endswith('\n'):  # Una línea a medias es un punto que no llegó a existir
+                    entries.append(json.loads(line))
+        return entries
+    
+    def _read_point(self, entry: Dict) -> Dict:
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            blob = f.read()
+        if hashlib.sha256(blob).hexdigest() != entry['sha256']:
+            raise ValueError(f"Copia {entry['seq']} dañada (sha256 no coincide)")
+        return json.loads(zlib.decompress(blob))
+    
+    def _chain(self, entries: List[Dict], seq: int) -> List[Dict]:
+        """Copia completa + deltas hasta `seq` (inclusive)"""
+        by_seq = {e['seq']: e for e in entries}
+        if seq not in by_seq:
+            raise ValueError(f"No existe la copia {seq}")
+        base = by_seq[seq]['base']
+        return [e for e in entries if e['base'] == base and e['seq'] <= seq]
+    
+    def _replay(self, chain: List[Dict]) -> tuple:
+        """(líneas por hash en el orden de la instantánea, trozos del archivo) tras aplicar la cadena"""
+        lines: Dict[str, bytes] = {}
+        order: List[str] = []
+        archive = []
+        for entry in chain:
+            point = self._read_point(entry)
+            removed = set(point['removed'])
+            for h in removed:
+                lines.pop(h, None)
+            if removed:
+                order = [h for h in order if h not in removed]
+            # Las líneas que siguen conservan su orden relativo: insertar las nuevas
+            # en su posición (ascendente) reproduce el orden del fichero
+            positions = point.get('positions')   # Puntos antiguos: sin posición, al final
+            for i, text in enumerate(point['added']):
+                line = text.encode('utf-8')
+                h = self._line_hash(line)
+                lines[h] = line
+                if positions is None:
+                    order.append(h)
+                else:
+                    order.insert(positions[i], h)
+            archive.append(point['archive'].encode('utf-8'))
+        return {h: lines[h] for h in order}, archive
+    
+    def _load_state(self):
+        """Hashes del último punto (una vez por arranque: repasa solo su cadena)"""
+        self._state = ([], 0, 0, 0, 0)
+        entries = self.entries()
+        if not entries:
+            return
+        last = entries[-1]
+        try:
+            chain = self._chain(entries, last['seq'])
+            lines, _ = self._replay(chain)
+            self._state = (list(lines), last['archive_bytes'], last['seq'], last['base'], len(chain))
+        except (OSError, ValueError, zlib.error) as e:
+            # Sin base fiable: el próximo punto será una copia completa
+            print(f"Error leyendo copias de seguridad: {e}")
+            self._state = ([], 0, last['seq'], 0, self.FULL_EVERY)
+            
+    def take(self, snapshot_path: str, archive_path: str) -> Optional[Dict]:
+        """Nuevo punto de copia; None si nada cambió. Requiere tener el lock tomado."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Otra instancia pudo añadir puntos: el manifiesto manda
+        entries = self.entries()
+        if self._state is None or self._state[2] != (entries[-1]['seq'] if entries else 0):
+            self._load_state()
+        prev_order, prev_archive, prev_seq, base, chain_len = self._state
+        prev_hashes = set(prev_order)
+        current = {self._line_hash(line): line for line in SnapshotFile.iter_lines(snapshot_path)}
+        archive_bytes = os.path.getsize(archive_path) if os.path.exists(archive_path) else 0
+        # Un delta solo sabe colocar líneas nuevas: si las que siguen cambiaron de orden
+        # entre sí (p. ej. tras fusionar con otra instancia), hace falta una copia completa
+        reordered = [h for h in prev_order if h in current] != [h for h in current if h in prev_hashes]
+        # Cadena nueva al llegar al límite o si el archivo se reemplazó (restauración)
+        full = chain_len >= self.FULL_EVERY or archive_bytes < prev_archive or not prev_seq or reordered
+        if full:
+            prev_hashes, prev_archive = set(), 0
+        added = [line for h, line in current.items() if h not in prev_hashes]
+        positions = [i for i, h in enumerate(current) if h not in prev_hashes]
+        removed = [h for h in prev_hashes if h not in current]
+        if not full and not removed and archive_bytes == prev_archive and all(
+                line.startswith(b'["meta"') for line in added):
+            return None  # Solo cambió 'last_save'
+        archive = b''
+        if archive_bytes > prev_archive:
+            with open(archive_path, 'rb') as f:
+                f.seek(prev_archive)
+                archive = f.read(archive_bytes - prev_archive)
+            archive = archive[:archive.rfind(b'\n') + 1]  # Solo líneas completas
+            archive_bytes = prev_archive + len(archive)
+            
+        seq = prev_seq + 1
+        base = seq if full else base
+        point = {
+            'added': [line.decode('utf-8') for line in added],
+            'positions': positions,
+            'removed': removed,
+            'archive': archive.decode('utf-8'),
+        }
+        blob = zlib.compress(json.dumps(point, ensure_ascii=False).encode('utf-8'))
+        entry = {
+            'seq': seq,
+            'base': base,
+            'kind': 'full' if full else 'delta',
+            'file': f"{seq:06d}-{'full' if full else 'delta'}.bak",
+            'created': self.clock.now().isoformat(timespec='seconds'),
+            'bytes': len(blob),
+            'sha256': hashlib.sha256(blob).hexdigest(),
+            'archive_bytes': archive_bytes,
+            'state': self._state_digest(current, archive_bytes),
+        }
+        tmp_path = os.path.join(self.directory, entry['file'] + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, entry['file']))
+        # El punto existe cuando su línea del manifiesto está completa en disco
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._state = (list(current), archive_bytes, seq, base, 1 if full else chain_len + 1)
+        if full:
+            self.prune()
+        return entry
+    
+    def prune(self):
+        """Borra las cadenas que sobran (el manifiesto se reescribe atómicamente)"""
+        entries = self.entries()
+        bases = sorted({e['base'] for e in entries})
+        keep = set(bases[-self.KEEP_CHAINS:])
+        if len(keep) == len(bases):
+            return
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in entries:
+                if entry['base'] in keep:
+                    f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        for entry in entries:
+            if entry['base'] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, entry['file']))
+                except OSError:
+                    pass
+                    
+    def restore(self, seq: int, snapshot_path: str, archive_path: str) -> str:
+        """
+        Reconstruye instantánea y archivo tal como estaban en el punto `seq`
+        El binario y las etiquetas del archivo se borran: se regeneran al abrir.
+        """
+        entries = self.entries()
+        chain = self._chain(entries, seq)
+        target = chain[-1]
+        lines, archive = self._replay(chain)
+        archive = b''.join(archive)
+        if self._state_digest(lines, len(archive)) != target['state']:
+            raise ValueError(f"La copia {seq} no reconstruye el estado esperado")
+        # Las líneas ya vienen en el orden del fichero; el sort (estable) solo
+        # agrupa meta, tareas y sesiones en cadenas con puntos antiguos sin posición
+        records = [tuple(json.loads(line)) for line in lines.values()]
+        order = {'meta': 0, 'task': 1, 'session': 2}
+        records.sort(key=lambda r: order.get(r[0], 3))
+        SnapshotFile.write(snapshot_path, records)
+        tmp_path = archive_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(archive)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, archive_path)
+        records_path = os.path.splitext(archive_path)[0] + '.bin'
+        for derived in (records_path, os.path.splitext(records_path)[0] + '_labels.jsonl'):
+            if os.path.exists(derived):
+                os.remove(derived)
+        self._state = None
+        return (f"Restaurada la copia {seq} ({target['created']}): "
+                f"{len(records)} registros, {len(archive)} B de archivo, {len(chain)} puntos aplicados")
+
+
+class EventLog:
+    """
+    Historial de deshacer/rehacer como log de eventos invertibles
+    Cada evento lista cambios (kind, uid, antes, después) con el estado
+    completo del registro, así deshacer aplica 'antes' y rehacer 'después'
+    por uid, en O(1). En RAM solo vive un anillo de los últimos RING eventos;
+    en disco se añaden líneas (eventos y marcas de undo/redo) y el fichero
+    se compacta al anillo cuando crece demasiado.
+    """
+    
+    RING = 100
+    COMPACT_AFTER = 500
+    
+    def __init__(self, path: str, clock: Optional[Clock] = None):
+        self.path = path
+        self.clock = clock or Clock()
+        self.done = deque(maxlen=self.RING)
+        self.undone = deque(maxlen=self.RING)
+        self.next_id = 1
+        self._lines = 0
+        self._load()
+        
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Línea a medio escribir
+                self._lines += 1
+                if 'event' in entry:
+                    self.done.append(entry['event'])
+                    self.undone.clear()
+                    self.next_id = entry['event']['id'] + 1
+                elif 'undo' in entry and self.done:
+                    self.undone.append(self.done.pop())
+                elif 'redo' in entry and self.undone:
+                    self.done.append(self.undone.pop())
+                elif 'drop' in entry and self.done:   # Logs de versiones anteriores
+                    self.done.pop()
+                    
+    def _append(self, entry: Dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._lines += 1
+        if self._lines > self.COMPACT_AFTER:
+            self.compact()
+            
+    def compact(self):
+        """Reescribe el log con solo el anillo (mismas pilas al recargar)"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for event in chain(self.done, reversed(self.undone)):
+                f.write(json.dumps({'event': event}, ensure_ascii=False) + '\n')
+            for event in self.undone:
+                f.write(json.dumps({'undo': event['id']}) + '\n')
+        os.replace(tmp_path, self.path)
+        self._lines = len(self.done) + 2 * len(self.undone)
+        
+    def record(self, label: str, changes: List[tuple]) -> Dict:
+        """changes: [(kind, uid, antes, después)]; antes/después None = no existe"""
+        event = {
+            'id': self.next_id,
+            'label': label,
+            'at': self.clock.now().isoformat(timespec='seconds'),
+            'changes': [list(change) for change in changes],
+        }
+        self.next_id += 1
+        self.done.append(event)
+        self.undone.clear()
+        self._append({'event': event})
+        return event
+    
+    def peek_undo(self) -> Optional[Dict]:
+        return self.done[-1] if self.done else None
+    
+    def peek_redo(self) -> Optional[Dict]:
+        return self.undone[-1] if self.undone else None
+    
+    def undo(self) -> Dict:
+        event = self.done.pop()
+        self.undone.append(event)
+        self._append({'undo': event['id']})
+        return event
+    
+    def redo(self) -> Dict:
+        event = self.undone.pop()
+        self.done.append(event)
+        self._append({'redo': event['id']})
+        return event
+
+
+class DataFileLock:
+    """
+    Lock advisory entre procesos sobre el fichero de datos
+    Usa un fichero .lock aparte porque los guardados reemplazan el de datos
+    (os.replace) y un flock sobre el inodo viejo no protegería nada.
+    Sin fcntl (Windows) degrada a no-op.
+    """
+    
+    def __init__(self, data_file: str, shared: bool = False):
+        self.path = data_file + '.lock'
+        self.shared = shared
+        self._fd = None
+        
+    def __enter__(self):
+        if fcntl:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+        
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+    
+    @staticmethod
+    def signature(path: str) -> Optional[tuple]:
+        """Huella barata para detectar escrituras de otra instancia"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class DeviceLease:
+    """
+    Id de dispositivo de sync propio de cada proceso sobre un fichero de datos
+    Dos instancias abiertas sobre el mismo fichero no pueden compartir id:
+    cada una numera sus cambios por su cuenta y el servidor descartaría los
+    seq repetidos. Los ids se guardan en un pool junto al fichero de datos
+    (fuera de la instantánea compartida) y cada proceso toma uno libre con
+    un flock propio; así se reutilizan entre arranques y no crecen. Sin
+    fcntl (Windows) no hay lease: se usa el id de la instantánea, como antes.
+    """
+    
+    def __init__(self, data_file: str):
+        self.pool_path = os.path.splitext(data_file)[0] + '_devices.json'
+        self.device_id: Optional[str] = None
+        self._fd = None
+        
+    def _lock_path(self, device_id: str) -> str:
+        return f"{self.pool_path}.{device_id}.lock"
+    
+    def claim(self) -> Optional[str]:
+        """Toma el primer id libre del pool (o crea uno); None sin fcntl"""
+        if not fcntl or self.device_id:
+            return self.device_id
+        with DataFileLock(self.pool_path):
+            try:
+                with open(self.pool_path, 'r') as f:
+                    devices = [d for d in json.load(f).get('devices', []) if isinstance(d, str)]
+            except FileNotFoundError:
+                devices = []
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"Error leyendo el pool de dispositivos (se empieza otro): {e}")
+                devices = []
+            for device_id in devices:
+                fd = os.open(self._lock_path(device_id), os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)   # En uso por otra instancia viva
+                    continue
+                self._fd, self.device_id = fd, device_id
+                return device_id
+            device_id = uuid.uuid4().hex[:12]
+            self._fd = os.open(self._lock_path(device_id), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            tmp = self.pool_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'devices': devices + [device_id]}, f)
+            os.replace(tmp, self.pool_path)
+            self.device_id = device_id
+            return device_id
+        
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.device_id = None
+
+
+class ProfileStore:
+    """
+    Perfiles de estudiante para equipos compartidos (modo laboratorio)
+    Cada perfil tiene su carpeta con su fichero de datos y todos sus
+    auxiliares (archivo, copias, deshacer). Un índice pequeño y común
+    (nombre, último uso y un resumen) basta para pintar el selector sin
+    abrir ningún perfil: los datos completos se cargan solo al elegirlo.
+    """
+    
+    INDEX = 'profiles.json'
+    DATA_NAME = 'studyflow_v2_data.sfs'
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, self.INDEX)
+        os.makedirs(directory, exist_ok=True)
+        
+    @classmethod
+    def from_env(cls) -> Optional['ProfileStore']:
+        directory = os.environ.get('STUDYFLOW_PROFILES_DIR')
+        return cls(directory) if directory else None
+    
+    def _read(self) -> List[Dict]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                profiles = json.load(f).get('profiles', [])
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Error leyendo el índice de perfiles: {e}")
+            return []
+        return [p for p in profiles if isinstance(p, dict) and 'id' in p and 'name' in p]
+    
+    def _write(self, profiles: List[Dict]):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'profiles': profiles}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_path)
+        
+    def list(self) -> List[Dict]:
+        """Perfiles por último uso (solo el índice)"""
+        with DataFileLock(self.index_path, shared=True):
+            profiles = self._read()
+        return sorted(profiles, key=lambda p: p.get('last_used', ''), reverse=True)
+    
+    def create(self, name: str) -> Dict:
+        name = ' '.join(name.split())
+        if not name:
+            raise ValueError("el nombre está vacío")
+        slug = re.sub(r'[^a-z0-9]+', '-', TaskSearchIndex.fold(name)).strip('-')[:24] or 'perfil'
+        with DataFileLock(self.index_path):
+            profiles = self._read()
+            if any(TaskSearchIndex.fold(p['name']) == TaskSearchIndex.fold(name) for p in profiles):
+                raise ValueError(f"ya existe un perfil llamado {name}")
+            profile = {'id': f"{slug}-{uuid.uuid4().hex[:6]}", 'name': name,
+                       'created': datetime.now().isoformat(timespec='seconds'), 'last_used': '',
+                       'tasks_open': 0, 'sessions': 0}
+            profiles.append(profile)
+            self._write(profiles)
+        return profile
+    
+    def update(self, profile_id: str, **fields) -> Optional[Dict]:
+        """Actualiza la entrada del índice (último uso, resumen para el selector)"""
+        with DataFileLock(self.index_path):
+            profiles = self._read()
+            for profile in profiles:
+                if profile['id'] == profile_id:
+                    profile.update(fields)
+                    self._write(profiles)
+                    return profile
+        return None
+    
+    def data_file(self, profile_id: str) -> str:
+        folder = os.path.join(self.directory, profile_id)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, self.DATA_NAME)
+
+
+class SyncEngine:
+    """
+    Sincronización delta entre dispositivos con version vectors
+    Cada cambio local recibe (dispositivo, seq) y solo viaja lo que el otro
+    lado aún no ha visto. Conflictos: last-writer-wins con reloj de Lamport
+    y desempate por id de dispositivo, así todas las copias convergen igual.
+    """
+    
+    def __init__(self, state: Optional[Dict] = None, device_id: Optional[str] = None):
+        state = state or {}
+        # Cada proceso que comparte el fichero de datos tiene su propio id (DeviceLease)
+        self.device_id = device_id or state.get('device_id') or uuid.uuid4().hex[:12]
+        self.clock = state.get('clock', 0)    # Reloj de Lamport compartido
+        self.vv = dict(state.get('vv', {}))   # dispositivo -> último seq visto
+        own_seq = state.get('seq', 0) if state.get('device_id') == self.device_id else 0
+        self.seq = max(own_seq, self.vv.get(self.device_id, 0))   # Cambios de ESTE dispositivo
+        # (kind, uid) -> (dispositivo, seq) del último cambio local sin confirmar por el
+        # servidor (el dispositivo puede ser otra instancia que ya cerró sin enviarlo)
+        self.pending = {}
+        for entry in state.get('pending', []):
+            kind, uid, seq = entry[:3]
+            self.pending[(kind, uid)] = (entry[3] if len(entry) > 3 else state.get('device_id'), seq)
+            
+    def to_state(self) -> Dict:
+        return {
+            'device_id': self.device_id,
+            'seq': self.seq,
+            'clock': self.clock,
+            'vv': self.vv,
+            'pending': [[k, u, seq, device] for (k, u), (device, seq) in self.pending.items()]
+        }
+        
+    def stamp(self, kind: str, record: Dict):
+        """Marca un registro modificado localmente (le asigna uid si no tiene)"""
+        if 'uid' not in record:
+            record['uid'] = f"{self.device_id}-{uuid.uuid4().hex[:8]}"
+        self.clock += 1
+        self.seq += 1
+        record['_rev'] = [self.clock, self.device_id]
+        self.vv[self.device_id] = self.seq
+        self.pending[(kind, record['uid'])] = (self.device_id, self.seq)
+        
+    def build_push(self, lookup: Callable[[str, str], Optional[Dict]]) -> Dict:
+        """Paquete para el servidor: O(cambios pendientes), no O(historial)"""
+        changes = []
+        for (kind, uid), (device, seq) in sorted(self.pending.items(), key=lambda kv: kv[1][1]):
+            record = lookup(kind, uid)
+            if record is None:
+                # Ya no existe (p. ej. reparado en la carga): nada que enviar, ni que reintentar
+                del self.pending[(kind, uid)]
+                continue
+            changes.append({'kind': kind, 'uid': uid, 'device': device,
+                            'seq': seq, 'record': dict(record)})
+        return {'device': self.device_id, 'vv': dict(self.vv), 'changes': changes}
+        
+    def acknowledge(self, pushed: List[Dict]):
+        """Olvida los cambios confirmados (salvo que se hayan vuelto a editar)"""
+        for change in pushed:
+            key = (change['kind'], change['uid'])
+            if self.pending.get(key) == (change['device'], change['seq']):
+                del self.pending[key]
+                
+    def observe(self, change: Dict) -> bool:
+        """Avanza vv y reloj con un cambio remoto; False si ya se había visto"""
+        device, seq = change['device'], change['seq']
+        if device == self.device_id or seq <= self.vv.get(device, 0):
+            return False
+        self.vv[device] = seq
+        self.clock = max(self.clock, change['record'].get('_rev', [0])[0])
+        return True
+        
+    def discard_pending(self, kind: str, uid: str):
+        self.pending.pop((kind, uid), None)
+        
+    def absorb_state(self, state: Dict):
+        """Une el estado de otra instancia que comparte este fichero de datos"""
+        self.clock = max(self.clock, state.get('clock', 0))
+        for device, seq in state.get('vv', {}).items():
+            self.vv[device] = max(self.vv.get(device, 0), seq)
+        # Sus cambios sin enviar viajan con su propio (dispositivo, seq); los nuestros mandan
+        for entry in state.get('pending', []):
+            kind, uid, seq = entry[:3]
+            device = entry[3] if len(entry) > 3 else state.get('device_id')
+            if device == self.device_id:
+                continue
+            local = self.pending.get((kind, uid))
+            if local is None or (local[0] == device and seq > local[1]):
+                self.pending[(kind, uid)] = (device, seq)
+        
+    @staticmethod
+    def wins(remote: Dict, local: Dict) -> bool:
+        """Orden total determinista: (lamport, dispositivo)"""
+        return tuple(remote.get('_rev', (0, ''))) > tuple(local.get('_rev', (0, '')))
+
+
+class _SyncHandler(BaseHTTPRequestHandler):
+    """POST /sync con {device, vv, changes} -> {changes, vv}"""
+    
+    def do_POST(self):
+        if self.path != '/sync':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+            result = self.server.sync_server.exchange(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, format, *args):
+        pass
+
+
+class SyncServer:
+    """
+    Servidor de sincronización mínimo (local o autoalojado)
+    Guarda un log de cambios por dispositivo ordenado por seq; a cada cliente
+    le devuelve solo lo posterior a su version vector (bisect por dispositivo).
+    Uso: python main.py --sync-server --port 8765
+    """
+    
+    def __init__(self, port: int = 8765, host: str = '127.0.0.1', log_path: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.log_path = log_path
+        self.logs: Dict[str, List[Dict]] = {}   # dispositivo -> cambios
+        self.seqs: Dict[str, List[int]] = {}    # dispositivo -> seqs (para bisect)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        
+        if log_path and os.path.exists(log_path):
+            with open(log_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self._append(json.loads(line))
+                        
+    def _append(self, change: Dict) -> bool:
+        seqs = self.seqs.setdefault(change['device'], [])
+        if seqs and change['seq'] <= seqs[-1]:
+            return False  # Reintento de un cambio ya recibido
+        seqs.append(change['seq'])
+        self.logs.setdefault(change['device'], []).append(change)
+        return True
+        
+    def exchange(self, payload: Dict) -> Dict:
+        device = payload['device']
+        client_vv = payload.get('vv', {})
+        with self._lock:
+            accepted = [c for c in payload.get('changes', []) if self._append(c)]
+            if accepted and self.log_path:
+                with open(self.log_path, 'a') as f:
+                    for change in accepted:
+                        f.write(json.dumps(change) + '\n')
+                        
+            outgoing = []
+            for other, seqs in self.seqs.items():
+                if other == device:
+                    continue
+                start = bisect.bisect_right(seqs, client_vv.get(other, 0))
+                outgoing.extend(self.logs[other][start:])
+            server_vv = {d: seqs[-1] for d, seqs in self.seqs.items() if seqs}
+        return {'changes': outgoing, 'vv': server_vv}
+        
+    def start(self):
+        """Arranca en un hilo de fondo (útil para tests)"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _SyncHandler)
+        self._server.daemon_threads = True
+        self._server.sync_server = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever,
+                         name='sync-server', daemon=True).start()
+        
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            
+    def serve_forever(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _SyncHandler)
+        self._server.sync_server = self
+        print(f"Servidor de sync en http://{self.host}:{self.port}/sync")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+
+class SyncClient:
+    """Transporte HTTP al servidor de sync, siempre fuera del hilo de Tk"""
+    
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url.rstrip('/') + '/sync'
+        self.timeout = timeout
+        
+    @classmethod
+    def from_env(cls) -> Optional['SyncClient']:
+        """Crea el cliente solo si STUDYFLOW_SYNC_URL está definido"""
+        url = os.environ.get('STUDYFLOW_SYNC_URL')
+        return cls(url) if url else None
+        
+    def exchange(self, payload: Dict) -> Dict:
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+        
+    def exchange_async(self, payload: Dict, on_done: Callable[[Optional[Dict], Optional[Exception]], None]):
+        """on_done se llama desde el hilo de fondo: usar post_to_ui para tocar Tk"""
+        def worker():
+            try:
+                on_done(self.exchange(payload), None)
+            except Exception as e:
+                on_done(None, e)
+        threading.Thread(target=worker, name='sync-client', daemon=True).start()
+
+
+class TimeWarpSimulator:
+    """
+    Simulador de uso acelerado para pruebas de carga
+    Recorre miles de días con un SimulatedClock sobre una instancia sin Tk
+    de la app (StudyFlowV2.headless): altas y borrados de tareas, fin de
+    sesión, guardado con fusión, archivo, copias y log de deshacer pasan por
+    el mismo código que en la app. Solo el usuario es simulado (energía,
+    distracciones ante el FocusGuardian, pausas). Guarda una vez por semana
+    simulada en vez de tras cada cambio, para que años de historial tarden
+    segundos.
+    """
+    
+    # Pesos de energía (high, medium, low, minimal) por franja horaria
+    ENERGY_BY_HOUR = [
+        (range(6, 12), (5, 3, 1, 1)),
+        (range(12, 16), (2, 4, 3, 1)),
+        (range(16, 20), (2, 4, 2, 2)),
+        (range(20, 24), (1, 2, 4, 3)),
+    ]
+    DISTRACTION = {'high': 0.02, 'medium': 0.04, 'low': 0.07, 'minimal': 0.1}   # Por minuto
+    SAVE_EVERY = 7   # Días simulados entre guardados (con su copia de seguridad)
+    
+    @staticmethod
+    def data_file_in(directory: str) -> str:
+        return os.path.join(directory, 'studyflow_v2_data.sfs')
+    
+    def __init__(self, directory: str, seed: int = 0, start: Optional[datetime] = None):
+        self.rng = random.Random(seed)
+        self.clock = SimulatedClock(start or datetime(2020, 1, 1, 6, 0))
+        self.data_file = self.data_file_in(directory)
+        self.app = StudyFlowV2.headless(self.data_file, self.clock)
+        self.matcher = self.app.energy_matcher   # Con el DurationModel de la app
+        self.guardian = FocusGuardian(queue.Queue(), self.clock)
+        self.counts = {'days': 0, 'skipped': 0, 'sessions': 0, 'tasks': 0, 'done': 0,
+                       'deleted': 0, 'mild': 0, 'severe': 0, 'trace_bytes': 0}
+        
+    def run(self, days: int) -> Dict:
+        started = time.perf_counter()
+        for day in range(1, days + 1):
+            self.simulate_day()
+            if day % self.SAVE_EVERY == 0:
+                self.save()
+        self.save()
+        self.counts['seconds'] = round(time.perf_counter() - started, 3)
+        return dict(self.counts)
+    
+    def simulate_day(self):
+        today = self.clock.today()
+        midnight = datetime.combine(today, datetime.min.time())
+        self.counts['days'] += 1
+        self.churn_tasks()
+        skip = 0.35 if today.weekday() >= 5 else 0.15
+        if self.rng.random() < skip:
+            self.counts['skipped'] += 1
+        else:
+            hours = sorted(self.rng.sample(range(7, 23), self.rng.randint(1, 6)))
+            for hour in hours:
+                self.clock.advance_to(midnight + timedelta(hours=hour, minutes=self.rng.randint(0, 30)))
+                self.study_session()
+        self.clock.advance_to(midnight + timedelta(days=1, hours=6))
+        
+    def churn_tasks(self):
+        """Altas diarias y, de vez en cuando, borrado (lápida) de una hecha"""
+        app = self.app
+        created = self.clock.now().isoformat()
+        for _ in range(self.rng.choices((0, 1, 2, 4), (3, 4, 2, 1))[0]):
+            task = {'id': len(app.tasks), 'text': f"Tarea simulada {len(app.tasks)}",
+                    'difficulty': self.rng.choice(list(TaskEnergyMatcher.ENERGY_LEVELS)),
+                    'done': False, 'created': created}
+            app.add_task_record(task)
+            app.event_log.record("Añadir tarea", [('task', task['uid'], None, dict(task))])
+            self.counts['tasks'] += 1
+        if self.rng.random() < 0.3:
+            done = [t for t in app.tasks[-50:] if t['done'] and not t.get('deleted')]
+            if done:
+                task = self.rng.choice(done)
+                app.update_tasks([task['uid']], "Borrar tarea", lambda t: t.update(deleted=True))
+                self.counts['deleted'] += 1
+                
+    def pick_energy(self, hour: int) -> str:
+        weights = next((w for hours, w in self.ENERGY_BY_HOUR if hour in hours), (1, 1, 1, 1))
+        return self.rng.choices(list(TaskEnergyMatcher.ENERGY_LEVELS), weights)[0]
+    
+    def study_session(self):
+        """Una sesión completa, minuto a minuto, con las revisiones del FocusGuardian"""
+        energy = self.pick_energy(self.clock.now().hour)
+        self.matcher.set_energy(energy)
+        duration = self.matcher.get_recommended_duration()
+        pending = [t for t in self.app.tasks[-100:] if not t['done'] and not t.get('deleted')]
+        matching = [t for t in pending if self.matcher.get_task_suggestion(t['difficulty']) == 'match']
+        task = self.rng.choice(matching or pending) if pending else None
+        
+        self.guardian.register_interaction()
+        trace = FocusTrace(self.clock.time())
+        idle = 0
+        pauses = 0
+        for _ in range(duration):
+            if idle:
+                idle -= 1
+            elif self.rng.random() < self.DISTRACTION[energy]:
+                idle = self.rng.randint(1, 5)
+            else:
+                self.guardian.register_interaction()
+            for _ in range(2):
+                self.clock.advance(self.guardian.check_interval)
+                self.guardian.check()
+                while not self.guardian.message_queue.empty():
+                    level, (_, idle_time) = self.guardian.message_queue.get_nowait()
+                    self.counts[level] += 1
+                    trace.record(level, self.clock.time(), idle_time)
+                    if level == 'severe':   # Tras un aviso fuerte, a veces se pausa
+                        if self.rng.random() < 0.5:
+                            pauses += 1
+                            trace.record('pause', self.clock.time())
+                            self.clock.advance(self.rng.randint(30, 300))
+                            trace.record('resume', self.clock.time())
+                        idle = 0
+                        self.guardian.register_interaction()
+                        
+        session = {
+            'timestamp': self.clock.now().isoformat(),
+            'duration': duration,
+            'task': task['text'] if task else "General",
+            'pauses': pauses,
+            'quality': trace.quality(self.clock.time()),
+            'energy_level': energy,
+            'trace': trace.to_text()
+        }
+        self.counts['trace_bytes'] += len(session['trace'])
+        if task:
+            session['task_uid'] = task['uid']
+        # No siempre se acaba la tarea con la que se estudió
+        finished = task if task and self.rng.random() < 0.6 else None
+        self.app.complete_session(session, finished)
+        self.counts['sessions'] += 1
+        if finished:
+            self.counts['done'] += 1
+            
+    def save(self):
+        """Como tras una sesión en la app: guardado (archiva lo que sobra) y copia"""
+        app = self.app
+        app.persist()
+        StudyFlowV2.take_backup(app.backups, app.data_file, app.session_archive.path)
+        
+    def stress(self) -> str:
+        """Mide con lo generado: cargar la instantánea, reabrir el archivo y analizar"""
+        archive, sessions = self.app.session_archive, self.app.sessions_history
+        
+        def timed(label: str, func) -> str:
+            started = time.perf_counter()
+            result = func()
+            return f"{label:22} {time.perf_counter() - started:8.4f}s  {result}"
+        
+        def load():
+            data = SnapshotFile.load(self.data_file)
+            return f"{len(data['tasks'])} tareas, {len(data['sessions'])} sesiones"
+        
+        def analytics():
+            acc = {}
+            _merge_analytics(acc, _analytics_records_partial(archive.records.path, 0,
+                                                            len(archive.records)))
+            _merge_analytics(acc, _aggregate((datetime.fromisoformat(s['timestamp']), s['duration'],
+                                              s['pauses'], s['quality'], s['energy_level'])
+                                             for s in sessions))
+            return f"{acc['sessions']} sesiones analizadas"
+        
+        dashboard = DashboardBuilder(os.path.splitext(self.data_file)[0] + '_dashboard',
+                                     archive.records.path)
+        
+        def build(full: bool):
+            records = archive.records
+            result = dashboard.build(len(records), list(records.labels),
+                                     DashboardBuilder.recent_rows(sessions), self.clock.now(), full)
+            return f"{result['written']} de {result['weeks']} semanas escritas"
+        
+        return '\n'.join([
+            f"instantánea {os.path.getsize(self.data_file)} B • archivo "
+            f"{os.path.getsize(archive.path) if os.path.exists(archive.path) else 0} B",
+            timed("cargar instantánea", load),
+            timed("reabrir archivo", lambda: f"{SessionArchive(archive.path).count} archivadas"),
+            timed("análisis completo", analytics),
+            timed("panel HTML completo", lambda: build(True)),
+            timed("panel HTML sin cambios", lambda: build(False)),
+        ])
+
+
 class StudyFlowV2:
     """
     Aplicación principal v2.1 - THREAD SAFE
     Rediseñada desde cero con principios de UX para neurodivergencia
     """
     
-    def __init__(self, root):
+    # Filas de tareas que se dibujan a la vez (el resto se alcanza buscando)
+    MAX_VISIBLE_TASKS = 200
+    ROW_CACHE = 100   # Filas construidas que se guardan fuera de la vista
+    IMPORT_CHUNK = 100   # Tareas por commit (render + guardado) al importar
+    # Sesiones que viven en RAM; las más antiguas van al archivo
+    RECENT_SESSIONS = 500
+    SPILL_BATCH = 100
+    
+    def __init__(self, root, clock: Optional[Clock] = None, profiles: Optional[ProfileStore] = None):
         self.root = root
+        self.clock = clock or Clock()   # Inyectable: el simulador usa uno virtual
         self.root.title("StudyFlow TDAH v2.1 - Modo Cerebro Galáctico")
         self.root.geometry("1100x800")
         self.root.minsize(1000, 700)
@@ -255,10 +3712,12 @@ class StudyFlowV2:
         }
         
         # Sistemas
-        self.reward_system = DopamineRewardSystem()
-        self.energy_matcher = TaskEnergyMatcher()
+        self.energy_matcher = TaskEnergyMatcher(clock=self.clock)
         self.body_doubling = BodyDoublingRoom()
         
+        # Eventos del ciclo de vida para integraciones (corren fuera del hilo de Tk)
+        self.event_bus = EventBus.from_env(self.clock)
+        
         # Cola para mensajes thread-safe
         self.msg_queue = queue.Queue()
         self.focus_guardian: Optional[FocusGuardian] = None
@@ -269,33 +3728,144 @@ class StudyFlowV2:
         self.current_task: Optional[Dict] = None
         self.session_start_time: Optional[datetime] = None
         self.pause_count = 0
-        
-        # Datos
-        self.tasks: List[Dict] = []
-        self.sessions_history: List[Dict] = []
+        self.focus_trace: Optional[FocusTrace] = None   # Eventos de la sesión en curso
+        self.timer_telemetry: Optional[TimerTelemetry] = None
+        self.last_timing: Dict = {}   # Precisión del timer en la última sesión
+        
+        # Datos (lo ligado a un fichero lo prepara open_store: se rehace al cambiar de perfil)
+        self.data_version = 0   # Sube con cada cambio: clave de las cachés de análisis
+        self.device_lease: Optional[DeviceLease] = None   # Id de sync de este proceso
+        self._task_rows: Dict[str, tuple] = {}   # uid -> (frame, firma), de menos a más reciente
+        self._visible_task_order: List[str] = []
+        self._selected_tasks = set()   # uids marcados para acciones en lote
+        self._subtask_parent: Optional[Dict] = None   # De quién cuelga la próxima tarea
+        self.reminders = ReminderScheduler(self.root.after, self.root.after_cancel,
+                                           self.on_reminders_due, self.clock)
+        self._import_running = False
+        
+        # Perfiles (modo laboratorio, opcional vía --profiles o STUDYFLOW_PROFILES_DIR)
+        self.profiles = profiles
+        self.profile: Optional[Dict] = None
+        data_file = 'studyflow_v2_data.sfs'
+        if self.profiles:
+            self.root.withdraw()   # Nada de datos a la vista hasta elegir perfil
+            self.profile = self.ask_profile()
+            if self.profile is None:
+                self.root.destroy()
+                raise SystemExit(0)
+            data_file = self.profiles.data_file(self.profile['id'])
+        self.open_store(data_file)
+        
+        # Sincronización entre dispositivos (opcional, vía STUDYFLOW_SYNC_URL)
+        # Un servidor de sync es de un solo usuario: en modo laboratorio no se usa
+        self.sync_client = SyncClient.from_env() if not self.profiles else None
+        self._sync_in_flight = False
+        self._sync_scheduled = False
+        
+        # Telemetría (exportador de métricas y diagnóstico)
+        self.distraction_events = {'mild': 0, 'severe': 0}
+        self.last_save_latency = 0.0
+        self.max_save_latency = 0.0
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self._last_queue_check = time.monotonic()
+        self.metrics_exporter = MetricsExporter.from_env()
+        self.analytics_engine = AnalyticsEngine(self.post_to_ui)
+        self.async_bridge = AsyncBridge(self.post_to_ui)   # E/S y red como tareas asíncronas
+        self.heatmap = FocusHeatmap(self.post_to_ui, self.colors['bg_secondary'], self.colors['bg_card'])
+        self._heatmap_photo = None   # Referencia viva para que Tk no la libere
         
         self.setup_ui()
         self.apply_theme()
+        self._energy_level = self.energy_var.get()   # Último nivel aplicado (para el evento)
         self.load_data()
+        self.refresh_heatmap()
+        if self.profile:
+            self.on_profile_loaded()
         
         # Iniciar check de cola de mensajes
         self.check_message_queue()
         
+        # Exportador de métricas (opcional, vía STUDYFLOW_METRICS_PORT)
+        if self.metrics_exporter:
+            try:
+                self.metrics_exporter.start()
+                self.publish_metrics()
+            except OSError as e:
+                print(f"Error iniciando métricas: {e}")
+                self.metrics_exporter = None
+                
+        if self.sync_client:
+            self.periodic_sync()
+            
+        # Detectar escrituras de otras ventanas sobre el mismo fichero
+        self.watch_data_file()
+        
         # Bindings globales para focus guardian
         self.root.bind_all('<Button-1>', lambda e: self.on_user_activity())
         self.root.bind_all('<Key>', lambda e: self.on_user_activity())
+        self.root.bind_all('<Control-z>', lambda e: self.undo())
+        self.root.bind_all('<Control-y>', lambda e: self.redo())
+        self.update_undo_buttons()
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        
+    @classmethod
+    def headless(cls, data_file: str, clock: Optional[Clock] = None) -> 'StudyFlowV2':
+        """
+        Instancia sin Tk sobre un fichero de datos nuevo: solo estado y persistencia
+        El simulador la usa para pasar por el mismo código que la app (alta y
+        cambios de tareas, fin de sesión, guardado con fusión, archivo, copias
+        y log de deshacer). Los métodos con UI no se pueden llamar.
+        """
+        app = cls.__new__(cls)
+        app.root = None
+        app.clock = clock or Clock()
+        app.energy_matcher = TaskEnergyMatcher(clock=app.clock)
+        app.event_bus = EventBus(clock=app.clock)
+        app.current_task = None
+        app.data_version = 0
+        app.device_lease = None
+        app._selected_tasks = set()
+        app.reminders = ReminderScheduler(lambda ms, func: None, lambda after_id: None,
+                                          lambda due: None, app.clock)   # Sin Tk no hay avisos
+        app.heatmap = FocusHeatmap(lambda func, *args: None, '#000000', '#000000')
+        app.sync_client = None
+        app.last_save_latency = 0.0
+        app.max_save_latency = 0.0
+        app.open_store(data_file)
+        return app
+    
+    def close_headless(self):
+        self.event_bus.shutdown()
+        self.heatmap.shutdown()
+        self.device_lease.release()
         
     def check_message_queue(self):
         """Revisa la cola de mensajes del Focus Guardian (thread-safe)"""
+        # Lag del loop: cuánto tarde llegamos respecto a los 100ms programados
+        now = time.monotonic()
+        self.loop_lag = max(0.0, now - self._last_queue_check - 0.1)
+        self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+        self._last_queue_check = now
+        
         try:
             while True:
                 level, message = self.msg_queue.get_nowait()
-                self.on_distraction_detected(level, message)
+                if level == 'call':
+                    func, args = message
+                    func(*args)
+                else:
+                    text, idle = message   # Avisos del FocusGuardian: (texto, segundos inactivo)
+                    self.on_distraction_detected(level, text, idle)
         except queue.Empty:
             pass
         finally:
             # Revisar cada 100ms
             self.root.after(100, self.check_message_queue)
+            
+    def post_to_ui(self, func: Callable, *args):
+        """Programa func(*args) en el hilo de Tk desde cualquier hilo"""
+        self.msg_queue.put(('call', (func, args)))
         
     def setup_ui(self):
         """Configuración de interfaz con layout optimizado"""
@@ -344,6 +3914,15 @@ class StudyFlowV2:
         right = tk.Frame(header, bg=self.colors['bg_primary'])
         right.pack(side=tk.RIGHT)
         
+        if self.profiles:
+            self.profile_btn = tk.Button(right, text=f"👤 {self.profile['name']}",
+                                         font=('Helvetica Neue', 10, 'bold'),
+                                         bg=self.colors['bg_card'],
+                                         fg=self.colors['text_primary'],
+                                         cursor='hand2',
+                                         command=self.open_profile_picker)
+            self.profile_btn.pack(side=tk.LEFT, padx=(0, 15))
+        
         tk.Label(right, text="Mi energía ahora:", 
                 font=('Helvetica Neue', 11),
                 fg=self.colors['text_secondary'],
@@ -609,6 +4188,22 @@ class StudyFlowV2:
                  cursor='hand2',
                  command=self.add_task).pack(side=tk.LEFT)
         
+        tk.Button(input_row, text="📋 IMPORTAR",
+                 font=('Helvetica Neue', 11, 'bold'),
+                 bg=self.colors['bg_card'],
+                 fg=self.colors['text_primary'],
+                 cursor='hand2',
+                 command=self.open_import_dialog).pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Proyecto activo: la tarea nueva entra como subtarea (clic para quitarlo)
+        self.subtask_label = tk.Label(input_card, text="",
+                                     font=('Helvetica Neue', 10),
+                                     fg=self.colors['accent_energy'],
+                                     bg=self.colors['bg_secondary'],
+                                     cursor='hand2')
+        self.subtask_label.pack(anchor=tk.W, padx=15)
+        self.subtask_label.bind('<Button-1>', lambda e: self.set_subtask_parent(None))
+        
         # Sugerencia inteligente
         self.suggestion_label = tk.Label(input_card,
                                         text="💡 Sugerencia: Con tu energía MEDIUM, prioriza tareas MEDIUM",
@@ -617,6 +4212,65 @@ class StudyFlowV2:
                                         bg=self.colors['bg_secondary'])
         self.suggestion_label.pack(anchor=tk.W, padx=15, pady=(0, 10))
         
+        # Buscador: filtra mientras escribes
+        search_row = tk.Frame(frame, bg=self.colors['bg_primary'])
+        search_row.pack(fill=tk.X, pady=(0, 10))
+        
+        tk.Label(search_row, text="🔎",
+                font=('Segoe UI Emoji', 12),
+                bg=self.colors['bg_primary']).pack(side=tk.LEFT)
+        
+        self.task_filter_var = tk.StringVar()
+        self.task_filter_entry = tk.Entry(search_row,
+                                         textvariable=self.task_filter_var,
+                                         font=('Helvetica Neue', 11),
+                                         bg=self.colors['bg_secondary'],
+                                         fg=self.colors['text_primary'],
+                                         insertbackground=self.colors['accent_primary'],
+                                         relief=tk.FLAT)
+        self.task_filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=5, padx=5)
+        self.task_filter_entry.bind('<KeyRelease>', lambda e: self.render_tasks())
+        
+        self.task_count_label = tk.Label(search_row, text="",
+                                        font=('Helvetica Neue', 10),
+                                        fg=self.colors['text_muted'],
+                                        bg=self.colors['bg_primary'])
+        self.task_count_label.pack(side=tk.RIGHT, padx=5)
+        
+        # Acciones en lote sobre la selección
+        batch_row = tk.Frame(frame, bg=self.colors['bg_primary'])
+        batch_row.pack(fill=tk.X, pady=(0, 10))
+        
+        self.selection_label = tk.Label(batch_row, text="0 seleccionadas",
+                                       font=('Helvetica Neue', 10),
+                                       fg=self.colors['text_muted'],
+                                       bg=self.colors['bg_primary'])
+        self.selection_label.pack(side=tk.LEFT, padx=5)
+        
+        batch_actions = [
+            ("☑ Visibles", self.select_visible_tasks),
+            ("✅ Completar", lambda: self.complete_selected_tasks(True)),
+            ("↺ Reabrir", lambda: self.complete_selected_tasks(False)),
+            ("🗑 Borrar", self.delete_selected_tasks),
+            ("✕ Limpiar", self.clear_task_selection),
+        ]
+        for text, command in batch_actions:
+            tk.Button(batch_row, text=text,
+                     font=('Helvetica Neue', 9),
+                     bg=self.colors['bg_card'],
+                     fg=self.colors['text_primary'],
+                     relief=tk.FLAT, cursor='hand2',
+                     command=command).pack(side=tk.LEFT, padx=3)
+        
+        self.batch_difficulty_var = tk.StringVar(value='medium')
+        tk.OptionMenu(batch_row, self.batch_difficulty_var,
+                      *TaskEnergyMatcher.ENERGY_LEVELS,
+                      command=self.reprioritize_selected_tasks).pack(side=tk.RIGHT, padx=3)
+        tk.Label(batch_row, text="Energía ▸",
+                font=('Helvetica Neue', 9),
+                fg=self.colors['text_muted'],
+                bg=self.colors['bg_primary']).pack(side=tk.RIGHT)
+        
         # Lista de tareas
         list_container = tk.Frame(frame, bg=self.colors['bg_primary'])
         list_container.pack(fill=tk.BOTH, expand=True)
@@ -625,6 +4279,8 @@ class StudyFlowV2:
         headers = tk.Frame(list_container, bg=self.colors['bg_card'])
         headers.pack(fill=tk.X, pady=(0, 5))
         
+        tk.Label(headers, text="", width=3,
+                bg=self.colors['bg_card']).pack(side=tk.LEFT)
         tk.Label(headers, text="ESTADO", width=10,
                 font=('Helvetica Neue', 10, 'bold'),
                 fg=self.colors['text_muted'], bg=self.colors['bg_card']).pack(side=tk.LEFT)
@@ -733,6 +4389,18 @@ class StudyFlowV2:
                                       highlightthickness=0)
         self.streak_canvas.pack(fill=tk.X, padx=20)
         
+        # Mapa de calor: días x horas de los últimos 12 meses (una sola imagen)
+        heatmap_frame = tk.LabelFrame(frame, text=" Mapa de Foco: día × hora (12 meses) ",
+                                     font=('Helvetica Neue', 12, 'bold'),
+                                     fg=self.colors['text_primary'],
+                                     bg=self.colors['bg_secondary'])
+        heatmap_frame.pack(fill=tk.X, pady=(0, 10), ipady=5)
+        
+        self.heatmap_canvas = tk.Canvas(heatmap_frame, height=self.heatmap.tile_height + 20,
+                                       bg=self.colors['bg_secondary'],
+                                       highlightthickness=0)
+        self.heatmap_canvas.pack(fill=tk.X, padx=20)
+        
         # Log de sesiones
         log_frame = tk.LabelFrame(frame, text=" Historial de Sesiones ",
                                  font=('Helvetica Neue', 12, 'bold'),
@@ -751,13 +4419,30 @@ class StudyFlowV2:
         )
         self.log_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Exportar
-        tk.Button(frame, text="💾 Exportar Reporte Semanal",
+        # Exportar y análisis profundo
+        actions = tk.Frame(frame, bg=self.colors['bg_primary'])
+        actions.pack(pady=10)
+        
+        tk.Button(actions, text="💾 Exportar Reporte Semanal",
                  font=('Helvetica Neue', 11, 'bold'),
                  bg=self.colors['accent_primary'],
                  fg=self.colors['bg_primary'],
                  cursor='hand2',
-                 command=self.export_report).pack(pady=10)
+                 command=self.export_report).pack(side=tk.LEFT, padx=5)
+        
+        tk.Button(actions, text="🌐 Panel HTML",
+                 font=('Helvetica Neue', 11, 'bold'),
+                 bg=self.colors['accent_success'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=self.export_dashboard).pack(side=tk.LEFT, padx=5)
+        
+        tk.Button(actions, text="🔬 Análisis Profundo",
+                 font=('Helvetica Neue', 11, 'bold'),
+                 bg=self.colors['accent_energy'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=self.open_deep_analytics).pack(side=tk.LEFT, padx=5)
         
         return frame
     
@@ -776,6 +4461,7 @@ class StudyFlowV2:
             ("⏰ Calculador de Sueño", self.sleep_calculator),
             ("📊 Análisis de Energía", self.energy_analyzer),
             ("🎯 Desbloqueo de Logros", self.show_achievements),
+            ("🩺 Diagnóstico", self.show_diagnostics),
         ]
         
         for i, (name, cmd) in enumerate(tools):
@@ -813,12 +4499,31 @@ class StudyFlowV2:
                                      bg=self.colors['bg_secondary'])
         self.version_label.pack(side=tk.RIGHT, padx=15, pady=10)
         
+        # Deshacer / rehacer (también Ctrl+Z / Ctrl+Y)
+        self.redo_btn = tk.Button(footer, text="↷ Rehacer",
+                                 font=('Helvetica Neue', 9),
+                                 bg=self.colors['bg_card'],
+                                 fg=self.colors['text_secondary'],
+                                 relief=tk.FLAT, cursor='hand2',
+                                 command=self.redo)
+        self.redo_btn.pack(side=tk.RIGHT, padx=(0, 5), pady=10)
+        self.undo_btn = tk.Button(footer, text="↶ Deshacer",
+                                 font=('Helvetica Neue', 9),
+                                 bg=self.colors['bg_card'],
+                                 fg=self.colors['text_secondary'],
+                                 relief=tk.FLAT, cursor='hand2',
+                                 command=self.undo)
+        self.undo_btn.pack(side=tk.RIGHT, padx=5, pady=10)
+        
     # === FUNCIONALIDADES PRINCIPALES ===
     
     def on_energy_change(self):
         """Cuando cambia el nivel de energía seleccionado"""
         level = self.energy_var.get()
         self.energy_matcher.set_energy(level)
+        previous, self._energy_level = self._energy_level, level
+        if previous != level:
+            self.record_event(f"Energía {level.upper()}", [('setting', 'energy', previous, level)])
         
         # Actualizar UI
         duration = self.energy_matcher.get_recommended_duration()
@@ -827,13 +4532,13 @@ class StudyFlowV2:
         # Actualizar sugerencia en pestaña de tareas
         suggestion = f"💡 Con energía {level.upper()}, recomiendo: "
         if level == 'high':
-            suggestion += "tareas difíciles, sesiones de 25 min"
+            suggestion += f"tareas difíciles, sesiones de {duration} min"
         elif level == 'medium':
-            suggestion += "tareas moderadas, sesiones de 15 min"
+            suggestion += f"tareas moderadas, sesiones de {duration} min"
         elif level == 'low':
-            suggestion += "tareas simples, sesiones de 10 min"
+            suggestion += f"tareas simples, sesiones de {duration} min"
         else:
-            suggestion += "modo mínimo viable, solo 5 min"
+            suggestion += f"modo mínimo viable, solo {duration} min"
         
         self.suggestion_label.config(text=suggestion)
         self.footer_status.config(text=f"⚡ Energía: {level.upper()} • Duración: {duration} min")
@@ -858,7 +4563,7 @@ class StudyFlowV2:
                 return
         
         # Seleccionar tarea si hay disponibles
-        available_tasks = [t for t in self.tasks if not t.get('done')]
+        available_tasks = [t for t in self.tasks if not t.get('done') and not t.get('deleted')]
         if available_tasks and not self.current_task:
             # Sugerir tarea que match con energía actual
             energy = self.energy_var.get()
@@ -886,11 +4591,13 @@ class StudyFlowV2:
         duration = self.energy_matcher.get_recommended_duration()
         self.total_time = duration * 60
         self.current_time = self.total_time
-        self.session_start_time = datetime.now()
+        self.session_start_time = self.clock.now()
         self.pause_count = 0
+        self.focus_trace = FocusTrace(self.clock.time())
+        self.timer_telemetry = TimerTelemetry(self.total_time, self.clock)
         
         # Iniciar focus guardian (ahora con cola thread-safe)
-        self.focus_guardian = FocusGuardian(self.msg_queue)
+        self.focus_guardian = FocusGuardian(self.msg_queue, self.clock)
         self.focus_guardian.start_monitoring()
         
         # Estado
@@ -912,20 +4619,25 @@ class StudyFlowV2:
         
         # Programar mensajes ambientales de body doubling
         self.schedule_body_doubling_messages()
+        self.event_bus.publish('session_started', task=self.current_task['text'] if self.current_task else None,
+                               duration=duration, energy=self.energy_var.get())
         
     def countdown(self):
         """Loop del countdown"""
+        telemetry = self.timer_telemetry
         while self.timer_state == 'running' and self.current_time > 0:
-            time.sleep(1)
+            self.clock.sleep(1)
             if self.timer_state == 'running':
                 self.current_time -= 1
-                self.root.after(0, self.update_timer_visuals)
+                self.root.after(0, self.update_timer_visuals, telemetry, telemetry.tick())
         
         if self.current_time <= 0 and self.timer_state == 'running':
             self.root.after(0, self.session_complete)
             
-    def update_timer_visuals(self):
+    def update_timer_visuals(self, telemetry: Optional[TimerTelemetry] = None, scheduled: float = 0.0):
         """Actualiza todos los elementos visuales del timer"""
+        if telemetry:
+            telemetry.ui_updated(scheduled)
         mins, secs = divmod(self.current_time, 60)
         time_str = f"{mins:02d}:{secs:02d}"
         
@@ -967,6 +4679,8 @@ class StudyFlowV2:
         """Pausa la sesión actual"""
         self.timer_state = 'paused'
         self.pause_count += 1
+        self.focus_trace.record('pause', self.clock.time())
+        self.timer_telemetry.pause()
         self.btn_main.config(text="▶ REANUDAR", bg=self.colors['accent_success'])
         self.status_icon.config(text="⏸")
         self.status_message.config(
@@ -977,10 +4691,13 @@ class StudyFlowV2:
         
         if self.focus_guardian:
             self.focus_guardian.stop_monitoring()
+        self.event_bus.publish('session_paused', pauses=self.pause_count, remaining=self.current_time)
             
     def resume_session(self):
         """Reanuda sesión pausada"""
         self.timer_state = 'running'
+        self.focus_trace.record('resume', self.clock.time())
+        self.timer_telemetry.resume()
         self.btn_main.config(text="⏸ PAUSAR", bg=self.colors['accent_energy'])
         self.status_icon.config(text="🔥")
         self.status_message.config(text="¡De vuelta al flow!", fg=self.colors['accent_success'])
@@ -991,11 +4708,14 @@ class StudyFlowV2:
             
         self.timer_thread = threading.Thread(target=self.countdown, daemon=True)
         self.timer_thread.start()
+        self.event_bus.publish('session_resumed', pauses=self.pause_count, remaining=self.current_time)
         
     def reset_timer(self):
         """Reinicia todo"""
         self.timer_state = 'idle'
         self.current_time = 0
+        self.focus_trace = None
+        self.timer_telemetry = None
         
         if self.focus_guardian:
             self.focus_guardian.stop_monitoring()
@@ -1024,40 +4744,84 @@ class StudyFlowV2:
         """Cuando termina una sesión exitosamente"""
         self.timer_state = 'idle'
         
-        # Calcular calidad (basada en pausas)
-        quality = 1.0 - (self.pause_count * 0.1)
-        quality = max(0.5, quality)
-        
-        # Registrar en sistema de recompensas
+        # Calcular calidad: tiempo realmente enfocado según la traza (o, sin ella, las pausas)
+        if self.focus_trace:
+            quality = self.focus_trace.quality(self.clock.time())
+        else:
+            quality = self.reward_system.session_quality(self.pause_count)
         duration_mins = self.total_time // 60
-        reward = self.reward_system.register_session(duration_mins, quality)
         
         # Guardar en historial
         session_data = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': self.clock.now().isoformat(),
             'duration': duration_mins,
             'task': self.current_task['text'] if self.current_task else "General",
             'pauses': self.pause_count,
             'quality': quality,
             'energy_level': self.energy_var.get()
         }
-        self.sessions_history.append(session_data)
+        if self.current_task:
+            session_data['task_uid'] = self.current_task['uid']   # El texto no identifica
+        if self.focus_trace:
+            session_data['trace'] = self.focus_trace.to_text()
+            self.focus_trace = None
+        if self.timer_telemetry:
+            session_data['timing'] = self.last_timing = self.timer_telemetry.summary()
+            self.timer_telemetry = None
+        task, self.current_task = self.current_task, None
+        reward = self.complete_session(session_data, task)
         
         # Actualizar UI
+        self.update_undo_buttons()
         self.update_stats()
         self.reset_timer()
+        if task:
+            self.render_tasks()
         
         # Mostrar recompensa
         self.show_reward_popup(reward)
+        self.save_data()
+        self.backup_data()
+        self.refresh_dashboard()
+        
+    def complete_session(self, session_data: Dict, task: Optional[Dict] = None) -> Dict:
+        """
+        Parte sin UI del fin de sesión (también la usa el simulador)
+        Registra la sesión en historial, índices, árbol de proyectos, modelo de
+        duraciones y recompensas; marca `task` como hecha; deja sesión y tarea
+        en un solo evento de deshacer. Devuelve la recompensa.
+        """
+        self.touch_record('session', session_data)
+        self.sessions_history.append(session_data)
+        self._session_uids.add(session_data['uid'])
+        self.day_index.add(session_data)
+        self.heatmap.add_session(session_data)
+        self.task_tree.add_session(session_data)
+        self.duration_model.update(session_data['energy_level'],
+                                   datetime.fromisoformat(session_data['timestamp']).hour,
+                                   session_data['duration'], session_data['quality'], session_data['pauses'])
+        changes = [('session', session_data['uid'], None, dict(session_data))]
+        self.event_bus.publish('session_completed', session=dict(session_data))
+        
+        # Registrar en sistema de recompensas (con la racha en días ya al día)
+        self.refresh_streak()
+        reward = self.reward_system.register_session(session_data['duration'], session_data['quality'])
         
         # Marcar tarea como hecha si existe
-        if self.current_task:
-            self.current_task['done'] = True
-            self.render_tasks()
-            self.current_task = None
+        if task:
+            before = dict(task)
+            task['done'] = True
+            task['done_at'] = session_data['timestamp']
+            self.touch_record('task', task)
+            self.reminders.update(task)
+            self.task_changed(task)
+            self.event_bus.publish('task_toggled', task=dict(task))
+            changes.append(('task', task['uid'], before, dict(task)))
             
-        self.save_data()
-        
+        # Sesión y tarea completada se deshacen juntas
+        self.event_log.record(f"Sesión de {session_data['duration']} min", changes)
+        return reward
+    
     def show_reward_popup(self, reward: Dict):
         """Muestra popup de recompensa con dopamina"""
         popup = tk.Toplevel(self.root)
@@ -1110,8 +4874,12 @@ class StudyFlowV2:
                  fg=self.colors['bg_primary'],
                  command=popup.destroy).pack(pady=20)
         
-    def on_distraction_detected(self, level: str, message: str):
+    def on_distraction_detected(self, level: str, message: str, idle: float = 0):
         """Callback del Focus Guardian - AHORA SIEMPRE EN HILO PRINCIPAL"""
+        self.distraction_events[level] = self.distraction_events.get(level, 0) + 1
+        if self.focus_trace and self.timer_state == 'running':
+            self.focus_trace.record(level, self.clock.time(), idle)
+        self.event_bus.publish('distraction_detected', level=level, message=message)
         self.status_icon.config(text="⚠️")
         self.status_message.config(text=message, fg=self.colors['accent_urgent'])
         
@@ -1157,66 +4925,202 @@ class StudyFlowV2:
             'text': text,
             'difficulty': self.task_difficulty.get(),
             'done': False,
-            'created': datetime.now().isoformat()
+            'created': self.clock.now().isoformat()
         }
+        parent = self._subtask_parent
+        if parent is not None and not parent.get('deleted'):
+            task['parent'] = parent['uid']
         
-        self.tasks.append(task)
+        self.add_task_record(task)
+        self.record_event("Añadir subtarea" if 'parent' in task else "Añadir tarea",
+                          [('task', task['uid'], None, dict(task))])
         self.task_entry.delete(0, tk.END)
         self.render_tasks()
         self.save_data()
         
+    def task_changed(self, task: Dict):
+        """Tras cualquier cambio de una tarea: árbol de proyectos, orden de la lista y filas"""
+        self.task_tree.set_task(task)
+        self.task_order.mark(task['uid'])
+        if task.get('deleted'):
+            self._gone_task_rows.add(task['uid'])
+            
+    def add_task_record(self, task: Dict):
+        """Alta de una tarea en el estado e índices (sin UI: también la usa el simulador)"""
+        self.touch_record('task', task)
+        self.tasks.append(task)
+        self._tasks_by_uid[task['uid']] = task
+        self.task_index.add(task['uid'], task['text'])
+        self.task_changed(task)
+        self.event_bus.publish('task_added', task=dict(task))
+        
     def render_tasks(self):
-        """Renderiza la lista de tareas"""
-        # Limpiar
-        for widget in self.tasks_list_frame.winfo_children():
-            widget.destroy()
-            
-        # Ordenar: pendientes primero, luego por dificultad
-        sorted_tasks = sorted(self.tasks, 
-                            key=lambda x: (x['done'], 
-                                         ['high', 'medium', 'low', 'minimal'].index(x['difficulty'])))
-        
-        for task in sorted_tasks:
-            row = tk.Frame(self.tasks_list_frame, bg=self.colors['bg_secondary'])
-            row.pack(fill=tk.X, pady=2)
-            
-            # Estado
-            status = "✅" if task['done'] else "⬜"
-            tk.Label(row, text=status, width=10,
-                    font=('Segoe UI Emoji', 14),
-                    bg=self.colors['bg_secondary']).pack(side=tk.LEFT)
+        """
+        Renderiza la lista de tareas de forma incremental
+        Solo se construyen las filas nuevas o cambiadas; el resto se reutiliza.
+        El orden (pendientes primero, luego por dificultad; cada subtarea justo
+        debajo de su padre) lo mantiene TaskOrder al editar: teclear en el
+        filtro solo recorre la lista ya ordenada.
+        """
+        self.task_order.refresh(self._tasks_by_uid, self.task_tree)
+        query = self.task_filter_var.get().strip()
+        if query:
+            matches = self.task_index.search(query)
+            total = len(matches)
+            visible = self.task_order.first(self.MAX_VISIBLE_TASKS, matches)
+        else:
+            total = len(self.task_order.ordered)
+            visible = self.task_order.first(self.MAX_VISIBLE_TASKS)
             
-            # Texto
-            fg = self.colors['text_muted'] if task['done'] else self.colors['text_primary']
-            tk.Label(row, text=task['text'],
-                    font=('Helvetica Neue', 11, 'overstrike' if task['done'] else 'normal'),
-                    fg=fg, bg=self.colors['bg_secondary']).pack(side=tk.LEFT, expand=True)
-            
-            # Dificultad
-            color = self.energy_matcher.ENERGY_LEVELS[task['difficulty']]['color']
-            tk.Label(row, text=task['difficulty'].upper(),
-                    font=('Helvetica Neue', 9, 'bold'),
-                    fg=color, bg=self.colors['bg_secondary'],
-                    width=12).pack(side=tk.LEFT)
-            
-            # Acciones
-            if not task['done']:
-                tk.Button(row, text="ESTUDIAR",
-                         font=('Helvetica Neue', 9, 'bold'),
-                         bg=self.colors['accent_primary'],
-                         fg=self.colors['bg_primary'],
-                         cursor='hand2',
-                         command=lambda t=task: self.select_task_for_study(t)).pack(side=tk.LEFT, padx=5)
-            
-            tk.Button(row, text="✓" if not task['done'] else "↺",
-                     font=('Helvetica Neue', 10),
-                     bg=self.colors['bg_card'],
-                     fg=self.colors['accent_success'] if not task['done'] else self.colors['accent_energy'],
+        order = []
+        now = self.clock.now().isoformat(timespec='minutes')
+        for uid in visible:
+            task = self._tasks_by_uid[uid]
+            overdue = not task['done'] and task.get('due', now) < now
+            progress = self.task_tree.progress(uid) if self.task_tree.has_children(uid) else None
+            signature = (task['done'], task['text'], task['difficulty'], uid in self._selected_tasks,
+                         task.get('due'), task.get('remind_at'), overdue,
+                         self.task_depth(uid), progress)
+            cached = self._task_rows.pop(uid, None)   # Se reinserta al final: LRU
+            if cached is None:
+                row = tk.Frame(self.tasks_list_frame, bg=self.colors['bg_secondary'])
+                self._build_task_row(row, task)
+                self._task_rows[uid] = (row, signature)
+            elif cached[1] != signature:
+                row = cached[0]
+                for widget in row.winfo_children():
+                    widget.destroy()
+                self._build_task_row(row, task)
+                self._task_rows[uid] = (row, signature)
+            else:
+                self._task_rows[uid] = cached
+            order.append(uid)
+            
+        # Re-empaquetar solo si cambió qué filas se ven o su orden
+        if order != self._visible_task_order:
+            for uid in self._visible_task_order:
+                if uid in self._task_rows:
+                    self._task_rows[uid][0].pack_forget()
+            for uid in order:
+                self._task_rows[uid][0].pack(fill=tk.X, pady=2)
+            self._visible_task_order = order
+            
+        # Filas de tareas borradas desde el último render (un deshacer pudo revivirlas)
+        gone = [uid for uid in self._gone_task_rows if self._tasks_by_uid.get(uid, {}).get('deleted', True)]
+        self._gone_task_rows.clear()
+        for uid in gone:
+            cached = self._task_rows.pop(uid, None)
+            if cached is not None:
+                cached[0].destroy()
+        self._selected_tasks.difference_update(gone)
+        # Fuera de la vista solo se guardan ROW_CACHE filas (las usadas hace menos)
+        excess = len(self._task_rows) - len(order) - self.ROW_CACHE
+        for uid in list(islice(self._task_rows, max(0, excess))):
+            self._task_rows.pop(uid)[0].destroy()
+        self.selection_label.config(text=f"{len(self._selected_tasks)} seleccionadas")
+            
+        shown = f"{len(order)} de {total}" if total > len(order) else f"{len(order)}"
+        self.task_count_label.config(text=f"{shown} tareas" if query else f"{total} tareas")
+        
+    def _build_task_row(self, row, task: Dict):
+        """Construye los widgets de una fila de tarea"""
+        # Selección (para acciones en lote)
+        check = tk.Label(row, text="☑" if task['uid'] in self._selected_tasks else "☐", width=3,
+                        font=('Segoe UI Emoji', 12), cursor='hand2',
+                        fg=self.colors['accent_primary'], bg=self.colors['bg_secondary'])
+        depth = self.task_depth(task['uid'])
+        check.pack(side=tk.LEFT, padx=(depth * 18, 0))
+        check.bind('<Button-1>', lambda e, uid=task['uid']: self.toggle_task_selection(uid))
+        
+        # Estado
+        status = "✅" if task['done'] else "⬜"
+        tk.Label(row, text=status, width=10,
+                font=('Segoe UI Emoji', 14),
+                bg=self.colors['bg_secondary']).pack(side=tk.LEFT)
+        
+        # Texto
+        fg = self.colors['text_muted'] if task['done'] else self.colors['text_primary']
+        tk.Label(row, text=f"↳ {task['text']}" if depth else task['text'],
+                font=('Helvetica Neue', 11, 'overstrike' if task['done'] else 'normal'),
+                fg=fg, bg=self.colors['bg_secondary']).pack(side=tk.LEFT, expand=True)
+        
+        # Progreso del proyecto (acumulado de sus subtareas)
+        if self.task_tree.has_children(task['uid']):
+            done, total, minutes, sessions = self.task_tree.progress(task['uid'])
+            filled = round(10 * done / total) if total else 0
+            tk.Label(row, text=f"{'▰' * filled}{'▱' * (10 - filled)} {done}/{total} • {minutes} min",
+                    font=('Helvetica Neue', 9),
+                    fg=self.colors['accent_success'] if total and done == total else self.colors['text_secondary'],
+                    bg=self.colors['bg_secondary']).pack(side=tk.LEFT, padx=5)
+        
+        # Fecha límite / recordatorio
+        if task.get('due') or task.get('remind_at'):
+            parts = []
+            if task.get('due'):
+                parts.append(f"📅 {datetime.fromisoformat(task['due']).strftime('%d/%m %H:%M')}")
+            if task.get('remind_at'):
+                parts.append("⏰")
+            overdue = not task['done'] and task.get('due', '~') < self.clock.now().isoformat(timespec='minutes')
+            tk.Label(row, text=' '.join(parts),
+                    font=('Helvetica Neue', 9),
+                    fg=self.colors['accent_urgent'] if overdue else self.colors['text_secondary'],
+                    bg=self.colors['bg_secondary']).pack(side=tk.LEFT, padx=5)
+        
+        # Dificultad
+        color = self.energy_matcher.ENERGY_LEVELS[task['difficulty']]['color']
+        tk.Label(row, text=task['difficulty'].upper(),
+                font=('Helvetica Neue', 9, 'bold'),
+                fg=color, bg=self.colors['bg_secondary'],
+                width=12).pack(side=tk.LEFT)
+        
+        # Acciones
+        if not task['done']:
+            tk.Button(row, text="ESTUDIAR",
+                     font=('Helvetica Neue', 9, 'bold'),
+                     bg=self.colors['accent_primary'],
+                     fg=self.colors['bg_primary'],
                      cursor='hand2',
-                     command=lambda t=task: self.toggle_task_done(t)).pack(side=tk.LEFT)
+                     command=lambda t=task: self.select_task_for_study(t)).pack(side=tk.LEFT, padx=5)
+        
+        tk.Button(row, text="✓" if not task['done'] else "↺",
+                 font=('Helvetica Neue', 10),
+                 bg=self.colors['bg_card'],
+                 fg=self.colors['accent_success'] if not task['done'] else self.colors['accent_energy'],
+                 cursor='hand2',
+                 command=lambda t=task: self.toggle_task_done(t)).pack(side=tk.LEFT)
+        
+        tk.Button(row, text="⏰",
+                 font=('Segoe UI Emoji', 10),
+                 bg=self.colors['bg_card'],
+                 fg=self.colors['text_primary'],
+                 cursor='hand2',
+                 command=lambda t=task: self.open_schedule_dialog(t)).pack(side=tk.LEFT, padx=(5, 0))
+        
+        tk.Button(row, text="＋",
+                 font=('Helvetica Neue', 10),
+                 bg=self.colors['bg_card'],
+                 fg=self.colors['text_primary'],
+                 cursor='hand2',
+                 command=lambda t=task: self.set_subtask_parent(t)).pack(side=tk.LEFT, padx=(5, 0))
+            
+    def task_depth(self, uid: str) -> int:
+        """Ancestros vivos (la subtarea de un proyecto borrado sube de nivel)"""
+        return sum(1 for node in islice(self.task_tree.path(uid), 1, None)
+                   if not self._tasks_by_uid.get(node, {'deleted': True}).get('deleted'))
+    
+    def set_subtask_parent(self, task: Optional[Dict]):
+        """Las tareas que se añadan cuelgan de `task` (None: tareas sueltas)"""
+        self._subtask_parent = task
+        if task is None:
+            self.subtask_label.config(text="")
+        else:
+            self.subtask_label.config(text=f"↳ Subtareas de «{task['text'][:40]}» (clic para quitar)")
+            self.task_entry.focus_set()
             
     def select_task_for_study(self, task: Dict):
         """Selecciona tarea para estudiar ahora"""
+        if self.focus_trace and self.current_task is not task:
+            self.focus_trace.record('task_switch', self.clock.time())
         self.current_task = task
         self.notebook.select(0)  # Ir a focus tab
         self.current_task_label.config(
@@ -1233,45 +5137,482 @@ class StudyFlowV2:
         
     def toggle_task_done(self, task: Dict):
         """Marca/desmarca tarea"""
-        task['done'] = not task['done']
+        done = not task['done']
+        self.batch_update_tasks([task['uid']], "Completar tarea" if done else "Reabrir tarea",
+                                lambda t: self._set_done(t, done, self.clock.now()))
+        if done:
+            self.celebrate_task_completion()
+            
+    @staticmethod
+    def _set_done(task: Dict, done: bool, at: datetime):
+        if task['done'] == done:
+            return
+        task['done'] = done
+        if done:
+            task['done_at'] = at.isoformat()
+        else:
+            task.pop('done_at', None)
+            
+    def batch_update_tasks(self, uids, label: str, mutate: Callable[[Dict], None]) -> int:
+        """
+        Aplica `mutate` a varias tareas como una sola transacción
+        Un evento de deshacer, un render incremental y un guardado, sean
+        cuantas sean. Las que no cambian no se sellan ni viajan por sync.
+        """
+        changes = self.update_tasks(uids, label, mutate)
+        if self._subtask_parent is not None and self._subtask_parent.get('deleted'):
+            self.set_subtask_parent(None)
+        if self.current_task is not None and self.current_task.get('deleted'):
+            self.current_task = None
+            self.current_task_label.config(text="Ninguna tarea seleccionada",
+                                          fg=self.colors['text_secondary'])
+        if changes:
+            self.update_undo_buttons()
+            self.render_tasks()
+            self.save_data()
+        return len(changes)
+    
+    def update_tasks(self, uids, label: str, mutate: Callable[[Dict], None]) -> List[tuple]:
+        """Parte sin UI de batch_update_tasks: estado, índices y evento de deshacer"""
+        changes = []
+        for uid in uids:
+            task = self._tasks_by_uid.get(uid)
+            if task is None or task.get('deleted'):
+                continue
+            before = dict(task)
+            mutate(task)
+            if task == before:
+                continue
+            if task.get('deleted'):
+                self.task_index.remove(uid)
+                self._selected_tasks.discard(uid)
+            self.touch_record('task', task)
+            self.reminders.update(task)
+            self.task_changed(task)
+            if task['done'] != before['done'] and not task.get('deleted'):
+                self.event_bus.publish('task_toggled', task=dict(task))
+            changes.append(('task', uid, before, dict(task)))
+        if changes:
+            self.event_log.record(label, changes)
+        return changes
+    
+    def open_import_dialog(self):
+        """Pegar un temario (o elegir un fichero) e importarlo en bloques"""
+        popup = tk.Toplevel(self.root)
+        popup.title("Importar tareas")
+        popup.geometry("620x480")
+        popup.configure(bg=self.colors['bg_secondary'])
+        
+        tk.Label(popup, text="Pega una lista (CSV, Markdown - [ ] o una tarea por línea):",
+                font=('Helvetica Neue', 11),
+                fg=self.colors['text_primary'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W, padx=15, pady=(15, 0))
+        tk.Label(popup, text="Dificultad: columna (alta/media/baja/mínima o 3-0) o etiqueta final "
+                             "#alta, #media, #baja, #minima. Se omiten los títulos «# ...».",
+                font=('Helvetica Neue', 9),
+                fg=self.colors['text_muted'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W, padx=15, pady=(0, 5))
+        
+        text = scrolledtext.ScrolledText(popup, height=14,
+                                         font=('JetBrains Mono', 10),
+                                         bg=self.colors['bg_card'],
+                                         fg=self.colors['text_primary'],
+                                         insertbackground=self.colors['accent_primary'],
+                                         relief=tk.FLAT)
+        text.pack(fill=tk.BOTH, expand=True, padx=15)
+        
+        progress = ttk.Progressbar(popup, maximum=100, mode='determinate')
+        progress.pack(fill=tk.X, padx=15, pady=(10, 0))
+        status = tk.Label(popup, text="",
+                         font=('Helvetica Neue', 10),
+                         fg=self.colors['text_secondary'],
+                         bg=self.colors['bg_secondary'])
+        status.pack(anchor=tk.W, padx=15, pady=5)
+        
+        buttons = tk.Frame(popup, bg=self.colors['bg_secondary'])
+        buttons.pack(fill=tk.X, padx=15, pady=(0, 15))
+        
+        def on_progress(added: int, duplicates: int, fraction: float):
+            if popup.winfo_exists():
+                progress['value'] = fraction * 100
+                status.config(text=f"⏳ {added} importadas • {duplicates} repetidas")
+                
+        def on_done(added: int, duplicates: int):
+            if popup.winfo_exists():
+                progress['value'] = 100
+                status.config(text=f"✅ {added} tareas importadas • {duplicates} repetidas omitidas")
+            self.footer_status.config(text=f"📋 {added} tareas importadas")
+            
+        def from_text():
+            content = text.get(1.0, tk.END)
+            self.import_tasks(io.StringIO(content), len(content), on_progress, on_done)
+            
+        def from_file():
+            path = filedialog.askopenfilename(parent=popup, title="Importar tareas",
+                                              filetypes=[("Listas", "*.csv *.tsv *.md *.txt"),
+                                                         ("Todos", "*")])
+            if not path:
+                return
+            try:
+                f = open(path, 'r', encoding='utf-8-sig', newline='')
+            except OSError as e:
+                messagebox.showerror("Importar", f"No se pudo abrir el fichero: {e}", parent=popup)
+                return
+            csv_hint = path.lower().endswith(('.csv', '.tsv'))
+            self.import_tasks(f, os.path.getsize(path), on_progress, on_done, csv_hint)
+            
+        tk.Button(buttons, text="📂 Desde archivo...",
+                 font=('Helvetica Neue', 10),
+                 bg=self.colors['bg_card'],
+                 fg=self.colors['text_primary'],
+                 cursor='hand2',
+                 command=from_file).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Importar texto",
+                 font=('Helvetica Neue', 10, 'bold'),
+                 bg=self.colors['accent_success'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=from_text).pack(side=tk.RIGHT)
+        
+    def import_tasks(self, source, total_chars: int, on_progress: Callable, on_done: Callable,
+                     csv_hint: bool = False):
+        """
+        Importa en bloques de IMPORT_CHUNK sin bloquear Tk
+        Deduplica contra las tareas existentes (y dentro del propio lote) por
+        hash del texto normalizado; cada bloque es un render + un guardado y
+        la importación entera es un solo evento de deshacer.
+        """
+        if self._import_running:
+            return
+        self._import_running = True
+        consumed = 0
+        
+        def counted():
+            nonlocal consumed
+            for line in source:
+                consumed += len(line)
+                yield line
+                
+        items = TaskImporter.parse(counted(), self.task_difficulty.get(), csv_hint)
+        seen = {TaskImporter.key(t['text']) for t in self.tasks if not t.get('deleted')}
+        changes = []
+        duplicates = 0
+        
+        def step():
+            nonlocal duplicates
+            finished = True
+            try:
+                try:
+                    chunk = list(islice(items, self.IMPORT_CHUNK))
+                except (csv.Error, UnicodeDecodeError) as e:
+                    print(f"Error importando: {e}")
+                    chunk = []
+                created = self.clock.now().isoformat()
+                added_before = len(changes)
+                for text, difficulty, done in chunk:
+                    key = TaskImporter.key(text)
+                    if key in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(key)
+                    task = {
+                        'id': len(self.tasks),
+                        'text': text,
+                        'difficulty': difficulty,
+                        'done': done,
+                        'created': created
+                    }
+                    if done:
+                        task['done_at'] = created
+                    self.add_task_record(task)
+                    changes.append(('task', task['uid'], None, dict(task)))
+                if len(changes) > added_before:
+                    self.render_tasks()
+                    self.save_data()
+                if len(chunk) == self.IMPORT_CHUNK:
+                    on_progress(len(changes), duplicates, min(consumed / max(total_chars, 1), 1.0))
+                    self.root.after(1, step)  # Ceder el loop de Tk entre bloques
+                    finished = False
+                    return
+            finally:
+                # Pase lo que pase, la importación se cierra (y lo ya añadido se puede deshacer)
+                if finished:
+                    source.close()
+                    self._import_running = False
+                    if changes:
+                        self.record_event(f"Importar {len(changes)} tareas", changes)
+            on_done(len(changes), duplicates)
+            
+        step()
+        
+    def toggle_task_selection(self, uid: str):
+        if uid in self._selected_tasks:
+            self._selected_tasks.discard(uid)
+        else:
+            self._selected_tasks.add(uid)
         self.render_tasks()
-        self.save_data()
         
-        if task['done']:
+    def select_visible_tasks(self):
+        self._selected_tasks.update(self._visible_task_order)
+        self.render_tasks()
+        
+    def clear_task_selection(self):
+        self._selected_tasks.clear()
+        self.render_tasks()
+        
+    def complete_selected_tasks(self, done: bool):
+        count = self.batch_update_tasks(list(self._selected_tasks),
+                                        f"{'Completar' if done else 'Reabrir'} {len(self._selected_tasks)} tareas",
+                                        lambda t: self._set_done(t, done, self.clock.now()))
+        if count and done:
             self.celebrate_task_completion()
             
+    def reprioritize_selected_tasks(self, difficulty: str):
+        self.batch_update_tasks(list(self._selected_tasks), f"Energía {difficulty.upper()} en lote",
+                                lambda t: t.update(difficulty=difficulty))
+        
+    def delete_selected_tasks(self):
+        count = len(self._selected_tasks)
+        if not count or not messagebox.askyesno("Borrar tareas",
+                                                f"¿Borrar {count} tareas? (se puede deshacer)"):
+            return
+        self.batch_update_tasks(list(self._selected_tasks), f"Borrar {count} tareas",
+                                lambda t: t.update(deleted=True))
+            
     def celebrate_task_completion(self):
         """Efecto visual de celebración"""
         original = self.tasks_canvas.cget('bg')
         self.tasks_canvas.config(bg=self.colors['accent_success'])
         self.root.after(300, lambda: self.tasks_canvas.config(bg=original))
         
+    # === RECORDATORIOS ===
+    
+    def open_schedule_dialog(self, task: Dict):
+        """Fecha límite y recordatorio de una tarea"""
+        popup = tk.Toplevel(self.root)
+        popup.title("Fechas de la tarea")
+        popup.geometry("420x260")
+        popup.configure(bg=self.colors['bg_secondary'])
+        
+        tk.Label(popup, text=task['text'][:50],
+                font=('Helvetica Neue', 12, 'bold'),
+                fg=self.colors['text_primary'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W, padx=15, pady=(15, 5))
+        tk.Label(popup, text="AAAA-MM-DD [HH:MM] o relativo: +2d, +3h, +45m (vacío = sin fecha)",
+                font=('Helvetica Neue', 9),
+                fg=self.colors['text_muted'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W, padx=15)
+        
+        entries = {}
+        for field, label in (('due', "📅 Fecha límite"), ('remind_at', "⏰ Recordarme")):
+            line = tk.Frame(popup, bg=self.colors['bg_secondary'])
+            line.pack(fill=tk.X, padx=15, pady=5)
+            tk.Label(line, text=label, width=16, anchor=tk.W,
+                    font=('Helvetica Neue', 10),
+                    fg=self.colors['text_secondary'],
+                    bg=self.colors['bg_secondary']).pack(side=tk.LEFT)
+            entry = tk.Entry(line, font=('Helvetica Neue', 11),
+                            bg=self.colors['bg_card'],
+                            fg=self.colors['text_primary'],
+                            insertbackground=self.colors['accent_primary'],
+                            relief=tk.FLAT)
+            entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            if task.get(field):
+                entry.insert(0, datetime.fromisoformat(task[field]).strftime('%Y-%m-%d %H:%M'))
+            entries[field] = entry
+            
+        def save():
+            now = self.clock.now()
+            values = {}
+            for field, entry in entries.items():
+                try:
+                    when = ReminderScheduler.parse_when(entry.get(), now)
+                except ValueError:
+                    messagebox.showerror("Fechas", f"No entiendo la fecha: {entry.get()}", parent=popup)
+                    return
+                values[field] = when.isoformat(timespec='minutes') if when else None
+            if values['remind_at'] and values['remind_at'] <= now.isoformat(timespec='minutes'):
+                messagebox.showerror("Fechas", "El recordatorio tiene que ser en el futuro", parent=popup)
+                return
+                
+            def mutate(t: Dict):
+                for field, value in values.items():
+                    if value:
+                        t[field] = value
+                    else:
+                        t.pop(field, None)
+            self.batch_update_tasks([task['uid']], "Programar tarea", mutate)
+            popup.destroy()
+            
+        tk.Button(popup, text="Guardar",
+                 font=('Helvetica Neue', 10, 'bold'),
+                 bg=self.colors['accent_success'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=save).pack(side=tk.RIGHT, padx=15, pady=15)
+        
+    def on_reminders_due(self, due: List[tuple]):
+        """Callback del ReminderScheduler (hilo de Tk): todos los vencidos de una pasada"""
+        lines = []
+        for uid, kind in due:
+            task = self._tasks_by_uid.get(uid)
+            if task is None:
+                continue
+            ReminderScheduler.mark_reminded(task, kind)
+            self.touch_record('task', task)   # Tampoco suena en los otros dispositivos
+            lines.append(f"{'📅 Vence' if kind == 'due' else '⏰ Recordatorio'}: {task['text']}")
+        if not lines:
+            return
+        self.render_tasks()   # Marca en rojo lo que acaba de vencer
+        self.status_icon.config(text="⏰")
+        self.status_message.config(text=lines[0] if len(lines) == 1 else f"⏰ {len(lines)} avisos pendientes",
+                                   fg=self.colors['accent_urgent'])
+        self.flash_screen()
+        if self.timer_state != 'running':   # En plena sesión basta el aviso de la barra
+            messagebox.showinfo("Recordatorios", '\n'.join(lines[:15]) +
+                                (f"\n… y {len(lines) - 15} más" if len(lines) > 15 else ""))
+        self.save_data()   # Persiste lo ya avisado
+        
+    # === DESHACER / REHACER ===
+    
+    def record_event(self, label: str, changes: List[tuple]):
+        """Anota una mutación invertible: [(kind, uid, antes, después)]"""
+        self.event_log.record(label, changes)
+        self.update_undo_buttons()
+        
+    def update_undo_buttons(self):
+        undo, redo = self.event_log.peek_undo(), self.event_log.peek_redo()
+        self.undo_btn.config(state=tk.NORMAL if undo and not self.undo_blocked(undo) else tk.DISABLED,
+                             text=f"↶ {undo['label']}" if undo else "↶ Deshacer")
+        self.redo_btn.config(state=tk.NORMAL if redo else tk.DISABLED,
+                             text=f"↷ {redo['label']}" if redo else "↷ Rehacer")
+        
+    def undo_blocked(self, event: Dict) -> bool:
+        """Quitar una sesión que ya salió de la ventana en RAM: está en el archivo (solo crece)"""
+        return any(kind == 'session' and before is None and uid not in self._session_uids
+                   and self.session_archive.contains(uid)
+                   for kind, uid, before, _ in event['changes'])
+    
+    def undo(self):
+        event = self.event_log.peek_undo()
+        if event is None:
+            return
+        if self.undo_blocked(event):
+            # El evento se queda en la pila: el cursor no avanza sobre algo que no se aplicó
+            self.footer_status.config(text=f"↶ «{event['label']}» ya está archivado: no se puede deshacer")
+            return
+        self.event_log.undo()
+        self.apply_event(event, undo=True)
+        self.footer_status.config(text=f"↶ Deshecho: {event['label']}")
+        
+    def redo(self):
+        event = self.event_log.peek_redo()
+        if event is None:
+            return
+        self.event_log.redo()
+        self.apply_event(event, undo=False)
+        self.footer_status.config(text=f"↷ Rehecho: {event['label']}")
+        
+    def apply_event(self, event: Dict, undo: bool):
+        """Pone cada registro en su estado 'antes' (deshacer) o 'después' (rehacer)"""
+        changes = reversed(event['changes']) if undo else event['changes']
+        kinds = set()
+        for kind, uid, before, after in changes:
+            state = before if undo else after
+            if kind == 'task':
+                self.apply_task_state(uid, state)
+            elif kind == 'session':
+                self.apply_session_state(uid, state)
+            elif kind == 'setting' and uid == 'energy':
+                self._energy_level = state
+                self.energy_var.set(state)
+                self.on_energy_change()
+            kinds.add(kind)
+        if 'task' in kinds:
+            self.render_tasks()
+        if 'session' in kinds:
+            self.update_stats()
+            self.refresh_dashboard()
+        self.update_undo_buttons()
+        self.save_data()
+        
+    def apply_task_state(self, uid: str, state: Optional[Dict]):
+        task = self._tasks_by_uid.get(uid)
+        if state is None:
+            if task is None or task.get('deleted'):
+                return
+            task['deleted'] = True   # Lápida: así el borrado también viaja por sync
+            self.task_index.remove(uid)
+            if self.current_task is task:
+                self.current_task = None
+                self.current_task_label.config(text="Ninguna tarea seleccionada",
+                                              fg=self.colors['text_secondary'])
+        else:
+            if task is None:
+                task = self._tasks_by_uid[uid] = {}
+                self.tasks.append(task)
+            task.clear()  # Mantener la identidad (current_task apunta aquí)
+            task.update(state)
+            self.task_index.add(uid, task['text'])
+        self.touch_record('task', task)
+        self.reminders.update(task)
+        self.task_changed(task)
+        
+    def apply_session_state(self, uid: str, state: Optional[Dict]):
+        if state is None:
+            session = self._recent_session(uid)
+            if session is None:
+                return
+            self._remove_session(session)
+            tombstone = self._session_tombstones[uid] = dict(session, deleted=True)
+            self.touch_record('session', tombstone)
+        else:
+            self._session_tombstones.pop(uid, None)
+            if self.has_session(uid):
+                return
+            session = dict(state)
+            self.touch_record('session', session)
+            self._insert_session(session)
+        
     # === ANALYTICS ===
     
+    def refresh_streak(self):
+        """Racha en días desde el índice por día: O(1), sin recorrer sesiones"""
+        self.reward_system.update_streak(self.day_index.current_streak(self.clock.today()),
+                                         self.day_index.longest_run)
+        
     def update_stats(self):
         """Actualiza todas las estadísticas"""
+        self.refresh_streak()
         stats = self.reward_system.get_stats()
+        today = self.clock.today()
+        today_sessions = self.day_index.sessions_on(today)
+        today_minutes = self.day_index.minutes_on(today)
         
-        self.stat_cards['sessions'].config(text=str(stats['sessions']))
+        self.stat_cards['sessions'].config(text=str(today_sessions))
         self.stat_cards['streak'].config(text=str(stats['current_streak']))
         self.stat_cards['total'].config(text=str(int(stats['total_hours'] * 60)))
         self.stat_cards['best'].config(text=str(stats['best_streak']))
         
         self.mini_stats.config(
-            text=f"{stats['sessions']} sesiones • {int(stats['total_hours'] * 60)} min focus"
+            text=f"{today_sessions} sesiones • {today_minutes} min focus"
         )
         
-        # Dibujar racha
+        # Dibujar racha: últimos 20 días, el tamaño según los minutos de ese día
         self.streak_canvas.delete('all')
-        streak = stats['current_streak']
-        for i in range(min(streak, 20)):
+        for i in range(20):
+            day = today - timedelta(days=19 - i)
+            minutes = self.day_index.minutes_on(day)
             x = 30 + i * 45
             y = 30
-            self.streak_canvas.create_oval(x-15, y-15, x+15, y+15,
-                                          fill=self.colors['accent_success'],
-                                          outline=self.colors['accent_primary'],
+            r = 6 + min(minutes, 90) * 9 // 90 if minutes else 6
+            self.streak_canvas.create_oval(x-r, y-r, x+r, y+r,
+                                          fill=self.colors['accent_success'] if minutes else '',
+                                          outline=self.colors['accent_primary'] if minutes else self.colors['text_muted'],
                                           width=2)
             
+        self.refresh_heatmap()
+            
         # Actualizar log
         self.log_text.delete(1.0, tk.END)
         for session in reversed(self.sessions_history[-20:]):
@@ -1280,11 +5621,27 @@ class StudyFlowV2:
             self.log_text.insert(tk.END, 
                                f"[{time_str}] {session['duration']}min {quality_str} - {session['task'][:30]}...\n")
         
+    def refresh_heatmap(self):
+        """Pide al worker los meses sucios; si no hay ninguno no cuesta nada"""
+        if self.heatmap.needs_render(self.clock.today()):
+            self.heatmap.render_async(self.clock.today(), self.show_heatmap)
+            
+    def show_heatmap(self, png_base64: str, months: List[str]):
+        """Coloca la imagen ya rasterizada (hilo de Tk)"""
+        self._heatmap_photo = tk.PhotoImage(data=png_base64)
+        self.heatmap_canvas.delete('all')
+        self.heatmap_canvas.create_image(0, 18, anchor='nw', image=self._heatmap_photo)
+        step = self.heatmap.tile_width + self.heatmap.TILE_GAP
+        for i, month in enumerate(months):
+            self.heatmap_canvas.create_text(i * step, 8, anchor='w', text=month[2:],
+                                           font=('Helvetica Neue', 8),
+                                           fill=self.colors['text_muted'])
+        
     # === HERRAMIENTAS ===
     
     def open_focus_sound(self):
         """Abre sonido de focus"""
-        webbrowser.open("https://www.youtube.com/results?search_query=brown+noise+focus+adhd")
+        self.async_bridge.run_io(webbrowser.open, "https://www.youtube.com/results?search_query=brown+noise+focus+adhd")
         
     def breathing_exercise(self):
         """Ejercicio de respiración rápido"""
@@ -1345,7 +5702,7 @@ class StudyFlowV2:
                               "Pero probablemente querrás seguir.")
         
     def open_noise_generator(self):
-        webbrowser.open("https://mynoise.net/NoiseMachines/cafeRestaurantNoiseGenerator.php")
+        self.async_bridge.run_io(webbrowser.open, "https://mynoise.net/NoiseMachines/cafeRestaurantNoiseGenerator.php")
         
     def breathing_guide(self):
         self.breathing_exercise()
@@ -1361,7 +5718,7 @@ class StudyFlowV2:
         
     def sleep_calculator(self):
         """Calcula hora de dormir/despertar óptima"""
-        now = datetime.now()
+        now = self.clock.now()
         # Ciclos de 90 min, tiempo de quedarse dormido: 15 min
         cycles = [4, 5, 6]  # 6h, 7.5h, 9h
         msg = "Si te duermes AHORA, despierta a las:\n\n"
@@ -1371,24 +5728,86 @@ class StudyFlowV2:
         messagebox.showinfo("Calculador de Sueño", msg)
         
     def energy_analyzer(self):
-        """Analiza patrones de energía"""
-        if len(self.sessions_history) < 3:
+        """Analiza patrones de energía (el cálculo corre en el motor de análisis)"""
+        if self.total_sessions() < 3:
             messagebox.showinfo("Análisis", "Necesitas al menos 3 sesiones para analizar patrones.")
             return
             
-        energy_counts = {}
-        for s in self.sessions_history:
-            e = s['energy_level']
-            energy_counts[e] = energy_counts.get(e, 0) + 1
+        def show(result: Dict):
+            energy = result.get('energy', {})
+            if not energy:
+                return
+            most_common = max(energy, key=lambda level: energy[level][0])
+            peak = max(n for n, _, _ in energy.values())
+            msg = f"Tu nivel de energía más frecuente: {most_common.upper()}\n\n"
+            msg += "Distribución:\n"
+            for level, (count, quality_sum, _) in sorted(energy.items()):
+                bar = "█" * max(1, count * 30 // peak)
+                msg += f"{level:8} {bar} ({count}) • calidad {quality_sum / count:.2f}\n"
+            messagebox.showinfo("Análisis de Energía", msg)
             
-        most_common = max(energy_counts, key=energy_counts.get)
-        msg = f"Tu nivel de energía más frecuente: {most_common.upper()}\n\n"
-        msg += "Distribución:\n"
-        for level, count in sorted(energy_counts.items()):
-            bar = "█" * count
-            msg += f"{level:8} {bar} ({count})\n"
+        self.run_analytics(on_done=show)
+        
+    def run_analytics(self, on_done: Callable[[Dict], None],
+                      on_partial: Optional[Callable[[Dict, int, int], None]] = None):
+        """Lanza el análisis del historial completo fuera del hilo de Tk"""
+        on_partial = on_partial or (lambda acc, done, total: None)
+        if self.analytics_engine.attach(self.data_version, on_partial, on_done):
+            return   # En caché o ya en marcha: no hace falta rehacer las filas
+        rows = [_session_row(s) for s in self.sessions_history]
+        done_dates = [t['done_at'] for t in self.tasks if t.get('done_at') and not t.get('deleted')]
+        self.analytics_engine.run(self.data_version, rows, done_dates, on_partial, on_done,
+                                  records_path=self.session_archive.records.path,
+                                  record_count=len(self.session_archive.records))
+        
+    def open_deep_analytics(self):
+        """Ventana de análisis profundo con resultados en streaming"""
+        popup = tk.Toplevel(self.root)
+        popup.title("Análisis Profundo")
+        popup.geometry("720x560")
+        popup.configure(bg=self.colors['bg_secondary'])
+        
+        status = tk.Label(popup, text="⏳ Analizando historial...",
+                         font=('Helvetica Neue', 11),
+                         fg=self.colors['accent_primary'],
+                         bg=self.colors['bg_secondary'])
+        status.pack(anchor=tk.W, padx=15, pady=10)
+        
+        report = scrolledtext.ScrolledText(popup,
+                                           font=('JetBrains Mono', 10),
+                                           bg=self.colors['bg_card'],
+                                           fg=self.colors['text_secondary'],
+                                           relief=tk.FLAT,
+                                           padx=10, pady=10)
+        report.pack(fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
+        
+        def show(result: Dict, label: str):
+            if not popup.winfo_exists():
+                return
+            status.config(text=label)
+            report.delete(1.0, tk.END)
+            report.insert(tk.END, AnalyticsEngine.format_report(result))
             
-        messagebox.showinfo("Análisis de Energía", msg)
+        self.run_analytics(
+            on_partial=lambda acc, done, total: show(acc, f"⏳ Parcial: {done}/{total} bloques"),
+            on_done=lambda result: show(result, "✅ Análisis completo")
+        )
+        
+    def show_diagnostics(self):
+        """Muestra las mismas métricas que sirve el exportador"""
+        msg = ""
+        for name, labels, value in self.collect_metrics():
+            label_str = ','.join(v for _, v in labels)
+            short = name.replace('studyflow_', '')
+            msg += f"{short}{f' [{label_str}]' if label_str else ''}: {value}\n"
+        timer = TimerTelemetry.aggregate([s.get('timing') for s in self.sessions_history[-50:]])
+        if timer:
+            msg += (f"\nTimer ({timer['sessions']} sesiones recientes): deriva media {timer['drift_mean']:+.2f}s, "
+                    f"máx {timer['drift_max']:+.2f}s • pared vs. monotónico {timer['wall_vs_mono_max']:.2f}s • "
+                    f"tick más tardío {timer['tick_late_max']:.3f}s • {timer['late_ui']} repintados tarde\n")
+        if self.metrics_exporter:
+            msg += f"\nExportando en http://{self.metrics_exporter.host}:{self.metrics_exporter.port}/metrics"
+        messagebox.showinfo("Diagnóstico", msg)
         
     def show_achievements(self):
         """Muestra logros desbloqueados"""
@@ -1400,81 +5819,769 @@ class StudyFlowV2:
         messagebox.showinfo("Tus Logros", msg)
         
     def export_report(self):
-        """Exporta reporte semanal"""
-        filename = f"studyflow_report_{datetime.now().strftime('%Y%m%d')}.txt"
-        with open(filename, 'w') as f:
-            f.write("STUDYFLOW TDAH v2.1 - REPORTE SEMANAL\n")
-            f.write("=" * 50 + "\n\n")
-            
-            stats = self.reward_system.get_stats()
-            f.write(f"Total sesiones: {stats['sessions']}\n")
-            f.write(f"Horas de focus: {stats['total_hours']}\n")
-            f.write(f"Mejor racha: {stats['best_streak']}\n")
-            f.write(f"Racha actual: {stats['current_streak']}\n\n")
-            
-            f.write("DETALLE DE SESIONES:\n")
-            for s in self.sessions_history:
-                date = datetime.fromisoformat(s['timestamp']).strftime("%Y-%m-%d %H:%M")
-                f.write(f"{date} | {s['duration']}min | {s['task'][:40]} | {s['energy_level']}\n")
+        """Exporta reporte semanal (la foto se toma aquí; el escaneo y la escritura, en el hilo de E/S)"""
+        filename = f"studyflow_report_{self.clock.now().strftime('%Y%m%d')}.txt"
+        lines = ["STUDYFLOW TDAH v2.1 - REPORTE SEMANAL", "=" * 50, ""]
+        
+        stats = self.reward_system.get_stats()
+        lines.append(f"Total sesiones: {stats['sessions']}")
+        lines.append(f"Horas de focus: {stats['total_hours']}")
+        lines.append(f"Mejor racha: {stats['best_streak']} días")
+        lines.append(f"Racha actual: {stats['current_streak']} días")
+        lines.append("")
+        
+        lines.append("ÚLTIMOS 7 DÍAS:")
+        today = self.clock.today()
+        for offset in range(6, -1, -1):
+            day = today - timedelta(days=offset)
+            lines.append(f"{day.isoformat()} | {self.day_index.sessions_on(day)} sesiones | "
+                         f"{self.day_index.minutes_on(day)} min")
+        lines.append("")
+        lines.append("DETALLE DE SESIONES:")
+        
+        # Hasta dónde llega el binario ahora: un spill posterior no duplica lo que ya está en recent
+        records = self.session_archive.records
+        records_path, archived, labels = records.path, len(records), list(records.labels)
+        recent = [(s['timestamp'], s['duration'], s['task'], s['energy_level']) for s in self.sessions_history]
+        
+        def write():
+            codes = list(TaskEnergyMatcher.ENERGY_LEVELS)
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+                for ts, duration, _, _, energy, task_id in SessionRecordFile.scan(records_path, 0, archived):
+                    when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+                    task = labels[task_id] if task_id < len(labels) else "General"
+                    f.write(f"{when} | {duration}min | {task[:40]} | {codes[energy]}\n")
+                for timestamp, duration, task, energy in recent:
+                    when = datetime.fromisoformat(timestamp).strftime("%Y-%m-%d %H:%M")
+                    f.write(f"{when} | {duration}min | {task[:40]} | {energy}\n")
+                    
+        def done(_):
+            self.footer_status.config(text=f"📄 Reporte guardado: {filename}")
+            messagebox.showinfo("Exportado", f"Reporte guardado: {filename}")
+            
+        self.footer_status.config(text="📄 Exportando reporte...")
+        self.async_bridge.run_io(write, on_done=done,
+                                 on_error=lambda e: messagebox.showerror("Exportar", f"No se pudo guardar: {e}"))
+        
+    def build_dashboard(self, on_done: Optional[Callable[[Dict], None]] = None, full: bool = False):
+        """Panel HTML en el hilo de E/S (la foto de la ventana reciente se toma aquí)"""
+        records = self.session_archive.records
+        self.async_bridge.run_io(self.dashboard.build, len(records), list(records.labels),
+                                 DashboardBuilder.recent_rows(self.sessions_history), self.clock.now(), full,
+                                 on_done=on_done,
+                                 on_error=lambda e: print(f"Error generando el panel: {e}"))
+        
+    def export_dashboard(self):
+        """Genera (o pone al día) el panel y lo abre en el navegador"""
+        def done(result: Dict):
+            self.footer_status.config(
+                text=f"🌐 Panel: {result['written']} de {result['weeks']} semanas reescritas "
+                     f"en {result['seconds']:.2f}s")
+            self.async_bridge.run_io(webbrowser.open, 'file://' + os.path.abspath(self.dashboard.index_path))
+            
+        self.footer_status.config(text="🌐 Generando panel...")
+        self.build_dashboard(done)
+        
+    def refresh_dashboard(self):
+        """Tras un cambio de sesiones: solo si el panel ya se generó alguna vez"""
+        if os.path.exists(self.dashboard.index_path):
+            self.build_dashboard()
+            
+    # === SINCRONIZACIÓN ===
+    
+    def touch_record(self, kind: str, record: Dict):
+        """Registra un cambio local para el próximo intercambio delta"""
+        self.data_version += 1
+        self.sync_engine.stamp(kind, record)
+        self.request_sync()
+        
+    def lookup_record(self, kind: str, uid: str) -> Optional[Dict]:
+        if kind == 'task':
+            return self._tasks_by_uid.get(uid)
+        if uid in self._session_tombstones:   # Una sesión deshecha viaja como lápida
+            return self._session_tombstones[uid]
+        if uid in self._session_uids:
+            # Las sesiones pendientes son casi siempre las últimas
+            for session in reversed(self.sessions_history):
+                if session.get('uid') == uid:
+                    return session
+        return self.session_archive.find(uid)
+        
+    def request_sync(self):
+        """Agrupa cambios seguidos en un solo intercambio"""
+        if self.sync_client and not self._sync_scheduled:
+            self._sync_scheduled = True
+            self.root.after(1500, self.run_sync)
+            
+    def periodic_sync(self):
+        """Trae cambios de otros dispositivos aunque aquí no haya ediciones"""
+        self.request_sync()
+        self.root.after(30000, self.periodic_sync)
+        
+    def run_sync(self):
+        self._sync_scheduled = False
+        if self._sync_in_flight:
+            self.request_sync()
+            return
+        self._sync_in_flight = True
+        payload = self.sync_engine.build_push(self.lookup_record)
+        self.sync_client.exchange_async(
+            payload,
+            lambda result, error: self.post_to_ui(self.on_sync_result, payload['changes'], result, error)
+        )
+        
+    def on_sync_result(self, pushed: List[Dict], result: Optional[Dict], error: Optional[Exception]):
+        """Aplica la respuesta del servidor (hilo de Tk)"""
+        self._sync_in_flight = False
+        if error:
+            self.footer_status.config(text=f"🔴 Sync sin conexión: {error}")
+            return
+        self.sync_engine.acknowledge(pushed)
+        applied = self.apply_remote_changes(result.get('changes', []))
+        if applied:
+            self.footer_status.config(text="🔄 Cambios sincronizados desde otro dispositivo")
+        if pushed or applied:
+            self.save_data()
+        if self.sync_engine.pending:
+            self.request_sync()
+            
+    def merge_record(self, kind: str, record: Dict) -> bool:
+        """Fusiona un registro ajeno por uid; True si cambió algo local"""
+        uid = record['uid']
+        if kind == 'task':
+            local = self._tasks_by_uid.get(uid)
+            if local is None:
+                self.tasks.append(record)
+                self._tasks_by_uid[uid] = record
+            elif SyncEngine.wins(record, local):
+                local.clear()  # Mantener la identidad (current_task apunta aquí)
+                local.update(record)
+                self.sync_engine.discard_pending('task', uid)
+            else:
+                return False
+            if record.get('deleted'):
+                self.task_index.remove(uid)
+            else:
+                self.task_index.add(uid, record['text'])
+            self.reminders.update(self._tasks_by_uid[uid])
+            self.task_changed(self._tasks_by_uid[uid])
+            self.data_version += 1
+            return True
+        
+        # Sesiones: solo se añaden o se borran (lápida 'deleted' al deshacer)
+        tombstone = self._session_tombstones.get(uid)
+        if record.get('deleted'):
+            if tombstone is not None and not SyncEngine.wins(record, tombstone):
+                return False
+            local = self._recent_session(uid)
+            if local is not None and not SyncEngine.wins(record, local):
+                return False
+            self._session_tombstones[uid] = record
+            # Lo ya archivado no se reescribe: la lápida solo evita que vuelva
+            if local is None:
+                return False
+            self._remove_session(local)
+            self.data_version += 1
+            return True
+        if tombstone is not None:
+            if not SyncEngine.wins(record, tombstone):
+                return False
+            del self._session_tombstones[uid]
+        if self.has_session(uid):
+            return False
+        self._insert_session(record)
+        self.data_version += 1
+        return True
+        
+    def _insert_session(self, session: Dict):
+        bisect.insort(self.sessions_history, session, key=lambda s: s['timestamp'])
+        self._session_uids.add(session['uid'])
+        self.day_index.add(session)
+        self.heatmap.add_session(session)
+        self.task_tree.add_session(session)
+        self.reward_system.session_count += 1
+        self.reward_system.total_focus_minutes += session.get('duration', 0)
+        
+    def _remove_session(self, session: Dict):
+        self.sessions_history.remove(session)
+        self._session_uids.discard(session['uid'])
+        self.day_index.remove(session)
+        self.heatmap.remove_session(session)
+        self.task_tree.add_session(session, -1)
+        self.reward_system.session_count -= 1
+        self.reward_system.total_focus_minutes -= session.get('duration', 0)
+        
+    def _recent_session(self, uid: str) -> Optional[Dict]:
+        """Sesión de la ventana en RAM (buscando desde el final: suele ser reciente)"""
+        if uid not in self._session_uids:
+            return None
+        return next((s for s in reversed(self.sessions_history) if s['uid'] == uid), None)
+        
+    def apply_remote_changes(self, changes: List[Dict]) -> bool:
+        """Merge determinista: O(delta) gracias a los índices por uid"""
+        tasks_changed = False
+        sessions_added = False
+        for change in changes:
+            if self.sync_engine.observe(change) and self.merge_record(change['kind'], change['record']):
+                if change['kind'] == 'task':
+                    tasks_changed = True
+                else:
+                    sessions_added = True
                 
-        messagebox.showinfo("Exportado", f"Reporte guardado: {filename}")
+        if tasks_changed:
+            self.render_tasks()
+        if sessions_added:
+            self.update_stats()
+        return tasks_changed or sessions_added
+        
+    # === VARIAS INSTANCIAS ===
+    
+    def watch_data_file(self):
+        """Polling por stat (inotify no está en la stdlib y esto cuesta ~µs)"""
+        if DataFileLock.signature(self.data_file) != self._data_file_sig:
+            try:
+                with DataFileLock(self.data_file, shared=True):
+                    tasks_changed, sessions_added = self.merge_from_disk()
+                if tasks_changed:
+                    self.render_tasks()
+                if sessions_added:
+                    self.update_stats()
+                if tasks_changed or sessions_added:
+                    self.footer_status.config(text="🔄 Cambios de otra ventana incorporados")
+            except Exception as e:
+                print(f"Error recargando: {e}")
+        self.root.after(2000, self.watch_data_file)
+        
+    def merge_from_disk(self) -> tuple:
+        """
+        Incorpora lo que otra instancia escribió, registro a registro.
+        Solo toca los registros con uid nuevo o revisión mayor; el llamador
+        decide qué re-renderizar. Requiere tener el lock tomado.
+        """
+        sig = DataFileLock.signature(self.data_file)
+        if sig is None:
+            return False, False
+        # Tolerante sin cuarentena: lo inválido se queda en disco, no se importa
+        data = SnapshotFile.load(self.data_file, [])
+        self._data_file_sig = sig
+        self.data_file_bytes = sig[2]
+        self.session_archive.refresh()  # La otra instancia pudo archivar sesiones
+        
+        self.sync_engine.absorb_state(data.get('sync', {}))
+        tasks_changed = False
+        for task in data.get('tasks', []):
+            if 'uid' in task and self.merge_record('task', task):
+                tasks_changed = True
+        sessions_added = False
+        for session in data.get('sessions', []):
+            if 'uid' in session and self.merge_record('session', session):
+                sessions_added = True
+        
+        rs = data.get('reward_stats', {})
+        self.reward_system.best_streak = max(self.reward_system.best_streak, rs.get('best_streak', 0))
+        self.reward_system.achievements_unlocked.update(rs.get('achievements', []))
+        return tasks_changed, sessions_added
+        
+    # === HISTORIAL (ventana en RAM + archivo) ===
+    
+    def open_store(self, data_file: str):
+        """Estado ligado a un fichero de datos, vacío (load_data lo rellena)"""
+        if self.device_lease is not None:
+            self.device_lease.release()
+        self.data_file = data_file
+        self.device_lease = DeviceLease(data_file)
+        self.legacy_data_file = self.sibling_path('.json')   # Formato anterior: se importa una vez
+        self.session_archive = SessionArchive(self.sibling_path('_archive.jsonl'))
+        self.backups = BackupStore(self.sibling_path('_backups'), self.clock)
+        self.event_log = EventLog(self.sibling_path('_events.jsonl'), self.clock)
+        self.reward_system = DopamineRewardSystem()
+        self.duration_model = DurationModel(TaskEnergyMatcher.default_durations())
+        self.energy_matcher.model = self.duration_model
+        self.tasks: List[Dict] = []
+        self.sessions_history: List[Dict] = []
+        self._session_tombstones: Dict[str, Dict] = {}   # Sesiones deshechas (viajan por sync)
+        self._tasks_by_uid: Dict[str, Dict] = {}
+        self._session_uids = set()
+        self.task_index = TaskSearchIndex()
+        self.task_tree = TaskTree()
+        self.task_order = TaskOrder()
+        self._gone_task_rows = set()   # Borradas desde el último render (sus filas sobran)
+        self.day_index = DaySessionIndex()
+        self.sync_engine = SyncEngine(device_id=self.device_lease.claim())
+        self.dashboard = DashboardBuilder(self.sibling_path('_dashboard'), self.session_archive.records.path)
+        self._data_file_sig: Optional[tuple] = None
+        self.data_file_bytes = 0
+        self.load_report = {'tasks': 0, 'sessions': 0, 'repaired': 0, 'quarantined': 0,
+                            'damaged': False, 'seconds': 0.0}
+        self.data_version += 1
+        
+    def sibling_path(self, suffix: str) -> str:
+        """Ruta de un fichero auxiliar junto al de datos"""
+        return os.path.splitext(self.data_file)[0] + suffix
+    
+    def has_session(self, uid: str) -> bool:
+        return uid in self._session_uids or self.session_archive.contains(uid)
+    
+    def iter_all_sessions(self):
+        """Todo el historial en orden: primero lo archivado (paginado desde disco)"""
+        yield from self.session_archive.iter_sessions()
+        yield from list(self.sessions_history)
+        
+    def total_sessions(self) -> int:
+        return self.session_archive.count + len(self.sessions_history)
+        
+    def spill_sessions(self):
+        """Manda al archivo lo que sobra de la ventana (por lotes, no en cada sesión)"""
+        excess = len(self.sessions_history) - self.RECENT_SESSIONS
+        if excess < self.SPILL_BATCH:
+            return
+        old = self.sessions_history[:excess]
+        self.session_archive.append(old)
+        del self.sessions_history[:excess]
+        for session in old:
+            self._session_uids.discard(session['uid'])
+        
+    # === PERFILES ===
+    
+    def ask_profile(self) -> Optional[Dict]:
+        """Selector del arranque en modo laboratorio: hasta elegir no se carga nada"""
+        picked = []
+        popup = self.open_profile_picker(picked.append)
+        self.root.wait_window(popup)
+        return picked[0] if picked else None
+    
+    def open_profile_picker(self, on_pick: Optional[Callable[[Dict], None]] = None):
+        """Lista de perfiles desde el índice (sin abrir ningún fichero de datos)"""
+        on_pick = on_pick or self.switch_profile
+        profiles = self.profiles.list()
+        popup = tk.Toplevel(self.root)
+        popup.title("¿Quién estudia?")
+        popup.geometry("460x480")
+        popup.configure(bg=self.colors['bg_secondary'])
+        
+        tk.Label(popup, text="👤 ¿Quién estudia hoy?",
+                font=('Helvetica Neue', 14, 'bold'),
+                fg=self.colors['text_primary'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W, padx=15, pady=(15, 5))
         
+        listbox = tk.Listbox(popup, font=('Helvetica Neue', 11),
+                            bg=self.colors['bg_card'],
+                            fg=self.colors['text_primary'],
+                            selectbackground=self.colors['accent_primary'],
+                            relief=tk.FLAT, activestyle='none')
+        listbox.pack(fill=tk.BOTH, expand=True, padx=15)
+        for profile in profiles:
+            last = profile.get('last_used', '')[:10] or "nuevo"
+            listbox.insert(tk.END, f"{profile['name']}  •  {profile.get('tasks_open', 0)} pendientes • "
+                                   f"{profile.get('sessions', 0)} sesiones • {last}")
+            
+        def pick(profile: Dict):
+            popup.destroy()
+            on_pick(profile)
+            
+        def enter(event=None):
+            selection = listbox.curselection()
+            if selection:
+                pick(profiles[selection[0]])
+                
+        def create(event=None):
+            try:
+                profile = self.profiles.create(name_entry.get())
+            except ValueError as e:
+                messagebox.showerror("Perfiles", f"No se pudo crear: {e}", parent=popup)
+                return
+            except OSError as e:
+                messagebox.showerror("Perfiles", f"Error guardando el perfil: {e}", parent=popup)
+                return
+            pick(profile)
+            
+        listbox.bind('<Double-Button-1>', enter)
+        listbox.bind('<Return>', enter)
+        tk.Button(popup, text="Entrar",
+                 font=('Helvetica Neue', 10, 'bold'),
+                 bg=self.colors['accent_primary'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=enter).pack(anchor=tk.E, padx=15, pady=5)
+        
+        new_row = tk.Frame(popup, bg=self.colors['bg_secondary'])
+        new_row.pack(fill=tk.X, padx=15, pady=(5, 15))
+        name_entry = tk.Entry(new_row, font=('Helvetica Neue', 11),
+                             bg=self.colors['bg_card'],
+                             fg=self.colors['text_primary'],
+                             insertbackground=self.colors['accent_primary'],
+                             relief=tk.FLAT)
+        name_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=4)
+        name_entry.bind('<Return>', create)
+        tk.Button(new_row, text="+ Nuevo perfil",
+                 font=('Helvetica Neue', 10),
+                 bg=self.colors['accent_success'],
+                 fg=self.colors['bg_primary'],
+                 cursor='hand2',
+                 command=create).pack(side=tk.LEFT, padx=(10, 0))
+        return popup
+    
+    def switch_profile(self, profile: Dict):
+        """Cambia de perfil sin reiniciar Tk: guarda, vacía el estado y carga el elegido"""
+        if self.profile and profile['id'] == self.profile['id']:
+            return
+        if self.timer_state != 'idle' or self._import_running:
+            messagebox.showwarning("Perfiles", "Termina la sesión (o la importación) antes de cambiar de perfil")
+            return
+        self.save_data()
+        self.update_profile_summary()
+        
+        # Vaciar lo que cuelga del perfil anterior (widgets, selección, avisos, mapa)
+        self.reminders.rebuild([])
+        for row, _ in self._task_rows.values():
+            row.destroy()
+        self._task_rows.clear()
+        self._visible_task_order = []
+        self._selected_tasks.clear()
+        self.set_subtask_parent(None)
+        self.current_task = None
+        self.current_task_label.config(text="Ninguna tarea seleccionada", fg=self.colors['text_secondary'])
+        self.heatmap.reset()
+        
+        self.profile = profile
+        self.open_store(self.profiles.data_file(profile['id']))
+        self.load_data()
+        self.render_tasks()
+        self.update_stats()
+        self.refresh_heatmap()
+        self.update_undo_buttons()
+        self.on_profile_loaded()
+        
+    def on_profile_loaded(self):
+        self.root.title(f"StudyFlow TDAH v2.1 - 👤 {self.profile['name']}")
+        self.profile_btn.config(text=f"👤 {self.profile['name']}")
+        self.footer_status.config(text=f"👤 Perfil: {self.profile['name']}")
+        self.update_profile_summary()
+        self.root.deiconify()
+        
+    def update_profile_summary(self):
+        """Último uso y resumen en el índice (lo que el selector muestra sin cargar)"""
+        if not self.profile:
+            return
+        pending = sum(1 for t in self.tasks if not t['done'] and not t.get('deleted'))
+        try:
+            self.profiles.update(self.profile['id'], last_used=self.clock.now().isoformat(timespec='seconds'),
+                                 tasks_open=pending, sessions=self.total_sessions())
+        except OSError as e:
+            print(f"Error actualizando el índice de perfiles: {e}")
+            
     # === UTILIDADES ===
     
     def apply_theme(self):
         """Aplica tema oscuro completo"""
         self.root.configure(bg=self.colors['bg_primary'])
         
+    def collect_metrics(self) -> List[tuple]:
+        """Foto de métricas (name, labels, value) - SOLO desde el hilo de Tk"""
+        samples = [
+            ('studyflow_sessions_completed_total', (), self.reward_system.session_count),
+            ('studyflow_focus_minutes_total', (), self.reward_system.total_focus_minutes),
+        ]
+        for level, count in sorted(self.distraction_events.items()):
+            samples.append(('studyflow_distraction_events_total', (('level', level),), count))
+        samples += [
+            ('studyflow_save_latency_seconds', (), round(self.last_save_latency, 6)),
+            ('studyflow_save_latency_seconds_max', (), round(self.max_save_latency, 6)),
+            ('studyflow_data_file_bytes', (), self.data_file_bytes),
+            ('studyflow_load_seconds', (), round(self.load_report['seconds'], 6)),
+            ('studyflow_load_repaired_records', (), self.load_report['repaired']),
+            ('studyflow_load_quarantined_records', (), self.load_report['quarantined']),
+            ('studyflow_reminders_pending', (), len(self.reminders)),
+            ('studyflow_timer_drift_seconds', (),
+             round(self.last_timing['mono'] - self.last_timing['planned'], 2) if self.last_timing else 0),
+            ('studyflow_timer_tick_late_seconds_max', (), self.last_timing.get('max_tick_late', 0)),
+            ('studyflow_timer_late_ui_updates', (), self.last_timing.get('late_ui', 0)),
+            ('studyflow_threads', (), threading.active_count()),
+            ('studyflow_event_loop_lag_seconds', (), round(self.loop_lag, 6)),
+            ('studyflow_event_loop_lag_seconds_max', (), round(self.max_loop_lag, 6)),
+        ]
+        for event_type, count in self.event_bus.published.items():
+            samples.append(('studyflow_bus_events_total', (('type', event_type),), count))
+        bus_stats = self.event_bus.stats()
+        samples += [('studyflow_bus_queue_depth', (('subscriber', s[0]),), s[1]) for s in bus_stats]
+        samples += [('studyflow_bus_dropped_total', (('subscriber', s[0]),), s[3]) for s in bus_stats]
+        samples += [('studyflow_bus_errors_total', (('subscriber', s[0]),), s[4]) for s in bus_stats]
+        return samples
+        
+    def publish_metrics(self):
+        """Publica la foto para el exportador cada segundo"""
+        if not self.metrics_exporter:
+            return
+        self.metrics_exporter.publish(self.collect_metrics())
+        self.max_loop_lag = 0.0
+        self.root.after(1000, self.publish_metrics)
+        
     def save_data(self):
-        """Persistencia de datos"""
-        data = {
-            'tasks': self.tasks,
-            'sessions': self.sessions_history,
+        """Persistencia de datos (lock entre procesos + escritura atómica)"""
+        tasks_changed, sessions_added = self.persist()
+        if tasks_changed:
+            self.render_tasks()
+        if sessions_added:
+            self.update_stats()
+            
+    def persist(self) -> tuple:
+        """Parte sin UI de save_data; (tareas cambiadas, sesiones añadidas) al fusionar"""
+        started = time.perf_counter()
+        merged = (False, False)
+        try:
+            with DataFileLock(self.data_file):
+                # Si otra ventana escribió desde nuestra última lectura, fusionar primero
+                if DataFileLock.signature(self.data_file) not in (None, self._data_file_sig):
+                    merged = self.merge_from_disk()
+                self.spill_sessions()
+                self._write_data_file()
+        except Exception as e:
+            print(f"Error guardando: {e}")
+        
+        self.last_save_latency = time.perf_counter() - started
+        self.max_save_latency = max(self.max_save_latency, self.last_save_latency)
+        return merged
+        
+    def _write_data_file(self):
+        """Instantánea comprimida a un temporal + rename: nunca queda a medias"""
+        SnapshotFile.write(self.data_file, self._snapshot_records())
+        self._data_file_sig = DataFileLock.signature(self.data_file)
+        self.data_file_bytes = self._data_file_sig[2]
+        
+    @staticmethod
+    def snapshot_meta(rewards: DopamineRewardSystem, energy: str, sync_engine: SyncEngine,
+                      day_index: DaySessionIndex, saved_at: datetime) -> Dict:
+        """Registro 'meta' de la instantánea (también lo escribe el simulador)"""
+        return {
             'reward_stats': {
-                'sessions': self.reward_system.session_count,
-                'minutes': self.reward_system.total_focus_minutes,
-                'best_streak': self.reward_system.best_streak,
-                'achievements': list(self.reward_system.achievements_unlocked)
+                'sessions': rewards.session_count,
+                'minutes': rewards.total_focus_minutes,
+                'best_streak': rewards.best_streak,
+                'achievements': list(rewards.achievements_unlocked)
             },
             'settings': {
-                'energy': self.energy_var.get()
+                'energy': energy
             },
-            'last_save': datetime.now().isoformat()
+            'sync': sync_engine.to_state(),
+            'day_index': day_index.to_state(),
+            'last_save': saved_at.isoformat()
         }
-        try:
-            with open('studyflow_v2_data.json', 'w') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            print(f"Error guardando: {e}")
+        
+    def _snapshot_records(self):
+        """Registros de la instantánea: primero 'meta', luego tareas y sesiones"""
+        meta = self.snapshot_meta(self.reward_system, self.energy_matcher.current_energy, self.sync_engine,
+                                  self.day_index, self.clock.now())
+        meta['duration_model'] = self.duration_model.to_state()
+        meta['task_tree'] = self.task_tree.to_state()
+        yield 'meta', meta
+        for task in self.tasks:
+            yield 'task', task
+        for session in self.sessions_history:
+            yield 'session', session
+        for tombstone in self._session_tombstones.values():
+            yield 'session', tombstone
+            
+    def backup_data(self):
+        """Punto de copia incremental (solo lo cambiado) en el hilo de E/S"""
+        # Rutas y store fijados ahora: un cambio de perfil no desvía la copia
+        self.async_bridge.run_io(self.take_backup, self.backups, self.data_file, self.session_archive.path,
+                                 on_error=lambda e: print(f"Error en copia de seguridad: {e}"))
+        
+    @staticmethod
+    def take_backup(backups: BackupStore, data_file: str, archive_path: str):
+        with DataFileLock(data_file):
+            backups.take(data_file, archive_path)
             
+    def read_data_file(self) -> Dict:
+        """
+        Lectura registro a registro que salva lo legible
+        Lo inválido va a la cuarentena (JSONL junto al fichero de datos) y, si
+        el fichero en sí está dañado, se copia aparte antes de que el próximo
+        guardado lo reescriba. Requiere tener el lock tomado.
+        """
+        started = time.perf_counter()
+        quarantine = []
+        data = SnapshotFile.load(self.data_file, quarantine)
+        damaged = any(entry['kind'] is None for entry in quarantine)
+        if quarantine:
+            stamp = self.clock.now().strftime('%Y%m%d_%H%M%S')
+            with open(self.sibling_path('_quarantine.jsonl'), 'a') as f:
+                for entry in quarantine:
+                    f.write(json.dumps({'at': stamp, **entry}, ensure_ascii=False) + '\n')
+            if damaged:
+                shutil.copy2(self.data_file, self.sibling_path(f'_damaged_{stamp}.sfs'))
+            print(f"Carga: {len(quarantine)} registros en cuarentena "
+                  f"({self.sibling_path('_quarantine.jsonl')})")
+        self.load_report = {
+            'tasks': len(data['tasks']),
+            'sessions': len(data['sessions']),
+            'repaired': data.pop('repaired'),
+            'quarantined': len(quarantine),
+            'damaged': damaged,
+            'seconds': time.perf_counter() - started,
+        }
+        return data
+        
     def load_data(self):
-        """Carga datos previos"""
-        if os.path.exists('studyflow_v2_data.json'):
+        """Carga datos previos (tolerante: salva lo legible y pone en cuarentena lo demás)"""
+        if not os.path.exists(self.data_file) and os.path.exists(self.legacy_data_file):
             try:
-                with open('studyflow_v2_data.json', 'r') as f:
-                    data = json.load(f)
-                    
-                self.tasks = data.get('tasks', [])
-                self.sessions_history = data.get('sessions', [])
-                
-                # Restaurar stats
-                rs = data.get('reward_stats', {})
-                self.reward_system.session_count = rs.get('sessions', 0)
-                self.reward_system.total_focus_minutes = rs.get('minutes', 0)
-                self.reward_system.best_streak = rs.get('best_streak', 0)
-                self.reward_system.achievements_unlocked = set(rs.get('achievements', []))
-                
-                # Restaurar settings
-                settings = data.get('settings', {})
-                if 'energy' in settings:
-                    self.energy_var.set(settings['energy'])
-                    self.on_energy_change()
-                    
-                self.render_tasks()
-                self.update_stats()
-                
+                with DataFileLock(self.data_file):
+                    if not os.path.exists(self.data_file):
+                        # Tolerante: el JSON antiguo se conserva tal cual como copia
+                        damaged = []
+                        SnapshotFile.migrate(self.legacy_data_file, self.data_file, damaged=damaged)
+                        for reason, raw in damaged:
+                            print(f"Importando {self.legacy_data_file}: {reason} {raw[:80]}")
             except Exception as e:
-                print(f"Error cargando: {e}")
+                print(f"Error importando {self.legacy_data_file}: {e}")
+        if not os.path.exists(self.data_file):
+            return
+        try:
+            with DataFileLock(self.data_file, shared=True):
+                self._data_file_sig = DataFileLock.signature(self.data_file)
+                data = self.read_data_file()
+            self.data_file_bytes = self._data_file_sig[2]
+        except Exception as e:
+            print(f"Error cargando: {e}")
+            return
+            
+        self.tasks = data['tasks']
+        self.sessions_history = [s for s in data['sessions'] if not s.get('deleted')]
+        self._session_tombstones = {s['uid']: s for s in data['sessions']
+                                    if s.get('deleted') and 'uid' in s}
+        
+        # Índices por uid (los datos antiguos o reparados reciben uid aquí)
+        try:
+            self.sync_engine = SyncEngine(data.get('sync'), self.device_lease.device_id)
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"Error en estado de sync (se empieza de cero): {e}")
+        tasks = []
+        for task in self.tasks:
+            if 'uid' not in task:
+                self.sync_engine.stamp('task', task)
+            if task['uid'] in self._tasks_by_uid:
+                continue  # Duplicada (p. ej. fusión interrumpida): gana la primera
+            tasks.append(task)
+            self._tasks_by_uid[task['uid']] = task
+            if not task.get('deleted'):
+                self.task_index.add(task['uid'], task['text'])
+        self.tasks = tasks
+        for session in self.sessions_history:
+            if 'uid' not in session:
+                self.sync_engine.stamp('session', session)
+        # Si se cerró entre archivar y guardar, la sesión está en los dos sitios
+        self.sessions_history = [s for s in self.sessions_history
+                                 if not self.session_archive.contains(s['uid'])]
+        self._session_uids = {s['uid'] for s in self.sessions_history}
+        
+        # Proyectos: el árbol se deduce de las tareas; el foco propio de cada una viene
+        # guardado (sin él solo se recuenta la ventana reciente)
+        focus = data.get('task_tree')
+        try:
+            self.task_tree.rebuild(self.tasks, focus if isinstance(focus, dict) else None)
+        except (TypeError, ValueError) as e:
+            print(f"Error en task_tree (se recuenta la ventana reciente): {e}")
+            focus = None
+        if not isinstance(focus, dict):
+            self.task_tree.rebuild(self.tasks)
+            for session in self.sessions_history:
+                self.task_tree.add_session(session)
+        self.task_order.invalidate()
+            
+        # Índice por día: persistido; solo se reconstruye en datos antiguos o dañados
+        rebuild_days = True
+        if 'day_index' in data:
+            try:
+                self.day_index = DaySessionIndex(data['day_index'])
+                rebuild_days = False
+            except (TypeError, ValueError, AttributeError) as e:
+                print(f"Error en day_index (se reconstruye): {e}")
+        # Modelo de duraciones: persistido; sin él se aprende una vez de todo el historial
+        rebuild_model = True
+        if isinstance(data.get('duration_model'), dict):
+            try:
+                self.duration_model = DurationModel(TaskEnergyMatcher.default_durations(),
+                                                    data['duration_model'])
+                self.energy_matcher.model = self.duration_model
+                rebuild_model = False
+            except (TypeError, ValueError, AttributeError, IndexError, KeyError) as e:
+                print(f"Error en duration_model (se reconstruye): {e}")
+        try:
+            # Lo archivado se recorre sobre el registro binario, sin dicts
+            codes = list(TaskEnergyMatcher.ENERGY_LEVELS)
+            for ts, duration, pauses, quality, energy, _ in SessionRecordFile.scan(self.session_archive.records.path):
+                when = datetime.fromtimestamp(ts)
+                self.heatmap.add(when, duration, codes[energy])
+                if rebuild_days:
+                    self.day_index.add_minutes(when.date(), duration)
+                if rebuild_model:
+                    self.duration_model.update(codes[energy], when.hour, duration, quality, pauses)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Error leyendo el archivo binario: {e}")
+        for session in self.sessions_history:
+            self.heatmap.add_session(session)
+            if rebuild_days:
+                self.day_index.add(session)
+            if rebuild_model:
+                try:
+                    self.duration_model.update(session.get('energy_level'),
+                                               datetime.fromisoformat(session['timestamp']).hour,
+                                               session.get('duration', 0), session.get('quality', 1.0),
+                                               session.get('pauses', 0))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        
+        # Restaurar stats (un valor con tipo incorrecto vale como ausente)
+        rs = data.get('reward_stats')
+        rs = rs if isinstance(rs, dict) else {}
+        number = lambda key: rs[key] if type(rs.get(key)) in (int, float) else 0
+        self.reward_system.session_count = number('sessions')
+        self.reward_system.total_focus_minutes = number('minutes')
+        # Sin day_index la racha guardada contaba sesiones, no días: se recalcula
+        self.reward_system.best_streak = number('best_streak') if not rebuild_days else 0
+        achievements = rs.get('achievements')
+        self.reward_system.achievements_unlocked = set(
+            a for a in achievements if isinstance(a, int) and not isinstance(a, bool)
+        ) if isinstance(achievements, list) else set()   # Logros = nº de sesión alcanzado
+        
+        # Avisos: un solo heap para todas las tareas; lo ya avisado lo anota cada tarea
+        reminders = data.get('reminders')   # Marca global de versiones anteriores
+        delivered = reminders.get('delivered') if isinstance(reminders, dict) else None
+        if type(delivered) in (int, float):
+            ReminderScheduler.migrate_delivered(self.tasks, delivered)
+        self.reminders.rebuild(self.tasks)
+        
+        # Restaurar settings
+        settings = data.get('settings')
+        if isinstance(settings, dict) and settings.get('energy') in TaskEnergyMatcher.ENERGY_LEVELS:
+            self.energy_var.set(settings['energy'])
+            self._energy_level = settings['energy']   # Restaurar no es un evento deshacible
+            self.on_energy_change()
+            
+        self.render_tasks()
+        self.update_stats()
+        report = self.load_report
+        if report['quarantined'] or report['repaired']:
+            self.footer_status.config(
+                text=f"⚠️ Datos recuperados: {report['tasks']} tareas, {report['sessions']} sesiones • "
+                     f"{report['repaired']} reparados • {report['quarantined']} en cuarentena")
+            
+    def on_close(self):
+        """Cierre ordenado: parar hilos y procesos de fondo"""
+        if self.focus_guardian:
+            self.focus_guardian.stop_monitoring()
+        self.update_profile_summary()
+        self.reminders.stop()
+        self.event_bus.shutdown()
+        self.async_bridge.shutdown()
+        self.device_lease.release()
+        self.analytics_engine.shutdown()
+        self.heatmap.shutdown()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        self.root.destroy()
         
     def run(self):
         """Inicia la aplicación"""
@@ -1482,8 +6589,90 @@ class StudyFlowV2:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="StudyFlow TDAH")
+    parser.add_argument('--sync-server', action='store_true',
+                        help="Ejecuta solo el servidor de sincronización")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--sync-log', default='studyflow_sync_log.jsonl',
+                        help="Log persistente del servidor de sincronización")
+    parser.add_argument('--convert-sessions', metavar='JSON',
+                        help="Convierte las sesiones de un JSON/JSONL al registro binario")
+    parser.add_argument('--migrate-data', metavar='FILE',
+                        help="Actualiza un fichero de datos (JSON antiguo o instantánea) al formato actual")
+    parser.add_argument('--codec', choices=SnapshotFile.CODECS, default='zlib',
+                        help="Compresión de --migrate-data")
+    parser.add_argument('--list-backups', action='store_true',
+                        help="Lista las copias de seguridad incrementales")
+    parser.add_argument('--restore-backup', type=int, metavar='SEQ',
+                        help="Restaura los datos a la copia SEQ (con la app cerrada)")
+    parser.add_argument('--profiles', metavar='DIR',
+                        help="Modo laboratorio: un perfil por estudiante en DIR")
+    parser.add_argument('--profile', metavar='ID',
+                        help="Perfil de --list-backups / --restore-backup en modo laboratorio")
+    parser.add_argument('--simulate', type=int, metavar='DAYS',
+                        help="Simula DAYS días de uso acelerado y mide carga y análisis")
+    parser.add_argument('--seed', type=int, default=0, help="Semilla de --simulate")
+    parser.add_argument('--out', help="Destino de --convert-sessions / --migrate-data / --simulate")
+    parser.add_argument('--bench-archive', type=int, metavar='N', nargs='?', const=100000,
+                        help="Compara la velocidad de escaneo JSON vs. binario con N sesiones")
+    args = parser.parse_args()
+    
+    if args.sync_server:
+        SyncServer(args.port, args.host, args.sync_log).serve_forever()
+        return
+    if args.convert_sessions:
+        out = args.out or 'studyflow_v2_sessions.bin'
+        count = SessionRecordFile.convert_json(args.convert_sessions, out)
+        print(f"{count} sesiones convertidas a {out}")
+        return
+    if args.migrate_data:
+        out = args.out or 'studyflow_v2_data.sfs'
+        count, codec = SnapshotFile.migrate(args.migrate_data, out, args.codec)
+        print(f"{count} registros escritos en {out} (esquema {SnapshotFile.SCHEMA}, {codec})")
+        return
+    profiles = ProfileStore(args.profiles) if args.profiles else ProfileStore.from_env()
+    if args.list_backups or args.restore_backup is not None:
+        data_file = 'studyflow_v2_data.sfs'
+        if profiles:
+            ids = [p['id'] for p in profiles.list()]
+            if args.profile not in ids:
+                print(f"Error: indica un perfil con --profile ({', '.join(ids) or 'no hay perfiles'})")
+                return
+            data_file = profiles.data_file(args.profile)
+        elif args.profile:
+            print("Error: --profile necesita --profiles o STUDYFLOW_PROFILES_DIR")
+            return
+        stem = os.path.splitext(data_file)[0]
+        backups = BackupStore(stem + '_backups')
+        if args.list_backups:
+            for e in backups.entries():
+                print(f"{e['seq']:6d}  {e['kind']:5}  {e['created']}  {e['bytes']:>9} B  base {e['base']}")
+            return
+        with DataFileLock(data_file):
+            print(backups.restore(args.restore_backup, data_file, stem + '_archive.jsonl'))
+        return
+    if args.bench_archive:
+        print(SessionRecordFile.benchmark(args.bench_archive))
+        return
+    if args.simulate:
+        out = args.out or 'studyflow_sim'
+        os.makedirs(out, exist_ok=True)
+        start = datetime.combine(date.today() - timedelta(days=args.simulate), datetime.min.time())
+        data_file = TimeWarpSimulator.data_file_in(out)
+        if os.path.exists(data_file):
+            print(f"Error: {data_file} ya existe (usa otro --out)")
+            return
+        simulator = TimeWarpSimulator(out, args.seed, start + timedelta(hours=6))
+        try:
+            print(simulator.run(args.simulate))
+            print(simulator.stress())
+        finally:
+            simulator.app.close_headless()
+        return
+        
     root = tk.Tk()
-    app = StudyFlowV2(root)
+    app = StudyFlowV2(root, profiles=profiles)
     app.run()
 
 